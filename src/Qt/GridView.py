@@ -1,9 +1,13 @@
+from contextlib import contextmanager
 from typing import Union
 
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QStandardItemModel, QDropEvent, QResizeEvent
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QStandardItemModel, QDropEvent, QResizeEvent, QShowEvent
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QTableView, QHeaderView, QAbstractItemView
 
+from src import gvars
+from src.Qt.lazy import LazyCell, PixmapBudget
+
 
 # Container Class
 
@@ -45,18 +49,23 @@ class CellContainer(QWidget):
 
 class GridView(QTableView):
     """
-    A GridView for showing clickable widgets
+    A GridView for showing clickable widgets. Widgets that are LazyCells only load their image while they are in or
+    near the viewport
     """
 
     def __init__(self, max_cols: int,
                  cell_height: int = 100, cell_width: int = 100,
-                 allow_move: bool = True):
+                 allow_move: bool = True,
+                 prefetch_rows: int = gvars.GRID_PREFETCH_ROWS,
+                 pixmap_budget: int = gvars.GRID_PIXMAP_BUDGET_BYTES):
         """
         Instantiates a GridView object
         :param max_cols: Maximum number of columns to show in the gridview
         :param cell_height: The height of each cell in pixels
         :param cell_width: The width of each cell in pixels
         :param allow_move: Allow the user to drag and drop widgets to move them
+        :param prefetch_rows: Rows above and below the viewport whose images are loaded ahead of scrolling
+        :param pixmap_budget: Bytes of loaded images allowed before images of off-screen cells are released
         """
         super().__init__()
 
@@ -64,6 +73,12 @@ class GridView(QTableView):
         self.cell_width = cell_width
         self.cell_height = cell_height
         self.max_cols = max_cols
+        self._count: int = 0  # Number of widgets in the grid
+        self._pending: Union[list[QWidget], None] = None  # The widgets while in bulk update mode, None otherwise
+        self._update_depth: int = 0  # Number of begin_update calls without a matching end_update
+        self.prefetch_rows: int = prefetch_rows
+        self.pixmaps: PixmapBudget = PixmapBudget(pixmap_budget)
+        self._load_queued: bool = False  # Whether a __load_visible call is already queued
 
         # Set properties for Headers
         self.verticalHeader().hide()
@@ -90,6 +105,7 @@ class GridView(QTableView):
         self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
         self.setAutoScroll(True)
         self.setAutoScrollMargin(50)
+        self.verticalScrollBar().valueChanged.connect(self.__queue_load)
 
         # Final Adjustments
         self.__add_containers()  # Ensuring that all spots on grid have a container
@@ -104,12 +120,17 @@ class GridView(QTableView):
         :param widget: The widget to append
         :return: None
         """
+        if self._pending is not None:
+            self._pending.append(widget)  # Placed when end_update is called
+            return
         count: int = self.count()
         if self.cols() == 0: self.__append_col()  # Checks if there are no columns to prevent divide by zero exceptions
         if count % self.cols() == 0:  self.__append_row()  # Checks if the last row is full, then add row if needed
         self.set_at_idx(count, widget)  # Add Widget
+        self._count += 1
         self.__adjust_dim()  # Final Adjustments
         self.__set_widget_size()
+        self.__queue_load()
 
     def delete(self, idx: int):
         """
@@ -117,9 +138,13 @@ class GridView(QTableView):
         :param idx: The index to delete at
         :return: None
         """
+        if self._pending is not None:
+            if idx < len(self._pending): del self._pending[idx]
+            return
         count: int = self.count()
         elems = []
         if idx >= count: return  # If the input index is invalid, return
+        self.pixmaps.forget(self.get_at_idx(idx))  # The widget is deleted along with its container
         for i in range(idx + 1, count):  # Add all elements after the desired element to delete to list
             elems.append(self.get_at_idx(i))
         i = idx
@@ -127,39 +152,66 @@ class GridView(QTableView):
             self.set_at_idx(i, e)
         # Delete the last item in the list and replace with empty container
         self.setIndexWidget(self.model().index(self.get_row(count - 1), self.get_col(count - 1)), CellContainer())
+        self._count -= 1
         self.__adjust_dim()  # Final Adjustments
         self.__set_widget_size()
+        self.__queue_load()
 
     def count(self) -> int:
         """
         Counts the number of elements in the GridView
-
-        PLEASE NOTE This method DOES NOT RUN in constant time
-
         :return: The number of elements in the GridView
         """
-        i = 0
-        while True:  # Loop through grid until you hit a None object
-            if self.get_at_idx(i) is None:
-                return i
-            i += 1
+        return self._count if self._pending is None else len(self._pending)
 
     def set_contents(self, nc: list[QWidget]):
         """
-        Sets the contents of the list to a given list of widgets
+        Sets the contents of the list to a given list of widgets. Widgets that were in the GridView but aren't in the new
+        list are deleted
         :param nc: The list of widgets to set the contents to
         :return: None
         """
-        for i in range(self.count()):
-            self.delete(0)
-        for q in nc:
-            self.append(q)
+        with self.updating():
+            self._pending[:] = nc
+
+    def begin_update(self):
+        """
+        Starts bulk update mode. Until the matching end_update call, append, delete and move_widget only change a list,
+        and the grid is rebuilt once at the end. Calls can be nested
+        :return: None
+        """
+        if self._update_depth == 0: self._pending = self.get_widget_array()
+        self._update_depth += 1
+
+    def end_update(self):
+        """
+        Ends bulk update mode, placing every widget in the grid in a single pass
+        :return: None
+        """
+        self._update_depth -= 1
+        if self._update_depth > 0: return
+        widgets: list[QWidget] = self._pending
+        self._pending = None
+        self.__rebuild(widgets)
+
+    @contextmanager
+    def updating(self):
+        """
+        Context manager for bulk update mode: calls begin_update on entering and end_update on leaving
+        :return: The GridView
+        """
+        self.begin_update()
+        try:
+            yield self
+        finally:
+            self.end_update()
 
     def get_widget_array(self) -> list[QWidget]:
         """
         Gets a list of all widgets in the GridView in order
         :return: A list of all widgets in the GridView in order
         """
+        if self._pending is not None: return list(self._pending)
         lst = []
         for i in range(self.count()):
             lst.append(self.get_at_idx(i))
@@ -227,6 +279,7 @@ class GridView(QTableView):
         :param idx: The index
         :return: The Widget at the given index
         """
+        if self._pending is not None: return self._pending[idx] if idx < len(self._pending) else None
         return self.get_at_pos(self.get_row(idx), self.get_col(idx))
 
     def set_at_pos(self, row: int, col: int, widget: QWidget):
@@ -303,6 +356,9 @@ class GridView(QTableView):
         :param end: The end index
         :return: None
         """
+        if self._pending is not None:
+            self._pending.insert(end, self._pending.pop(start))
+            return
         if end > start:
             self.__move_after(start, end)
         elif start > end:
@@ -351,10 +407,16 @@ class GridView(QTableView):
         if self.get_at_idx(start) is None or self.get_at_idx(end) is None: return  # Check if user selected blank cell
         self.move_widget(start, end)  # Move accordingly
         self.__set_widget_size()  # Final Adjustments
+        self.__queue_load()
 
     def resizeEvent(self, event: QResizeEvent) -> None:
         super().resizeEvent(event)
         self.__set_widget_size()
+        self.__queue_load()
+
+    def showEvent(self, event: QShowEvent) -> None:
+        super().showEvent(event)
+        self.__queue_load()
 
     # Internal QoL methods
 
@@ -398,6 +460,60 @@ class GridView(QTableView):
             self.set_at_idx(i, elems[i])  # Replaces widgets in the order they were aleady there
         self.setFixedWidth(a_cols * self.cell_width + 4)  # Sets the width of the widget according to number of columns
 
+    def __rebuild(self, widgets: list[QWidget]):
+        """
+        Replaces the contents of the grid with a list of widgets in one pass: the rows and columns are sized once and
+        each widget is placed once. Widgets that were in the grid but aren't in the list are deleted
+        :param widgets: The widgets to place in the grid in order
+        :return: None
+        """
+        n: int = len(widgets)
+        cols: int = max(1, min(self.max_cols, n))
+        rows: int = (n + cols - 1) // cols
+        for w in widgets: w.setParent(None)  # Keeps the widgets alive when their old containers are replaced
+        self.model().setColumnCount(cols)
+        self.model().setRowCount(rows)
+        for i in range(rows * cols):
+            container: CellContainer = CellContainer()
+            if i < n: container.set(widgets[i])
+            self.setIndexWidget(self.model().index(i // cols, i % cols), container)
+        self._count = n
+        alive: set[QWidget] = set(widgets)
+        for w in self.pixmaps:
+            if w not in alive: self.pixmaps.forget(w)  # Deleted along with their old containers
+        self.setFixedWidth(cols * self.cell_width + 4)
+        self.__set_widget_size()
+        self.__queue_load()
+
+    def __queue_load(self):
+        """
+        Queues a __load_visible call for when control returns to the event loop, so that a burst of scroll and resize
+        events only causes one
+        :return: None
+        """
+        if self._load_queued: return
+        self._load_queued = True
+        QTimer.singleShot(0, self.__load_visible)
+
+    def __load_visible(self):
+        """
+        Loads the images of LazyCells in the rows in the viewport and the prefetch margin around it, then releases the
+        images of other cells if the loaded images are over budget
+        :return: None
+        """
+        self._load_queued = False
+        if self._pending is not None or self.cols() == 0: return  # Loaded again when bulk update mode ends
+        top: int = self.verticalScrollBar().value()
+        first: int = max(0, top // self.cell_height - self.prefetch_rows)
+        last: int = min(self.rows() - 1, (top + self.viewport().height()) // self.cell_height + self.prefetch_rows)
+        keep: set[QWidget] = set()
+        for i in range(first * self.cols(), min(self.count(), (last + 1) * self.cols())):
+            w: Union[QWidget, None] = self.get_at_idx(i)
+            if not isinstance(w, LazyCell): continue
+            self.pixmaps.loaded(w, w.load_image())
+            keep.add(w)
+        self.pixmaps.trim(keep, lambda cell: cell.release_image())
+
     def __set_widget_size(self):
         """
         Sets the size of the GridView widget according to whether there needs to be a scrollbar
@@ -427,6 +543,5 @@ def generate(widgets: list[QWidget], max_cols: int,
     :return: A GridView with the list of QWidgets and properties specified
     """
     gridview: GridView = GridView(max_cols, cell_height, cell_width, allow_move)
-    for w in widgets:
-        gridview.append(w)
+    gridview.set_contents(widgets)
     return gridview
@@ -0,0 +1,497 @@
+from typing import Union
+
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QPersistentModelIndex, QRect, QSize, QTimer, Signal
+from PySide6.QtGui import QColor, QDropEvent, QPainter, QPainterPath, QPixmap, QResizeEvent, QShowEvent
+from PySide6.QtWidgets import QListView, QStyledItemDelegate, QStyleOptionViewItem, QStyle, QAbstractItemView
+
+from src import gvars
+from src.Qt.imageloader import get_loader
+from src.Qt.lazy import PixmapBudget, pixmap_bytes
+
+
+ITEM_ROLE: int = Qt.UserRole  # Role that returns the GridItem itself
+
+
+# Item and Model Classes
+
+class GridItem:
+    """
+    An item in a VirtualGridView. Unlike the cells of GridView this isn't a widget, it only holds what is painted
+    """
+    def __init__(self, text: str, path: Union[str, None], data: object = None, outline: QPainterPath = None):
+        """
+        Instantiates a GridItem object
+        :param text: The text shown under the image
+        :param path: The path of the image file (None if there isn't one yet)
+        :param data: Anything the owner of the grid wants to associate with the item (e.g. a TgSticker)
+        :param outline: The shape of the image in a 1x1 square, painted until the image is loaded (Default is None)
+        """
+        self.text: str = text
+        self.path: Union[str, None] = path
+        self.data: object = data
+        self.outline: Union[QPainterPath, None] = outline
+        self.pixmap: Union[QPixmap, None] = None  # Loaded when the item is near the viewport, released when it isn't
+
+
+class GridModel(QAbstractListModel):
+    """
+    A list model of GridItems. Images are only loaded when the view asks for them, which it only does for cells near the
+    viewport, and are decoded in the background. An item has no image until its image is decoded
+    """
+
+    def __init__(self, icon_size: int, pixmap_budget: int = gvars.GRID_PIXMAP_BUDGET_BYTES, parent=None):
+        """
+        Instantiates a GridModel object
+        :param icon_size: The size that images are shown at (px)
+        :param pixmap_budget: Bytes of loaded images allowed before images of off-screen items are released
+        :param parent: The parent QObject
+        """
+        super().__init__(parent)
+        self.icon_size: int = icon_size
+        self.items: list[GridItem] = []
+        self.movable: bool = False
+        self.pixmaps: PixmapBudget = PixmapBudget(pixmap_budget)
+        self._decoding: set[GridItem] = set()  # Items whose image is being decoded
+
+    # Qt Model Overrides
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index: Union[QModelIndex, QPersistentModelIndex], role: int = Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.items): return None
+        item: GridItem = self.items[index.row()]
+        if role == Qt.DisplayRole: return item.text
+        if role == Qt.DecorationRole: return self.pixmap(item)
+        if role == ITEM_ROLE: return item
+        return None
+
+    def flags(self, index: Union[QModelIndex, QPersistentModelIndex]) -> Qt.ItemFlags:
+        if not index.isValid(): return Qt.ItemIsDropEnabled if self.movable else Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if self.movable: flags |= Qt.ItemIsDragEnabled
+        return flags
+
+    def supportedDropActions(self) -> Qt.DropActions:
+        return Qt.MoveAction
+
+    # Functions for external use
+
+    def pixmap(self, item: GridItem) -> Union[QPixmap, None]:
+        """
+        Gets the pixmap of an item from the shared pixmap cache, or starts decoding it
+        :param item: The item
+        :return: The pixmap of the item (null if the item has no image), or None if it's still being decoded
+        """
+        if item.pixmap is None and item not in self._decoding:
+            item.pixmap = get_loader().request(item.path, self.icon_size, lambda pix: self.__decoded(item, pix), self)
+            if item.pixmap is None: self._decoding.add(item)
+        if item.pixmap is not None: self.pixmaps.loaded(item, pixmap_bytes(item.pixmap))
+        return item.pixmap
+
+    def __decoded(self, item: GridItem, pixmap: QPixmap):
+        """
+        Shows an image once it is decoded
+        :param item: The item the image belongs to
+        :param pixmap: The image
+        :return: None
+        """
+        if item not in self._decoding: return  # Released or removed while it was decoding
+        self._decoding.discard(item)
+        try:
+            idx: int = self.items.index(item)
+        except ValueError:
+            return
+        item.pixmap = pixmap
+        self.pixmaps.loaded(item, pixmap_bytes(pixmap))
+        self.dataChanged.emit(self.index(idx), self.index(idx), [Qt.DecorationRole])
+
+    def release(self, item: GridItem):
+        """
+        Releases the pixmap of an item. It's loaded again the next time it's needed
+        :param item: The item
+        :return: None
+        """
+        self.pixmaps.forget(item)
+        self._decoding.discard(item)
+        item.pixmap = None
+
+    def append(self, item: GridItem):
+        """
+        Appends an item to the end of the list
+        :param item: The item to append
+        :return: None
+        """
+        self.beginInsertRows(QModelIndex(), len(self.items), len(self.items))
+        self.items.append(item)
+        self.endInsertRows()
+
+    def delete(self, idx: int):
+        """
+        Deletes the item at a given index
+        :param idx: The index to delete at
+        :return: None
+        """
+        if idx < 0 or idx >= len(self.items): return
+        self.beginRemoveRows(QModelIndex(), idx, idx)
+        self.release(self.items.pop(idx))
+        self.endRemoveRows()
+
+    def move(self, start: int, end: int):
+        """
+        Moves an item so that it ends up at a given index
+        :param start: The index of the item
+        :param end: The index the item should end up at
+        :return: None
+        """
+        if start == end or not (0 <= start < len(self.items)) or not (0 <= end < len(self.items)): return
+        # beginMoveRows takes the index the item is inserted before, counted before the item is removed
+        self.beginMoveRows(QModelIndex(), start, start, QModelIndex(), end + 1 if end > start else end)
+        self.items.insert(end, self.items.pop(start))
+        self.endMoveRows()
+
+    def move_many(self, rows: list[int], end: int):
+        """
+        Moves several items together, keeping their order, to the position of the item at a given index. Like move,
+        they end up after that item if they are moved forward and before it if they are moved back
+        :param rows: The indexes of the items
+        :param end: The index of the item to move them to
+        :return: None
+        """
+        rows = sorted(set(r for r in rows if 0 <= r < len(self.items)))
+        if len(rows) == 0 or not (0 <= end < len(self.items)) or end in rows: return
+        moving: list[GridItem] = [self.items[r] for r in rows]
+        moving_ids: set[int] = {id(item) for item in moving}
+        target: GridItem = self.items[end]
+        rest: list[GridItem] = [item for item in self.items if id(item) not in moving_ids]
+        at: int = next(i for i, item in enumerate(rest) if item is target) + (1 if end > rows[0] else 0)
+        new: list[GridItem] = rest[:at] + moving + rest[at:]
+        self.layoutAboutToBeChanged.emit()
+        rows_now: dict[int, int] = {id(item): i for i, item in enumerate(new)}
+        old: list[QPersistentModelIndex] = self.persistentIndexList()
+        self.changePersistentIndexList(old, [self.index(rows_now[id(self.items[i.row()])]) for i in old])
+        self.items = new
+        self.layoutChanged.emit()
+
+    def set_items(self, items: list[GridItem]):
+        """
+        Replaces every item in the model at once
+        :param items: The new items
+        :return: None
+        """
+        self.beginResetModel()
+        self.items = list(items)
+        self.pixmaps.clear()
+        self._decoding.clear()
+        for item in self.items: item.pixmap = None
+        self.endResetModel()
+
+    def item_changed(self, idx: int):
+        """
+        Tells the view that an item's text or image changed. Clears the loaded pixmap so that it's loaded again
+        :param idx: The index of the item
+        :return: None
+        """
+        self.release(self.items[idx])
+        self.dataChanged.emit(self.index(idx), self.index(idx))
+
+
+# Delegate Class
+
+class GridDelegate(QStyledItemDelegate):
+    """
+    Paints a GridItem: the image centered at the top of the cell and the text under it
+    """
+
+    def __init__(self, cell_width: int, cell_height: int, icon_size: int, parent=None):
+        """
+        Instantiates a GridDelegate object
+        :param cell_width: The width of each cell in pixels
+        :param cell_height: The height of each cell in pixels
+        :param icon_size: The size that images are shown at (px)
+        :param parent: The parent QObject
+        """
+        super().__init__(parent)
+        self.cell_width: int = cell_width
+        self.cell_height: int = cell_height
+        self.icon_size: int = icon_size
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        return QSize(self.cell_width, self.cell_height)
+
+    def paint(self, painter: QPainter, option: QStyleOptionViewItem, index: QModelIndex) -> None:
+        painter.save()
+        r: QRect = option.rect
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(r, QColor('#31434b'))
+        elif option.state & QStyle.State_MouseOver:
+            painter.fillRect(r, QColor('#283338'))  # Same as LitClickWidget
+
+        top: int = r.y() + (r.height() - self.icon_size - option.fontMetrics.height() - 4) // 2
+        icon: QRect = QRect(r.x() + (r.width() - self.icon_size) // 2, top, self.icon_size, self.icon_size)
+        self.paint_image(painter, icon, index)
+
+        text: str = option.fontMetrics.elidedText(index.data(Qt.DisplayRole) or '', Qt.ElideRight, r.width() - 4)
+        painter.setPen(option.palette.color(option.palette.ColorRole.Text))
+        painter.drawText(QRect(r.x() + 2, icon.bottom() + 4, r.width() - 4, option.fontMetrics.height()),
+                         Qt.AlignHCenter | Qt.AlignTop, text)
+        painter.restore()
+
+    def paint_image(self, painter: QPainter, icon: QRect, index: QModelIndex):
+        """
+        Paints the image of an item, keeping its aspect ratio. Until the image is loaded, its outline is painted instead
+        if the item has one
+        :param painter: The painter
+        :param icon: The square the image is painted in
+        :param index: The index of the item
+        :return: None
+        """
+        pix: QPixmap = index.data(Qt.DecorationRole)
+        if pix is None or pix.isNull():
+            self.paint_outline(painter, icon, index.data(ITEM_ROLE))
+            return
+        size: QSize = pix.size().scaled(icon.size(), Qt.KeepAspectRatio)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(QRect(icon.x() + (icon.width() - size.width()) // 2,
+                                 icon.y() + (icon.height() - size.height()) // 2,
+                                 size.width(), size.height()), pix)
+
+    def paint_outline(self, painter: QPainter, icon: QRect, item: GridItem):
+        """
+        Paints the outline of an item as a placeholder for its image
+        :param painter: The painter
+        :param icon: The square the image is painted in
+        :param item: The item
+        :return: None
+        """
+        if item is None or item.outline is None or item.outline.isEmpty(): return
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.translate(icon.topLeft())
+        painter.scale(icon.width(), icon.height())
+        painter.fillPath(item.outline, QColor('#2c3136'))  # Same as the placeholder of packs on the home page
+        painter.restore()
+
+
+# Main VirtualGridView Class
+
+class VirtualGridView(QListView):
+    """
+    A grid of images with text that only creates and paints what is visible, for grids with thousands of cells.
+    Has the same functions as GridView, but takes GridItems instead of widgets
+    """
+
+    item_clicked = Signal(object)  # Emits the data of the GridItem that was clicked
+
+    def __init__(self, max_cols: int,
+                 cell_height: int = 100, cell_width: int = 100,
+                 allow_move: bool = True, icon_size: int = 80,
+                 prefetch_rows: int = gvars.GRID_PREFETCH_ROWS,
+                 pixmap_budget: int = gvars.GRID_PIXMAP_BUDGET_BYTES,
+                 multi_select: bool = False):
+        """
+        Instantiates a VirtualGridView object
+        :param max_cols: Maximum number of columns to show in the grid
+        :param cell_height: The height of each cell in pixels
+        :param cell_width: The width of each cell in pixels
+        :param allow_move: Allow the user to drag and drop items to move them
+        :param icon_size: The size that images are shown at (px)
+        :param prefetch_rows: Rows above and below the viewport whose images are loaded ahead of scrolling
+        :param pixmap_budget: Bytes of loaded images allowed before images of off-screen items are released
+        :param multi_select: Allow the user to select several items at once (with shift, ctrl or a rubber band)
+        """
+        super().__init__()
+
+        # Set fields
+        self.cell_width: int = cell_width
+        self.cell_height: int = cell_height
+        self.max_cols: int = max_cols
+        self.prefetch_rows: int = prefetch_rows
+        self.multi_select: bool = multi_select
+        self._load_queued: bool = False  # Whether a __load_visible call is already queued
+
+        # Model and delegate
+        self.grid_model: GridModel = GridModel(icon_size, pixmap_budget, self)
+        self.setModel(self.grid_model)
+        self.setItemDelegate(GridDelegate(cell_width, cell_height, icon_size, self))
+
+        # Lay out as a grid of fixed size cells
+        self.setViewMode(QListView.IconMode)
+        self.setResizeMode(QListView.Adjust)
+        self.setMovement(QListView.Static)
+        self.setUniformItemSizes(True)
+        self.setGridSize(QSize(cell_width, cell_height))
+        self.setSpacing(0)
+        self.setWrapping(True)
+        self.setMouseTracking(True)
+
+        # Scrolling preferences
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.setAutoScroll(True)
+        self.setAutoScrollMargin(50)
+
+        # Prefetch and release images as the viewport and the contents change
+        self.verticalScrollBar().valueChanged.connect(self.__queue_load)
+        self.grid_model.rowsInserted.connect(self.__queue_load)
+        self.grid_model.rowsRemoved.connect(self.__queue_load)
+        self.grid_model.rowsMoved.connect(self.__queue_load)
+        self.grid_model.modelReset.connect(self.__queue_load)
+
+        self.set_allow_move(allow_move)
+        self.set_multi_select(multi_select)
+        self.clicked.connect(lambda idx: self.item_clicked.emit(self.grid_model.items[idx.row()].data))
+        self.setFixedWidth(max_cols * cell_width + self.verticalScrollBar().sizeHint().width() + 4)
+
+    # Functions for external use (same as GridView)
+
+    def append(self, item: GridItem):
+        """
+        Appends an item to the end of the list
+        :param item: The item to append
+        :return: None
+        """
+        self.grid_model.append(item)
+
+    def delete(self, idx: int):
+        """
+        Deletes an item at a given index
+        :param idx: The index to delete at
+        :return: None
+        """
+        self.grid_model.delete(idx)
+
+    def count(self) -> int:
+        """
+        Counts the number of items in the grid. Unlike GridView, this runs in constant time
+        :return: The number of items in the grid
+        """
+        return len(self.grid_model.items)
+
+    def set_contents(self, nc: list[GridItem]):
+        """
+        Sets the contents of the list to a given list of items
+        :param nc: The list of items to set the contents to
+        :return: None
+        """
+        self.grid_model.set_items(nc)
+
+    def get_widget_array(self) -> list[GridItem]:
+        """
+        Gets a list of all items in the grid in order
+        :return: A list of all items in the grid in order
+        """
+        return list(self.grid_model.items)
+
+    def get_at_idx(self, idx: int) -> Union[GridItem, None]:
+        """
+        Returns the item at a given index
+        :param idx: The index
+        :return: The item at the given index, or None if there isn't one
+        """
+        return self.grid_model.items[idx] if 0 <= idx < self.count() else None
+
+    def move_widget(self, start: int, end: int):
+        """
+        Move an item between positions
+        :param start: The start index
+        :param end: The end index
+        :return: None
+        """
+        self.grid_model.move(start, end)
+
+    def set_allow_move(self, allow_move: bool):
+        """
+        Set whether items can be moved or not
+        :param allow_move: Whether items can be moved
+        :return: None
+        """
+        self.grid_model.movable = allow_move
+        self.__update_selection_mode()
+        self.setDragEnabled(allow_move)
+        self.setAcceptDrops(allow_move)
+        self.setDropIndicatorShown(allow_move)
+        self.setDragDropMode(QAbstractItemView.InternalMove if allow_move else QAbstractItemView.NoDragDrop)
+        self.setDefaultDropAction(Qt.MoveAction)
+
+    def set_multi_select(self, multi_select: bool):
+        """
+        Set whether several items can be selected at once. Shift and ctrl click extend the selection, and dragging
+        from an empty spot selects the items in a rectangle
+        :param multi_select: Whether several items can be selected
+        :return: None
+        """
+        self.multi_select = multi_select
+        self.setSelectionRectVisible(multi_select)
+        self.__update_selection_mode()
+
+    def selected_rows(self) -> list[int]:
+        """
+        Gets the indexes of the selected items
+        :return: The indexes of the selected items in order
+        """
+        return sorted(i.row() for i in self.selectedIndexes())
+
+    def selected_items(self) -> list[GridItem]:
+        """
+        Gets the selected items
+        :return: The selected items in the order they are in the grid
+        """
+        return [self.grid_model.items[r] for r in self.selected_rows()]
+
+    # Qt Event Overrides
+
+    def dropEvent(self, event: QDropEvent) -> None:
+        target: QModelIndex = self.indexAt(event.position().toPoint())
+        selected: list[QModelIndex] = self.selectedIndexes()
+        event.setDropAction(Qt.IgnoreAction)  # The model is reordered here, so Qt must not remove the dragged rows
+        event.accept()
+        if not target.isValid() or len(selected) == 0: return  # Check if user dropped on a blank cell
+        if len(selected) == 1: self.move_widget(selected[0].row(), target.row())
+        else: self.grid_model.move_many([i.row() for i in selected], target.row())
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self.__queue_load()
+
+    def showEvent(self, event: QShowEvent) -> None:
+        super().showEvent(event)
+        self.__queue_load()
+
+    # Internal methods
+
+    def __update_selection_mode(self):
+        """
+        Sets the selection mode from whether items can be moved and whether several can be selected
+        :return: None
+        """
+        if self.multi_select: self.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        elif self.grid_model.movable: self.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        else: self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+
+    def __queue_load(self, *args):
+        """
+        Queues a __load_visible call for when control returns to the event loop, so that a burst of scroll, resize and
+        model events only causes one
+        :param args: Ignored, so that this can be connected to any signal
+        :return: None
+        """
+        if self._load_queued: return
+        self._load_queued = True
+        QTimer.singleShot(0, self.__load_visible)
+
+    def __load_visible(self):
+        """
+        Loads the images of the items in the rows in the viewport and the prefetch margin around it, then releases the
+        images of other items if the loaded images are over budget
+        :return: None
+        """
+        self._load_queued = False
+        cols: int = max(1, self.viewport().width() // self.cell_width)
+        top: int = self.verticalScrollBar().value()
+        first: int = max(0, top // self.cell_height - self.prefetch_rows)
+        last: int = (top + self.viewport().height()) // self.cell_height + self.prefetch_rows
+        keep: list[GridItem] = self.grid_model.items[first * cols:(last + 1) * cols]
+        for item in keep: self.grid_model.pixmap(item)
+        self.grid_model.pixmaps.trim(set(keep), self.grid_model.release)
@@ -12,6 +12,9 @@ from PySide6.QtWidgets import QApplication, QWidget, QMainWindow, QVBoxLayout, Q
 from qasync import QEventLoop
 
 from src import assets
+from src.Qt import imageloader
+from src.Qt.pixmapcache import pixmaps
+from src.Tg import cache
 
 
 def get_pixmap(module: ModuleType, resource: str) -> QPixmap:
@@ -27,15 +30,18 @@ def get_pixmap(module: ModuleType, resource: str) -> QPixmap:
     return pixmap
 
 
-def get_pixmap_from_file(fpath: str) -> QPixmap:
+def get_pixmap_from_file(fpath: str, size: int = 0) -> QPixmap:
     """
-    Generates a QPixMap object from a locally saved file
+    Generates a QPixMap object from a locally saved file, going through the pixmap cache shared by every page
     :param fpath: The path to get the file from
+    :param size: The size (px) of the square to scale the image to fit in (Default is 0, if 0 then full size)
     :return: A QPixMap containing the specified image
     """
-    pixmap: QPixmap = QPixmap()
-    if fpath is None: return pixmap
-    pixmap.load(fpath)
+    if fpath is None: return QPixmap()
+    pixmap: QPixmap = pixmaps.get(fpath, size)
+    if pixmap is None:
+        pixmap = QPixmap.fromImage(imageloader.decode(fpath, size))
+        pixmaps.put(fpath, size, pixmap)
     return pixmap
 
 
@@ -85,8 +91,12 @@ def nest_widget(widget: QWidget, alignment = Qt.AlignCenter) -> QWidget:
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
+        self.navigator: navigation.Navigator = navigation.Navigator()  # Pages use window().navigator to navigate
+        self.setCentralWidget(self.navigator)
 
     def closeEvent(self, event:QCloseEvent) -> None:
+        cache.manager.flush()
+        debug(f'Pixmap cache stats: {pixmaps.stats()}')
         exit(0)
 
 
@@ -107,6 +117,7 @@ class Loading(QWidget):
 
 
 from src.Qt.pages import login
+from src.Qt import navigation
 
 
 def main():
@@ -120,7 +131,7 @@ def main():
     widget = MainWindow()
     widget.setWindowIcon(QIcon(get_pixmap(assets, "app.png")))
     widget.setWindowTitle("PLACEHOLDER")
-    widget.setCentralWidget(login.TgLoginWidget())
+    widget.navigator.show_page(login.TgLoginWidget())
     widget.resize(900, 600)
 
     with QEventLoop(app) as loop:
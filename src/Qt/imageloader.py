@@ -0,0 +1,127 @@
+from logging import debug, info, warning, error, critical
+from typing import Callable, Union
+
+from PySide6.QtCore import Qt, QObject, QRunnable, QSize, QThreadPool, Signal
+from PySide6.QtGui import QImage, QImageReader, QPixmap
+from shiboken6 import isValid
+
+from src.Qt.pixmapcache import pixmaps
+
+
+class _DecodeTask(QRunnable):
+    """
+    Decodes one image file in a thread of the pool
+    """
+
+    def __init__(self, loader: 'ImageLoader', path: str, size: int):
+        """
+        Instantiates a _DecodeTask object
+        :param loader: The ImageLoader that receives the result
+        :param path: The path of the image file
+        :param size: The size (px) of the square the image is scaled to fit in, or 0 for full size
+        """
+        super().__init__()
+        self.loader: ImageLoader = loader
+        self.path: str = path
+        self.size: int = size
+
+    def run(self):
+        self.loader.decoded.emit(self.path, self.size, decode(self.path, self.size))  # Queued to the GUI thread
+
+
+class ImageLoader(QObject):
+    """
+    Decodes image files in a thread pool so that the GUI thread never waits on decoding. Images are decoded with
+    QImageReader straight to the size they are shown at, and converted to QPixmaps back on the GUI thread (QPixmaps
+    can't be made in other threads). Decoded images go in the shared pixmap cache
+    """
+
+    decoded = Signal(str, int, QImage)  # Emitted by worker threads: path, size, image
+
+    def __init__(self, threads: int = 0):
+        """
+        Instantiates an ImageLoader object. Must be made in the GUI thread
+        :param threads: The number of decoding threads (Default is 0, if 0 then one less than the number of CPU cores)
+        """
+        super().__init__()
+        self.pool: QThreadPool = QThreadPool(self)
+        if threads <= 0: threads = max(1, QThreadPool.globalInstance().maxThreadCount() - 1)  # Leave a core for the GUI
+        self.pool.setMaxThreadCount(threads)
+        # (path, size) -> callbacks waiting for the image, so that an image requested twice is decoded once
+        self._waiting: dict[tuple[str, int], list[tuple[Callable[[QPixmap], None], Union[QObject, None]]]] = {}
+        self.decoded.connect(self.__deliver, Qt.QueuedConnection)
+
+    def request(self, path: Union[str, None], size: int, callback: Callable[[QPixmap], None],
+                owner: QObject = None) -> Union[QPixmap, None]:
+        """
+        Gets an image from the shared pixmap cache, or decodes it in the background and calls a function with it on the
+        GUI thread
+        :param path: The path of the image file
+        :param size: The size (px) of the square the image is scaled to fit in, or 0 for full size
+        :param callback: Called with the QPixmap (null if the file couldn't be decoded). Not called if the image is
+        returned right away
+        :param owner: The QObject the callback belongs to. If it's deleted before the image is decoded, the callback
+        isn't called (Default is None)
+        :return: The image if it's cached (a null pixmap if path is None), otherwise None
+        """
+        if path is None: return QPixmap()
+        cached: Union[QPixmap, None] = pixmaps.get(path, size)
+        if cached is not None: return cached
+        key: tuple[str, int] = (path, size)
+        waiting = self._waiting.get(key)
+        if waiting is not None:
+            waiting.append((callback, owner))
+            return None
+        self._waiting[key] = [(callback, owner)]
+        self.pool.start(_DecodeTask(self, path, size))
+        return None
+
+    def pending(self) -> int:
+        """
+        Counts the images that are waiting to be decoded
+        :return: The number of images
+        """
+        return len(self._waiting)
+
+    def __deliver(self, path: str, size: int, image: QImage):
+        """
+        Converts a decoded image to a QPixmap and gives it to everything that requested it. Runs on the GUI thread
+        :param path: The path of the image file
+        :param size: The size the image was requested at
+        :param image: The decoded image
+        :return: None
+        """
+        pixmap: QPixmap = QPixmap.fromImage(image)
+        pixmaps.put(path, size, pixmap)
+        for callback, owner in self._waiting.pop((path, size), []):
+            if owner is None or isValid(owner): callback(pixmap)
+
+
+def decode(path: str, size: int) -> QImage:
+    """
+    Decodes an image file with QImageReader. Safe to call from any thread
+    :param path: The path of the image file
+    :param size: The size (px) of the square the image is scaled to fit in, or 0 for full size
+    :return: The decoded image (null if it couldn't be decoded)
+    """
+    reader: QImageReader = QImageReader(path)
+    reader.setAutoTransform(True)
+    src: QSize = reader.size()
+    if size > 0 and src.isValid():  # Only decode as many pixels as are shown
+        reader.setScaledSize(src.scaled(size, size, Qt.KeepAspectRatio))
+    image: QImage = reader.read()
+    if image.isNull(): debug(f'Could not decode {path}: {reader.errorString()}')
+    return image
+
+
+_loader: Union[ImageLoader, None] = None
+
+
+def get_loader() -> ImageLoader:
+    """
+    Gets the image loader, making it the first time this is called. Call it from the GUI thread
+    :return: The image loader
+    """
+    global _loader
+    if _loader is None: _loader = ImageLoader()
+    return _loader
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from PySide6.QtGui import QPixmap
+
+
+class LazyCell:
+    """
+    Mixin for GridView cell widgets that only load their image while they are near the viewport.
+    Cells start out showing a lightweight placeholder. By default a cell has no image, so cells override both methods
+    (this isn't an abc.ABC because the cells are QWidgets, whose metaclass can't be mixed with ABCMeta)
+    """
+
+    def load_image(self) -> int:
+        """
+        Loads the image of the cell if it isn't loaded already
+        :return: The size of the image in bytes (0 if the cell has no image)
+        """
+        return 0
+
+    def release_image(self):
+        """
+        Releases the image of the cell and goes back to showing the placeholder
+        :return: None
+        """
+        pass
+
+
+class PixmapBudget:
+    """
+    Keeps track of the images a grid has loaded, and releases the least recently shown off-screen images once they
+    take up more memory than the budget
+    """
+
+    def __init__(self, budget: int):
+        """
+        Instantiates a PixmapBudget object
+        :param budget: The number of bytes of loaded images allowed before off-screen images are released
+        """
+        self.budget: int = budget
+        self.total: int = 0
+        self._loaded: OrderedDict[Hashable, int] = OrderedDict()  # Least recently shown first
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._loaded
+
+    def __len__(self) -> int:
+        return len(self._loaded)
+
+    def __iter__(self):
+        return iter(list(self._loaded))
+
+    def loaded(self, key: Hashable, nbytes: int):
+        """
+        Records that an image was loaded or shown
+        :param key: The cell or item the image belongs to
+        :param nbytes: The size of the image in bytes
+        :return: None
+        """
+        self.total += nbytes - self._loaded.get(key, 0)
+        self._loaded[key] = nbytes
+        self._loaded.move_to_end(key)
+
+    def forget(self, key: Hashable):
+        """
+        Stops tracking an image without releasing it, e.g. because its cell was deleted
+        :param key: The cell or item the image belongs to
+        :return: None
+        """
+        self.total -= self._loaded.pop(key, 0)
+
+    def clear(self):
+        """
+        Stops tracking every image
+        :return: None
+        """
+        self._loaded.clear()
+        self.total = 0
+
+    def trim(self, keep: set, release: Callable[[Hashable], None]) -> int:
+        """
+        Releases images, least recently shown first, until the total is under budget. Images in keep are never released
+        :param keep: The cells or items that are on screen or within the prefetch margin
+        :param release: A function that releases the image of a cell or item
+        :return: The number of bytes released
+        """
+        if self.total <= self.budget: return 0
+        released: int = 0
+        for key in list(self._loaded):
+            if self.total <= self.budget: break
+            if key in keep: continue
+            nbytes: int = self._loaded.pop(key)
+            self.total -= nbytes
+            released += nbytes
+            release(key)
+        return released
+
+
+def pixmap_bytes(pixmap: QPixmap) -> int:
+    """
+    Estimates the memory used by a pixmap
+    :param pixmap: The pixmap
+    :return: The size of the pixmap in bytes
+    """
+    return 0 if pixmap is None or pixmap.isNull() else pixmap.width() * pixmap.height() * max(pixmap.depth(), 8) // 8
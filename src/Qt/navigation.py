@@ -0,0 +1,137 @@
+from collections import OrderedDict
+from logging import debug, info, warning, error, critical
+from typing import Union
+
+from PySide6.QtGui import QKeySequence, QShortcut
+from PySide6.QtWidgets import QWidget, QStackedWidget
+
+from src import gvars
+from src.Qt.pages.home import HomePage
+from src.Qt.pages.base_sticker import BaseStickerPage
+from src.Tg.stickers import TgStickerPack
+
+
+class Navigator(QStackedWidget):
+    """
+    The central widget of the main window. Pages are kept alive in a stack instead of being rebuilt on every visit, so
+    going back to a page is instant and keeps its state (including how far it was scrolled). The home page lives as long
+    as the user is signed in, and the most recently opened sticker pack pages are kept up to a limit
+    """
+
+    def __init__(self, max_pages: int = gvars.PAGE_CACHE_SIZE):
+        """
+        Instantiates a Navigator object
+        :param max_pages: The number of sticker pack pages to keep alive
+        """
+        super().__init__()
+        self.max_pages: int = max_pages
+        self.home: Union[HomePage, None] = None
+        self._pages: OrderedDict[str, BaseStickerPage] = OrderedDict()  # Shortname -> page, least recently used first
+        self._back: list[QWidget] = []
+        self._forward: list[QWidget] = []
+        QShortcut(QKeySequence(QKeySequence.StandardKey.Back), self).activated.connect(self.back)
+        QShortcut(QKeySequence(QKeySequence.StandardKey.Forward), self).activated.connect(self.forward)
+
+    def show_page(self, page: QWidget, remember: bool = True):
+        """
+        Shows a page, adding it to the stack if it isn't there yet
+        :param page: The page to show
+        :param remember: Whether the page that was showing can be gone back to (Default is True)
+        :return: None
+        """
+        current: Union[QWidget, None] = self.currentWidget()
+        if page is current: return
+        if self.indexOf(page) == -1: self.addWidget(page)
+        if remember and current is not None:
+            self._back.append(current)
+            self._forward.clear()
+        self.setCurrentWidget(page)
+
+    def reset(self, page: QWidget):
+        """
+        Shows a page and deletes every other page, e.g. after signing in
+        :param page: The page to show
+        :return: None
+        """
+        self.show_page(page, False)
+        for w in [self.widget(i) for i in range(self.count())]:
+            if w is not page: self.__remove(w)
+        self._back.clear()
+        self._forward.clear()
+
+    def go_home(self, title: str = None):
+        """
+        Shows the home page, making it the first time. The first time also deletes every other page, since the pages
+        before the home page are the sign in pages
+        :param title: The title of the home page if it has to be made (Default is None, if None then the default title)
+        :return: None
+        """
+        if self.home is None:
+            self.home = HomePage() if title is None else HomePage(title)
+            self.reset(self.home)
+        else:
+            self.show_page(self.home)
+
+    def open_pack(self, pack: TgStickerPack):
+        """
+        Shows the page of a sticker pack, reusing it if it was opened recently
+        :param pack: The sticker pack
+        :return: None
+        """
+        page: Union[BaseStickerPage, None] = self._pages.pop(pack.sn, None)
+        if page is None:
+            debug(f'Making the page of pack {pack.sn}')
+            page = BaseStickerPage(pack)
+        self._pages[pack.sn] = page
+        self.show_page(page)
+        while len(self._pages) > self.max_pages:
+            sn, old = self._pages.popitem(last=False)
+            debug(f'Deleting the page of pack {sn}, it was the least recently opened')
+            self.__remove(old)
+
+    def has_pack(self, sn: str) -> bool:
+        """
+        Checks if the page of a sticker pack is being kept alive
+        :param sn: The shortname of the pack
+        :return: Whether the page is kept
+        """
+        return sn in self._pages
+
+    def forget_packs(self):
+        """
+        Deletes every sticker pack page that isn't showing, so that they are made again from fresh data
+        :return: None
+        """
+        for sn, page in list(self._pages.items()):
+            if page is self.currentWidget(): continue
+            del self._pages[sn]
+            self.__remove(page)
+
+    def back(self):
+        """
+        Goes back to the previous page, if there is one
+        :return: None
+        """
+        if len(self._back) == 0: return
+        self._forward.append(self.currentWidget())
+        self.setCurrentWidget(self._back.pop())
+
+    def forward(self):
+        """
+        Goes forward to the page that was gone back from, if there is one
+        :return: None
+        """
+        if len(self._forward) == 0: return
+        self._back.append(self.currentWidget())
+        self.setCurrentWidget(self._forward.pop())
+
+    def __remove(self, page: QWidget):
+        """
+        Removes a page from the stack and the history, and deletes it
+        :param page: The page
+        :return: None
+        """
+        self._back = [w for w in self._back if w is not page]
+        self._forward = [w for w in self._forward if w is not page]
+        self.removeWidget(page)
+        page.deleteLater()
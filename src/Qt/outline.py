@@ -0,0 +1,117 @@
+import re
+from logging import debug, info, warning, error, critical
+
+from PySide6.QtGui import QPainterPath, QTransform
+
+
+# Telegram's table for decoding compressed outlines (PhotoPathSize) into SVG path data
+_LOOKUP: str = 'AACAAAAHAAALMAAAQASTAVAAAZaacaaaahaaalmaaaqastava.az0123456789-,'
+# Outlines are drawn in a 512x512 box, the size the longer side of every sticker is scaled to
+_BOX: int = 512
+_TOKEN: re.Pattern = re.compile(r'[MmLlHhVvCcSsQqTtZz]|[+-]?(?:\d+\.?\d*|\.\d+)')
+_ARGS: dict[str, int] = {'M': 2, 'L': 2, 'H': 1, 'V': 1, 'C': 6, 'S': 4, 'Q': 4, 'T': 2, 'Z': 0}
+
+
+def svg_path(data: bytes) -> str:
+    """
+    Decodes a compressed outline into SVG path data
+    :param data: The bytes of a PhotoPathSize
+    :return: The SVG path data, in a 512x512 box
+    """
+    out: list[str] = ['M']
+    for b in data:
+        if b >= 128 + 64:
+            out.append(_LOOKUP[b - 128 - 64])
+        else:
+            if b >= 128: out.append(',')
+            elif b >= 64: out.append('-')
+            out.append(str(b & 63))
+    out.append('z')
+    return ''.join(out)
+
+
+def painter_path(data: bytes, width: int, height: int, size: int) -> QPainterPath:
+    """
+    Decodes a compressed outline into a QPainterPath that lines up with the sticker image when the image is scaled to
+    fit in a square and centered in it
+    :param data: The bytes of a PhotoPathSize
+    :param width: The width of the sticker image
+    :param height: The height of the sticker image
+    :param size: The size of the square (e.g. 1 to scale the outline when it is painted)
+    :return: The outline, in the coordinates of the square. Empty if there is no outline or it can't be read
+    """
+    if len(data) == 0: return QPainterPath()
+    path: QPainterPath = _parse(svg_path(data))
+    # The outline is drawn over the image scaled so that its longer side is 512
+    scale: float = _BOX / max(width, height) if width > 0 and height > 0 else 1
+    w, h = (width * scale, height * scale) if width > 0 and height > 0 else (_BOX, _BOX)
+    k: float = size / _BOX
+    return QTransform().translate((size - w * k) / 2, (size - h * k) / 2).scale(k, k).map(path)
+
+
+def _parse(svg: str) -> QPainterPath:
+    """
+    Builds a QPainterPath from SVG path data. Only the commands Telegram uses in outlines are supported (no arcs)
+    :param svg: The SVG path data
+    :return: The path, up to the first command that couldn't be read
+    """
+    path: QPainterPath = QPainterPath()
+    tokens: list[str] = _TOKEN.findall(svg)
+    cmd: str = ''
+    prev: str = ''  # The previous command, to know if there is a control point to reflect
+    x = y = sx = sy = 0.0  # Current point and start of the subpath
+    cx = cy = 0.0  # Last control point
+    i: int = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            cmd = tokens[i]
+            i += 1
+            if cmd in 'Zz':
+                path.closeSubpath()
+                x, y, prev = sx, sy, 'Z'
+                continue
+        elif cmd == '' or cmd in 'Zz':
+            debug(f'Outline has a number without a command, stopping at token {i}')
+            break
+        c: str = cmd.upper()
+        n: int = _ARGS[c]
+        args: list[str] = tokens[i:i + n]
+        if len(args) < n or any(t.isalpha() for t in args):
+            debug(f'Outline command {cmd} is missing arguments, stopping at token {i}')
+            break
+        i += n
+        a: list[float] = [float(t) for t in args]
+        ox, oy = (x, y) if cmd.islower() else (0.0, 0.0)
+        if c == 'M':
+            x, y = ox + a[0], oy + a[1]
+            sx, sy = x, y
+            path.moveTo(x, y)
+            cmd = 'l' if cmd.islower() else 'L'  # Later pairs after a moveto are linetos
+        elif c == 'L':
+            x, y = ox + a[0], oy + a[1]
+            path.lineTo(x, y)
+        elif c == 'H':
+            x = ox + a[0]
+            path.lineTo(x, y)
+        elif c == 'V':
+            y = oy + a[0]
+            path.lineTo(x, y)
+        elif c in 'CS':
+            if c == 'C':
+                x1, y1 = ox + a[0], oy + a[1]
+                a = a[2:]
+            else:
+                x1, y1 = (2 * x - cx, 2 * y - cy) if prev in ('C', 'S') else (x, y)
+            cx, cy = ox + a[0], oy + a[1]
+            x, y = ox + a[2], oy + a[3]
+            path.cubicTo(x1, y1, cx, cy, x, y)
+        elif c in 'QT':
+            if c == 'Q':
+                cx, cy = ox + a[0], oy + a[1]
+                a = a[2:]
+            else:
+                cx, cy = (2 * x - cx, 2 * y - cy) if prev in ('Q', 'T') else (x, y)
+            x, y = ox + a[0], oy + a[1]
+            path.quadTo(cx, cy, x, y)
+        prev = c
+    return path
@@ -1,23 +1,35 @@
-from PySide6.QtGui import QFont, Qt
-from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel
+import asyncio
+from logging import debug, info, error
 
-from src.Qt import gui
+from PySide6.QtGui import QFont, QKeySequence, QShortcut, Qt
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QInputDialog, QLineEdit, QMessageBox
+from shiboken6 import isValid
+
+from src import utils
+from src.Qt import gui, outline
 from src.Qt.ClickWidget import ClickWidget, LitClickWidget
-from src.Qt.GridView import GridView
-from src.Qt.pages.home import HomePage
+from src.Qt.VirtualGridView import VirtualGridView, GridItem
+from src.Tg import bulk, commands, manifest, prefetch, reorder, store
 from src.Tg.stickers import TgStickerPack, TgSticker
 
 
 class BaseStickerPage(QWidget):
     def __init__(self, pack: TgStickerPack):
         super().__init__()
+        self.pack: TgStickerPack = pack
+        self.reported: set[commands.Operation] = set()  # Failed Sticker bot operations the user was already told about
+        manifest.manifest.refresh(pack.sn)  # Pick up files that were removed since the pack folder was last read
+        asyncio.ensure_future(pack.make_thumbnails())  # For stickers downloaded before thumbnails were made
+        asyncio.ensure_future(self.download_missing())  # The home page only fetches packs to the THUMB tier
         self.setLayout(QVBoxLayout())
         self.layout().setSpacing(0)
         self.panel: QWidget = QWidget()
         self.panel.setLayout(QVBoxLayout())
         self.panel.layout().setSpacing(0)
         self.panel.setStyleSheet("background-color: #24282c")
-        self.grid: GridView = GridView(5, cell_width=130, cell_height=130, allow_move=False)
+        self.grid: VirtualGridView = VirtualGridView(5, cell_width=130, cell_height=130, allow_move=True,
+                                                     multi_select=True)
+        self.grid.item_clicked.connect(lambda s: debug(f'Clicked sticker {s.doc_id} in {s.parent_sn}'))
         self.grid.setStyleSheet('border: none')
 
         # Stuff for the info panel
@@ -43,20 +55,30 @@ class BaseStickerPage(QWidget):
         home.layout().addWidget(gui.basic_label("Home", gui.generate_font(10)))
         home.setFixedSize(80, 80)
         home.setContentsMargins(0, 0, 0, 0)
-        home.clicked.connect(lambda: self.parentWidget().setCentralWidget(HomePage()))
+        home.clicked.connect(lambda: self.window().navigator.go_home())
         nhome = gui.nest_widget(home)
 
+        save = action_button("Save order")
+        save.clicked.connect(self.save_order)
+        nsave = gui.nest_widget(save)
+
+        refresh = action_button("Refresh")
+        refresh.clicked.connect(lambda: asyncio.ensure_future(self.sync_pack()))
+        nrefresh = gui.nest_widget(refresh)
+
         top = QWidget()
         top.setLayout(QHBoxLayout())
         top.layout().addWidget(info)
         top.layout().addStretch()
+        top.layout().addWidget(nrefresh)
+        top.layout().addWidget(nsave)
         top.layout().addWidget(nhome)
 
         # Stuff for the stickers list
 
         gv_nest = gui.nest_widget(self.grid)
         gv_nest.setMinimumWidth(self.grid.max_cols * self.grid.cell_width)
-        self.grid.set_contents([CellWidget(q) for q in pack.stickers])
+        self.grid.set_contents([sticker_item(q) for q in pack.stickers])
 
         gv_nest.setStyleSheet("background-color: #24282c")
 
@@ -70,32 +92,136 @@ class BaseStickerPage(QWidget):
         self.layout().addWidget(gui.nest_widget(top, Qt.AlignLeft))
         self.layout().addWidget(bot)
 
-    def add_button(self, button: QWidget):
-        self.panel.layout().addWidget(button)
-
+        # Bulk actions on the selected stickers
 
-class CellWidget(ClickWidget):
-    def __init__(self, sticker: TgSticker):
-        super().__init__()
-        self.clicked.connect(lambda: print(sticker.parent_sn))  # For Testing only
-        img = gui.get_pixmap_from_file(sticker.get_file_path())
-        label = QLabel()
-        label.setScaledContents(True)
-        label.setFixedSize(80, 80)
-        label.setContentsMargins(0, 0, 0, 0)
-        label.setPixmap(img)
-        nest_label = gui.nest_widget(label)
+        delete = action_button("Delete")
+        delete.clicked.connect(self.delete_selected)
+        self.add_button(delete)
+        emojis = action_button("Set emojis")
+        emojis.clicked.connect(self.set_selected_emojis)
+        self.add_button(emojis)
+        QShortcut(QKeySequence(QKeySequence.StandardKey.Delete), self.grid).activated.connect(self.delete_selected)
 
-        self.setLayout(QVBoxLayout())
-        self.layout().setAlignment(Qt.AlignCenter)
-        self.layout().addWidget(nest_label)
-
-        text = gui.basic_label(sticker.emojis, alignment=Qt.AlignCenter)
-        text.setContentsMargins(0, 0, 0, 0)
-
-        self.layout().addWidget(text)
-        self.layout().setContentsMargins(0, 0, 0, 0)
-        self.layout().setSpacing(2)
-
-        self.setStyleSheet("background-color: none")
+    def add_button(self, button: QWidget):
+        self.panel.layout().addWidget(button)
 
+    def save_order(self):
+        """
+        Sends the order the stickers were dragged into to Telegram, with as few moves as possible
+        :return: None
+        """
+        n: int = reorder.submit_order(self.pack, [item.data for item in self.grid.get_widget_array()],
+                                      self.report_failures, self.show_synced)
+        info(f'Queued {n} moves to save the order of pack {self.pack.sn}')
+
+    def delete_selected(self):
+        """
+        Deletes the selected stickers from the pack, after asking the user
+        :return: None
+        """
+        rows: list[int] = self.grid.selected_rows()
+        if len(rows) == 0: return
+        if QMessageBox.question(self, "Delete stickers", f"Delete {len(rows)} stickers from {self.pack.name}?") \
+                != QMessageBox.Yes:
+            return
+        bulk.delete_stickers(self.pack, [self.grid.get_at_idx(i).data for i in rows], self.report_failures,
+                             self.show_synced)
+        for i in reversed(rows): self.grid.delete(i)
+
+    def set_selected_emojis(self):
+        """
+        Sets the emojis of the selected stickers to emojis the user types in. Anything that isn't only emojis is refused
+        here and asked for again, instead of failing in Sticker bot for every sticker
+        :return: None
+        """
+        rows: list[int] = self.grid.selected_rows()
+        if len(rows) == 0: return
+        emojis: str = ''
+        while True:
+            emojis, ok = QInputDialog.getText(self, "Set emojis", f"Emojis for {len(rows)} stickers:",
+                                              QLineEdit.Normal, emojis)
+            if not ok: return
+            emojis = emojis.strip()
+            parts: list[str] = utils.split_emojis(emojis)
+            if len(parts) > 0 and all(utils.is_emoji(e) for e in parts): break
+            QMessageBox.warning(self, "Set emojis", "Type one or more emojis, and nothing else")
+        bulk.set_emojis(self.pack, [self.grid.get_at_idx(i).data for i in rows], emojis, self.report_failures,
+                        self.show_synced)
+        for i in rows:
+            self.grid.get_at_idx(i).text = emojis
+            self.grid.grid_model.item_changed(i)
+
+    async def sync_pack(self):
+        """
+        Syncs the pack with Telegram and shows it again, e.g. to see changes made outside of this program
+        :return: None
+        """
+        try:
+            await self.pack.sync()
+        except Exception as e:
+            error(f'Could not sync pack {self.pack.sn}: {e}')
+            return
+        self.show_synced(self.pack)
+
+    def show_synced(self, pack: TgStickerPack):
+        """
+        Shows the stickers of the pack again after it was synced with Telegram
+        :param pack: The pack (the same object as self.pack, which the sync updated)
+        :return: None
+        """
+        if not isValid(self): return
+        self.grid.set_contents([sticker_item(q) for q in pack.stickers])
+
+    def report_failures(self, queue: commands.CommandQueue):
+        """
+        Tells the user about Sticker bot operations on this pack that were given up on since the last time. Passed as
+        the callback of the queue, so it's called after every operation. The message box doesn't block the queue
+        :param queue: The queue
+        :return: None
+        """
+        new: list[commands.Operation] = [op for op in queue.failed
+                                         if op.args.get('sn') == self.pack.sn and op not in self.reported]
+        if len(new) == 0 or not isValid(self): return
+        self.reported.update(new)
+        details: str = '\n'.join(f'{op.kind.replace("_", " ")}: {op.error}' for op in new)
+        box: QMessageBox = QMessageBox(QMessageBox.Warning, "Sticker bot",
+                                       f"{len(new)} changes to {self.pack.name} could not be made. The pack will be "
+                                       f"synced with Telegram to show how it really looks.\n\n{details}", parent=self)
+        box.setAttribute(Qt.WA_DeleteOnClose)
+        box.show()
+
+    async def download_missing(self):
+        """
+        Downloads the stickers of the pack that aren't in the cache, then shows them in the grid
+        :return: None
+        """
+        prefetch.prefetcher.preempt(self.pack.sn)  # Fetched here at interactive priority instead
+        if await self.pack.fetch(store.Tier.FULL) == 0 or not isValid(self): return
+        for i, item in enumerate(self.grid.get_widget_array()):
+            if item.path is None and (path := item.data.get_preview_path()) is not None:
+                item.path = path
+                self.grid.grid_model.item_changed(i)
+
+
+def action_button(text: str) -> LitClickWidget:
+    """
+    Creates a button for the bar at the top or the panel at the side of the page
+    :param text: The text on the button
+    :return: The button, connect to its clicked signal
+    """
+    button = LitClickWidget()
+    button.setLayout(QVBoxLayout())
+    button.layout().addWidget(gui.basic_label(text, gui.generate_font(10)))
+    button.setFixedSize(80, 80)
+    button.setContentsMargins(0, 0, 0, 0)
+    return button
+
+
+def sticker_item(sticker: TgSticker) -> GridItem:
+    """
+    Creates the grid item of a sticker
+    :param sticker: The sticker
+    :return: A GridItem showing the sticker's image and emojis, and its outline until the image is loaded
+    """
+    return GridItem(sticker.emojis, sticker.get_preview_path(), sticker,
+                    outline.painter_path(sticker.outline, sticker.width, sticker.height, 1))
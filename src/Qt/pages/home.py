@@ -1,18 +1,22 @@
 import asyncio
 import os
 from logging import debug
+from typing import Union
 
 from PySide6.QtCore import QTimer
-from PySide6.QtGui import Qt, QFont
+from PySide6.QtGui import Qt, QFont, QPixmap
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QHBoxLayout
 from qasync import asyncSlot
+from shiboken6 import isValid
 
 from src import gvars
 from src.Qt import gui
 from src.Qt.gui import Loading
 from src.Qt.ClickWidget import ClickWidget
 from src.Qt.GridView import GridView
-from src.Tg import tgapi
+from src.Qt.imageloader import get_loader
+from src.Qt.lazy import LazyCell, pixmap_bytes
+from src.Tg import cache, commands, prefetch, store, tgapi
 from src.Tg import stickers
 from src.Tg.stickers import TgStickerPack
 
@@ -65,29 +69,28 @@ class HomePage(QWidget):
     @asyncSlot()
     async def refresh(self):
         await stickers.update_owned_packs()
+        self.window().navigator.forget_packs()  # Pack pages are made again with the refreshed packs
         await self.pgv.show_info()
 
 
-from src.Qt.pages.base_sticker import BaseStickerPage
-
-
-class _PackWidget(ClickWidget):
-    def __init__(self, pack: TgStickerPack):
+class _PackWidget(ClickWidget, LazyCell):
+    def __init__(self, sn: str):
         super().__init__()
-        self.pack = pack
-        thumb = gui.get_pixmap_from_file(self.pack.get_thumb_path())
-        tlabel = QLabel()
+        self.sn = sn
+        self.pack: Union[TgStickerPack, None] = None  # Set by set_pack when the pack's metadata has loaded
+        self.thumb: Union[QPixmap, None] = None  # Loaded by the GridView when the widget scrolls near the viewport
+        self.wanted: bool = False  # Whether the thumbnail should be shown once it's decoded
+        self.tlabel = tlabel = QLabel()
         tlabel.setScaledContents(True)
         tlabel.setFixedSize(80, 80)
         tlabel.setContentsMargins(0, 0, 0, 0)
-        tlabel.setPixmap(thumb)
         tnest = gui.nest_widget(tlabel)
 
         self.setLayout(QVBoxLayout())
         self.layout().setAlignment(Qt.AlignCenter)
         self.layout().addWidget(tnest)
 
-        text = gui.basic_label(pack.name, alignment=Qt.AlignCenter)
+        self.text = text = gui.basic_label(sn, alignment=Qt.AlignCenter)
         text.setContentsMargins(2, 2, 2, 2)
 
         self.layout().addWidget(text)
@@ -97,13 +100,43 @@ class _PackWidget(ClickWidget):
         self.setStyleSheet('background-color: none')
 
         self.clicked.connect(self.pack_page)
+        self.release_image()
 
-    @asyncSlot()
-    async def pack_page(self):
-        self.parentWidget().parentWidget().parentWidget().parentWidget().layout().addWidget(Loading())
-        await asyncio.sleep(0.01)
-        self.parentWidget().parentWidget().parentWidget().parentWidget().parentWidget().parentWidget().\
-            setCentralWidget(BaseStickerPage(self.pack))
+    def set_pack(self, pack: TgStickerPack):
+        self.pack = pack
+        self.text.setText(pack.name)
+        if self.wanted and self.thumb is None: self.request_image()  # Already near the viewport
+
+    def set_failed(self):
+        self.text.setText(f'{self.sn}\n(failed to load)')
+
+    def load_image(self) -> int:
+        if self.thumb is not None: return pixmap_bytes(self.thumb)
+        if not self.wanted:
+            self.wanted = True
+            if self.pack is not None: return self.request_image()
+        return gvars.GRID_THUMB_SIZE * gvars.GRID_THUMB_SIZE * 4  # Estimate until it's decoded
+
+    def request_image(self) -> int:
+        thumb = get_loader().request(self.pack.get_preview_path(), gvars.GRID_THUMB_SIZE, self.set_image, self)
+        if thumb is None: return gvars.GRID_THUMB_SIZE * gvars.GRID_THUMB_SIZE * 4  # Estimate until it's decoded
+        self.set_image(thumb)
+        return pixmap_bytes(thumb)
+
+    def set_image(self, thumb: QPixmap):
+        if not self.wanted: return  # Released while it was decoding
+        self.thumb = thumb
+        self.tlabel.setStyleSheet('background-color: none')
+        self.tlabel.setPixmap(thumb)
+
+    def release_image(self):
+        self.wanted = False
+        self.thumb = None
+        self.tlabel.clear()
+        self.tlabel.setStyleSheet('background-color: #2c3136; border-radius: 8px')  # Placeholder
+
+    def pack_page(self):
+        if self.pack is not None: self.window().navigator.open_pack(self.pack)
 
 
 class _PackGridView(QWidget):
@@ -114,6 +147,7 @@ class _PackGridView(QWidget):
         self.gv = GridView(5, 140, 140, False)
         self.loading = Loading()
         self.gv.setStyleSheet('border: none')
+        self.generation: int = 0  # Counts calls of show_info, so that a load that was replaced by a newer one stops
         self.show_info()
 
     def clear_layout(self):
@@ -122,11 +156,26 @@ class _PackGridView(QWidget):
         for i in range(self.layout().count()):
             self.layout().removeWidget(self.layout().itemAt(0).widget())
 
+    def show_grid(self):
+        """
+        Shows the gridview in place of the loading sign if it isn't shown already
+        :return: None
+        """
+        if self.layout().indexOf(self.gv) == -1:
+            debug("showing gridview...")
+            self.clear_layout()
+            self.layout().addWidget(self.gv)
+
     @asyncSlot()
     async def show_info(self):
+        self.generation += 1
+        gen: int = self.generation
         self.layout().addWidget(self.loading)
         sns: list[str] = await stickers.get_owned_packs()
+        if gen != self.generation: return  # Refresh was pressed while the owned packs were loading
         debug(f"Got owned packs: {sns}")
+        # The client is logged in by now, so Sticker bot operations left over from the last run can be finished
+        if commands.queue.resume() > 0: commands.queue.start()
         if len(sns) == 0:
             debug("owned packs len == 0, displaying 0 packs screen")
             self.clear_layout()
@@ -135,9 +184,19 @@ class _PackGridView(QWidget):
                                                     "new pack!",
                                                     font=gui.generate_font(12)))
         else:
-            debug("getting packs and adding to gridview")
-            packs: list[TgStickerPack] = [await stickers.get_pack(s) for s in sns]
-            self.gv.set_contents([_PackWidget(tgs) for tgs in packs])
-            debug("showing gridview...")
-            self.clear_layout()
-            self.layout().addWidget(self.gv)
+            debug("showing a placeholder for every pack and filling them in as packs load")
+            widgets: dict[str, _PackWidget] = {sn: _PackWidget(sn) for sn in sns}
+            self.gv.set_contents(list(widgets.values()))
+            self.show_grid()
+            # Only the metadata and thumbnails are loaded here, stickers are downloaded when a pack is opened or by the
+            # prefetcher
+            # A newer load replaces the widgets with set_contents, so this one stops touching them once it's replaced
+            async for tgs in stickers.get_packs(sns, tier=store.Tier.THUMB):
+                if gen != self.generation: return
+                if tgs.sn in widgets and isValid(widgets[tgs.sn]): widgets[tgs.sn].set_pack(tgs)
+            if gen != self.generation: return
+            for w in widgets.values():
+                if w.pack is None and isValid(w): w.set_failed()
+            await cache.manager.collect(sns)  # Before prefetching, so that the prefetcher knows how full the cache is
+            if gen != self.generation: return
+            if gvars.PREFETCH_PACKS: prefetch.prefetcher.start(sns)
@@ -10,7 +10,6 @@ from qasync import asyncSlot
 import src
 from src import assets, gvars, utils
 from src.Qt.gui import generate_font, nest_widget, get_pixmap, Loading
-from src.Qt.pages.home import HomePage
 from src.Tg import auth
 
 # TODO Do proper docstrings
@@ -98,7 +97,7 @@ class _TgLoginInputWidget(QStackedWidget):
 
             if await gvars.client.is_user_authorized():
                 info("You're signed in and ready to go!")
-                self.parentWidget().parentWidget().setCentralWidget(HomePage("Welcome Back!"))
+                self.window().navigator.go_home("Welcome Back!")
             else:
                 self.next(self.page1())
 
@@ -243,7 +242,7 @@ class _TgLoginInputWidget(QStackedWidget):
 
             if gvars.state == auth.SignInState.SIGNED_IN:
                 info('Signed in!')
-                self.parentWidget().parentWidget().setCentralWidget(HomePage())
+                self.window().navigator.go_home()
 
         cont.clicked.connect(cont_clicked)
         code.returnPressed.connect(cont_clicked)
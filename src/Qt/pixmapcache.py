@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from logging import debug, info, warning, error, critical
+from typing import Union
+
+from PySide6.QtGui import QPixmap
+
+from src import gvars
+from src.Qt.lazy import pixmap_bytes
+from src.Tg import manifest
+
+
+class PixmapCache:
+    """
+    A process-wide cache of decoded images shared by every page, so that images aren't decoded again when a page is
+    rebuilt. Entries are keyed by (path, size, manifest version), so a file that is written again is decoded again.
+    The least recently used entries are evicted once the cache is over budget
+    """
+
+    def __init__(self, budget: int):
+        """
+        Instantiates a PixmapCache object
+        :param budget: The maximum size of the cached pixmaps in bytes
+        """
+        self.budget: int = budget
+        self.total: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._entries: OrderedDict[tuple[str, int, int], QPixmap] = OrderedDict()  # Least recently used first
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, path: str, size: int) -> Union[QPixmap, None]:
+        """
+        Gets a cached image
+        :param path: The path of the image file
+        :param size: The size the image was decoded at (0 for full size)
+        :return: The pixmap, or None if it isn't cached
+        """
+        key: tuple[str, int, int] = _key(path, size)
+        pixmap: Union[QPixmap, None] = self._entries.get(key)
+        if pixmap is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return pixmap
+
+    def put(self, path: str, size: int, pixmap: QPixmap):
+        """
+        Adds an image to the cache, evicting the least recently used images if the cache goes over budget
+        :param path: The path of the image file
+        :param size: The size the image was decoded at (0 for full size)
+        :param pixmap: The decoded image
+        :return: None
+        """
+        key: tuple[str, int, int] = _key(path, size)
+        nbytes: int = pixmap_bytes(pixmap)
+        if nbytes == 0 or nbytes > self.budget: return
+        old: Union[QPixmap, None] = self._entries.pop(key, None)
+        if old is not None: self.total -= pixmap_bytes(old)
+        self._entries[key] = pixmap
+        self.total += nbytes
+        while self.total > self.budget:
+            _, evicted = self._entries.popitem(last=False)
+            self.total -= pixmap_bytes(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Empties the cache. The counters are kept
+        :return: None
+        """
+        self._entries.clear()
+        self.total = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Gets the counters of the cache, for tuning the budget
+        :return: A dictionary with the hits, misses, evictions, number of entries, bytes used and budget
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self.total, 'budget': self.budget}
+
+
+def _key(path: str, size: int) -> tuple[str, int, int]:
+    """
+    Makes the cache key of an image file without touching the file system. Cache files are only ever replaced whole,
+    and the manifest changes their version when they are, so the path and version identify the contents
+    :param path: The path of the image file
+    :param size: The size the image is decoded at
+    :return: The key
+    """
+    return path, size, manifest.manifest.version(path)
+
+
+# The pixmap cache shared by every page
+pixmaps: PixmapCache = PixmapCache(gvars.PIXMAP_CACHE_BYTES)
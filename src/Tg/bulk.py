@@ -0,0 +1,68 @@
+import sys
+from logging import debug, info, warning, error, critical
+from typing import Callable
+
+from src.Tg import commands, manifest, stickers
+from src.Tg.stickers import TgSticker, TgStickerPack
+
+
+def delete_stickers(pack: TgStickerPack, targets: list[TgSticker],
+                    callback: Callable[[commands.CommandQueue], None] = None,
+                    on_synced: Callable[[TgStickerPack], None] = None) -> int:
+    """
+    Queues the Sticker bot operations that delete stickers from a pack, and removes them from the local copy of the
+    pack right away instead of waiting for Sticker bot. If an operation fails, the pack is synced with Telegram once the
+    queue is done with it, which brings the sticker back
+    :param pack: The pack
+    :param targets: The stickers to delete
+    :param callback: Passed to commands.queue.start, e.g. to tell the user about operations in commands.queue.failed
+    (Default is None, if None then no callback)
+    :param on_synced: Called with the pack after it was synced because an operation failed (Default is None, if None
+    then nothing is called)
+    :return: The number of operations that were queued
+    """
+    ids: set[int] = {s.doc_id for s in targets}
+    targets = [s for s in pack.stickers if s.doc_id in ids]
+    if len(targets) == 0: return 0
+    info(f'Deleting {len(targets)} stickers from pack {pack.sn}')
+    commands.queue.add([commands.Operation('delete_sticker', sn=pack.sn, sticker=commands.sticker_ref(s))
+                        for s in targets])
+    commands.queue.start(commands.sync_on_failure(pack, on_synced))
+    commands.queue.start(callback)
+    pack.stickers = [s for s in pack.stickers if s.doc_id not in ids]
+    pack.size = len(pack.stickers)
+    pack.hash = 0
+    stickers.serialize_pack(pack)
+    for s in targets:
+        for path in s.get_cached_paths(): manifest.manifest.remove_file(path)
+    return len(targets)
+
+
+def set_emojis(pack: TgStickerPack, targets: list[TgSticker], emojis: str,
+               callback: Callable[[commands.CommandQueue], None] = None,
+               on_synced: Callable[[TgStickerPack], None] = None) -> int:
+    """
+    Queues the Sticker bot operations that change the emojis of stickers in a pack, and changes them in the local copy
+    of the pack right away instead of waiting for Sticker bot. If an operation fails, the pack is synced with Telegram
+    once the queue is done with it, which brings the old emojis back
+    :param pack: The pack
+    :param targets: The stickers to change
+    :param emojis: The new emojis of every one of the stickers
+    :param callback: Passed to commands.queue.start, e.g. to tell the user about operations in commands.queue.failed
+    (Default is None, if None then no callback)
+    :param on_synced: Called with the pack after it was synced because an operation failed (Default is None, if None
+    then nothing is called)
+    :return: The number of operations that were queued
+    """
+    ids: set[int] = {s.doc_id for s in targets}
+    targets = [s for s in pack.stickers if s.doc_id in ids and s.emojis != emojis]
+    if len(targets) == 0: return 0
+    info(f'Setting the emojis of {len(targets)} stickers in pack {pack.sn} to {emojis}')
+    commands.queue.add([commands.Operation('edit_sticker', sn=pack.sn, sticker=commands.sticker_ref(s),
+                                           emojis=emojis) for s in targets])
+    commands.queue.start(commands.sync_on_failure(pack, on_synced))
+    commands.queue.start(callback)
+    for s in targets: s.emojis = sys.intern(emojis)
+    pack.hash = 0
+    stickers.serialize_pack(pack)
+    return len(targets)
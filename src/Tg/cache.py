@@ -0,0 +1,183 @@
+import asyncio
+import os
+import shutil
+import time
+from logging import debug, info, warning, error, critical
+from typing import Union
+
+from src import gvars
+from src.Tg import manifest, store
+
+
+class CacheManager:
+    """
+    Keeps the sticker cache under a size budget by deleting the least recently used sticker files, and deletes the
+    folders of packs the user doesn't own anymore. Only the files of the FULL tier are evicted: pack metadata and the
+    files shown as pack thumbnails are kept, and unfinished downloads are kept until they are PARTIAL_MAX_AGE old
+    """
+    def __init__(self, root: str, budget: int):
+        """
+        Instantiates a CacheManager object
+        :param root: The cache folder that holds one folder per pack (must end with a separator)
+        :param budget: The maximum size of the cache in bytes
+        """
+        self.root: str = root
+        self.budget: int = budget
+        self._touched: dict[str, float] = {}  # Access times that haven't been written to the database yet
+        self.used: int = 0  # The size of the cache in bytes when the last collection finished
+        self.evicted: set[str] = set()  # Packs that were taken down to the THUMB tier by eviction this session
+        self._running: Union[asyncio.Task, None] = None
+
+    def touch(self, path: Union[str, None]):
+        """
+        Records that a cached file was used
+        :param path: The path of the file (None is ignored so that the result of get_file_path can be passed directly)
+        :return: None
+        """
+        if path is not None: self._touched[path] = time.time()
+
+    def flush(self):
+        """
+        Writes the recorded access times to the database
+        :return: None
+        """
+        if len(self._touched) == 0: return
+        debug(f'Writing {len(self._touched)} cache access times to the database')
+        store.store.set_access_times(self._touched.items())
+        self._touched.clear()
+
+    async def collect(self, owned: list[str] = None) -> int:
+        """
+        Deletes least recently used sticker files until the cache is under budget, and deletes the folders of packs
+        that aren't owned. The file system work runs in a thread so that it doesn't block the event loop. If a
+        collection is already running, this waits for it instead of starting another
+        :param owned: The shortnames of the packs the user owns (Default is None, if None then no folders are deleted)
+        :return: The number of bytes reclaimed
+        """
+        if self._running is None or self._running.done():
+            self._running = asyncio.ensure_future(self.__collect(owned))
+        return await asyncio.shield(self._running)
+
+    async def __collect(self, owned: Union[list[str], None]) -> int:
+        """
+        Does the work of collect()
+        :param owned: The shortnames of the packs the user owns, or None
+        :return: The number of bytes reclaimed
+        """
+        self.flush()
+        atimes: dict[str, float] = store.store.get_access_times()
+        thumb_docs: dict[str, int] = store.store.get_thumb_stickers()
+        keep: Union[set[str], None] = None if owned is None or len(owned) == 0 else set(owned)
+        info(f'Collecting sticker cache with a budget of {self.budget} bytes')
+        reclaimed, files, packs, self.used = await asyncio.get_event_loop().run_in_executor(
+            None, _collect, self.root, self.budget, atimes, keep, thumb_docs, time.time() - gvars.PARTIAL_MAX_AGE)
+
+        # Database and manifest updates happen back on the event loop's thread
+        for f in files: manifest.manifest.discard(f)
+        capped: set[str] = {os.path.basename(os.path.dirname(f)) for f in files
+                            if not manifest.is_partial(os.path.basename(f))}
+        store.store.cap_tiers(capped, store.Tier.THUMB)
+        self.evicted |= capped
+        for sn in packs:
+            manifest.manifest.invalidate(sn)
+            store.store.delete_pack(sn)
+        store.store.forget_access(files)
+        store.store.forget_access_in([self.root + sn + os.sep for sn in packs])
+        info(f'Sticker cache collection reclaimed {reclaimed} bytes ({len(files)} files, {len(packs)} pack folders)')
+        return reclaimed
+
+
+def is_protected(name: str, thumb_doc: int = None) -> bool:
+    """
+    Checks if a file in a pack folder belongs to the META or THUMB tier, so it must never be evicted. Evicting any other
+    file only takes the pack down to the THUMB tier
+    :param name: The name of the file
+    :param thumb_doc: The document id of the sticker shown as the pack thumbnail, if the pack doesn't have a thumbnail
+    (Default is None)
+    :return: Whether the file is protected
+    """
+    if name.startswith('thumb.') or name.endswith('.json'): return True
+    return thumb_doc is not None and (name.startswith(f'{thumb_doc}.') or name.startswith(f'{thumb_doc}_'))
+
+
+def _collect(root: str, budget: int, atimes: dict[str, float], owned: Union[set[str], None],
+             thumb_docs: dict[str, int], expired: float) -> tuple[int, list[str], list[str], int]:
+    """
+    Does the file system work of CacheManager.collect. Runs in a worker thread, so it must not touch the database
+    :param root: The cache folder
+    :param budget: The maximum size of the cache in bytes
+    :param atimes: The last access time of each file path that has one recorded
+    :param owned: The shortnames of the owned packs, or None to keep every pack folder
+    :param thumb_docs: The document id of the sticker shown as the pack thumbnail of each pack that doesn't have one
+    :param expired: Unfinished downloads last modified before this time are deleted
+    :return: (bytes reclaimed, paths of deleted files, shortnames of deleted pack folders, size of the cache after)
+    """
+    reclaimed: int = 0
+    files: list[str] = []
+    packs: list[str] = []
+    total: int = 0
+    entries: list[tuple[float, int, str]] = []  # (last access, size, path) of every file that can be evicted
+    with os.scandir(root) as it:
+        for d in it:
+            if not d.is_dir(): continue
+            if owned is not None and d.name not in owned:
+                size: int = _folder_size(d.path)
+                debug(f'Deleting cache folder of pack {d.name} that is no longer owned ({size} bytes)')
+                shutil.rmtree(d.path, ignore_errors=True)
+                reclaimed += size
+                packs.append(d.name)
+                continue
+            with os.scandir(d.path) as pit:
+                for f in pit:
+                    if not f.is_file(): continue
+                    st: os.stat_result = f.stat()
+                    if manifest.is_partial(f.name):
+                        if st.st_mtime >= expired or not _remove(f.path):
+                            total += st.st_size
+                            continue
+                        debug(f'Deleted unfinished download {f.path}')
+                        reclaimed += st.st_size
+                        files.append(f.path)
+                        continue
+                    total += st.st_size
+                    if not is_protected(f.name, thumb_docs.get(d.name)):
+                        entries.append((atimes.get(f.path, st.st_mtime), st.st_size, f.path))
+    if total <= budget: return reclaimed, files, packs, total
+
+    target: int = int(budget * 0.9)  # Evict a little past the budget so that the next few downloads don't trigger it
+    entries.sort()
+    for atime, size, path in entries:
+        if total <= target: break
+        if not _remove(path): continue
+        total -= size
+        reclaimed += size
+        files.append(path)
+    return reclaimed, files, packs, total
+
+
+def _remove(path: str) -> bool:
+    """
+    Deletes a cached file
+    :param path: The path of the file
+    :return: Whether the file was deleted
+    """
+    try:
+        os.remove(path)
+        return True
+    except OSError as e:
+        warning(f'Could not evict {path}: {e}')
+        return False
+
+
+def _folder_size(path: str) -> int:
+    """
+    Adds up the sizes of the files in a folder (not recursive)
+    :param path: The folder
+    :return: The total size in bytes
+    """
+    with os.scandir(path) as it:
+        return sum(f.stat().st_size for f in it if f.is_file())
+
+
+# The manager of the sticker cache
+manager: CacheManager = CacheManager(gvars.CACHEPATH, gvars.CACHE_BUDGET_BYTES)
@@ -0,0 +1,484 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from logging import debug, info, warning, error, critical
+from typing import Callable, Union
+
+from telethon.tl.types import InputDocument, Message, TypeInputFile
+
+from src import gvars
+from src.Tg import tgapi
+from src.Tg.stickers import TgSticker, TgStickerPack
+
+
+class StepError(Exception):
+    """
+    Raised when Sticker bot doesn't reply to a step of an operation the way the step expects
+    """
+
+
+class Step:
+    """
+    One message of a conversation with Sticker bot, and the reply it should get
+    """
+    def __init__(self, send: Union[str, InputDocument], expect: tuple[str, ...], upload: bool = False,
+                 keyboard: bool = False, choice: bool = False):
+        """
+        Instantiates a Step object
+        :param send: What to send: text, a sticker, or the path of a file if upload is True
+        :param expect: Pieces of text, any of which in the reply (ignoring case) means that the step worked. They must
+        only appear in the reply to this step when it works, not in error replies or the prompts of other steps
+        :param upload: Whether send is the path of a file to upload and send (Default is False)
+        :param keyboard: Whether the reply must come with a keyboard of choices (Default is False)
+        :param choice: Whether send must be one of the choices on the keyboard of the reply before (Default is False)
+        """
+        self.send: Union[str, InputDocument] = send
+        self.expect: tuple[str, ...] = expect
+        self.upload: bool = upload
+        self.keyboard: bool = keyboard
+        self.choice: bool = choice
+
+    def accepts(self, reply: Message) -> bool:
+        """
+        Checks if a reply from Sticker bot is the one this step expects
+        :param reply: The reply
+        :return: Whether the step worked
+        """
+        text: str = (reply.message or '').lower()
+        if is_error(reply) or not any(e in text for e in self.expect): return False
+        return not self.keyboard or len(tgapi.reply_buttons(reply)) > 0
+
+
+def is_error(reply: Message) -> bool:
+    """
+    Checks if a reply from Sticker bot is one of the replies it gives when it refuses a message
+    :param reply: The reply
+    :return: Whether the reply is an error
+    """
+    text: str = (reply.message or '').lower()
+    return any(e in text for e in _ERRORS)
+
+
+class Operation:
+    """
+    A conversation with Sticker bot that does one thing (e.g. adds a sticker to a pack), as a list of steps. Operations
+    are made from a kind and JSON serializable arguments, so they can be saved to a checkpoint and made again later
+    """
+    def __init__(self, kind: str, group: str = None, **args):
+        """
+        Instantiates an Operation object
+        :param kind: The kind of operation, one of the keys of KINDS
+        :param group: Operations that only make sense if the ones before them in the same group worked (e.g. the moves
+        of a reorder). If one is given up on, the rest of its group is dropped (Default is None, if None then no group)
+        :param args: The arguments of the function in KINDS that makes the steps
+        """
+        self.kind: str = kind
+        self.group: Union[str, None] = group
+        self.args: dict = args
+        steps, session, prefix = KINDS[kind](**args)
+        self.steps: list[Step] = steps
+        self.session: Union[str, None] = session  # Operations with the same session can skip the steps that open it
+        self.prefix: int = prefix  # The number of steps that open the session
+        self.attempts: int = 0
+        self.error: Union[str, None] = None
+
+    def __repr__(self) -> str:
+        return f'Operation({self.kind}, {self.args})'
+
+    def files(self) -> list[str]:
+        """
+        Gets the files that this operation uploads
+        :return: The paths of the files
+        """
+        return [s.send for s in self.steps if s.upload]
+
+    def to_dict(self) -> dict:
+        """
+        Gets what is saved to the checkpoint for this operation
+        :return: A JSON serializable dictionary
+        """
+        return {'kind': self.kind, 'group': self.group, 'args': self.args}
+
+
+def sticker_ref(sticker: TgSticker) -> dict:
+    """
+    Makes the JSON serializable reference to a sticker that operations take as an argument
+    :param sticker: The sticker
+    :return: The reference
+    """
+    return {'id': sticker.doc_id, 'access_hash': sticker.doc_access_hash, 'fileref': sticker.doc_fileref.hex()}
+
+
+def _doc(ref: dict) -> InputDocument:
+    """
+    Gets the sticker a reference refers to, so it can be sent to Sticker bot
+    :param ref: The reference made by sticker_ref
+    :return: The sticker as an InputDocument
+    """
+    return InputDocument(ref['id'], ref['access_hash'], bytes.fromhex(ref['fileref']))
+
+
+# Pieces of the replies Sticker bot gives when it refuses a message (e.g. "Sorry, this short name is already taken.")
+_ERRORS: tuple[str, ...] = ('sorry', 'invalid', 'not valid', "can't", 'cannot', 'unacceptable', 'already taken',
+                            'try again', 'too long', 'too many', 'not found', 'not in the')
+
+# The prompt Sticker bot gives after a command that works on an existing pack
+_CHOOSE_SET: tuple[str, ...] = ('choose a sticker set', 'choose a set', 'choose the set')
+
+
+# Functions that make the steps of each kind of operation. They return (steps, session, prefix), see Operation
+# Replies are matched on a few phrases of what Sticker bot says when a step works, in case it changes its wording a
+# little. Each phrase is specific to the reply it matches, so that a prompt or error doesn't pass for it
+
+def _new_pack(title: str, sn: str, path: str, emojis: str, animated: bool = False) \
+        -> tuple[list[Step], Union[str, None], int]:
+    return [
+        Step(gvars.SB_NEW_ANIMATED if animated else gvars.SB_NEW, ('choose a name', 'call it')),
+        Step(title, ('now send me the sticker', 'send me the sticker')),
+        Step(path, ('send me an emoji', 'corresponds to'), upload=True),
+        Step(emojis, ('congratulations', 'stickers in the set', 'stickers in the pack')),
+        Step(gvars.SB_PUBLISH, ('icon for', gvars.SB_SKIP)),
+        Step(gvars.SB_SKIP, ('provide a short name', 'choose a short name', 'short name for')),
+        Step(sn, ('kaboom', 'published your')),
+    ], None, 0
+
+
+def _add_sticker(sn: str, path: str, emojis: str) -> tuple[list[Step], Union[str, None], int]:
+    # Sticker bot keeps adding to the same pack until it's told otherwise, so a run of additions to a pack only has to
+    # choose the pack once
+    return [
+        Step(gvars.SB_ADD, _CHOOSE_SET, keyboard=True),
+        Step(sn, ('now send me the sticker', 'send me the sticker'), choice=True),
+        Step(path, ('send me an emoji', 'corresponds to'), upload=True),
+        Step(emojis, ('added your sticker', 'there we go')),
+    ], f'{gvars.SB_ADD} {sn}', 2
+
+
+def _delete_sticker(sn: str, sticker: dict) -> tuple[list[Step], Union[str, None], int]:
+    return [
+        Step(gvars.SB_DELETE, _CHOOSE_SET, keyboard=True),
+        Step(sn, ('want to delete',), choice=True),
+        Step(_doc(sticker), ('deleted that sticker', 'have deleted', "i've deleted")),
+    ], None, 0
+
+
+def _edit_sticker(sn: str, sticker: dict, emojis: str) -> tuple[list[Step], Union[str, None], int]:
+    return [
+        Step(gvars.SB_EDIT, _CHOOSE_SET, keyboard=True),
+        Step(sn, ('want to edit',), choice=True),
+        Step(_doc(sticker), ('current emoji', 'new emoji')),
+        Step(emojis, ('emoji updated', 'emojis updated', 'updated the emoji', 'have edited', "i've edited")),
+    ], None, 0
+
+
+def _order_sticker(sn: str, sticker: dict, target: dict) -> tuple[list[Step], Union[str, None], int]:
+    # The sticker is moved to the position of the target sticker, which moves one place towards where it came from
+    return [
+        Step(gvars.SB_ORDER, _CHOOSE_SET, keyboard=True),
+        Step(sn, ('want to move',), choice=True),
+        Step(_doc(sticker), ('new position', 'place it')),
+        Step(_doc(target), ('have moved', "i've moved", 'changed the position', 'position changed', 'reordered')),
+    ], None, 0
+
+
+def _set_icon(sn: str, sticker: dict) -> tuple[list[Step], Union[str, None], int]:
+    return [
+        Step(gvars.SB_SETICON, _CHOOSE_SET, keyboard=True),
+        Step(sn, ('send me a sticker', 'send me the sticker', 'use as the icon'), choice=True),
+        Step(_doc(sticker), ('icon updated', 'icon has been', 'updated the icon', 'changed the icon', 'icon was')),
+    ], None, 0
+
+
+# The kinds of operations, and the functions that make their steps
+KINDS: dict[str, Callable[..., tuple[list[Step], Union[str, None], int]]] = {
+    'new_pack': _new_pack,
+    'add_sticker': _add_sticker,
+    'delete_sticker': _delete_sticker,
+    'edit_sticker': _edit_sticker,
+    'order_sticker': _order_sticker,
+    'set_icon': _set_icon,
+}
+
+
+class CommandQueue:
+    """
+    Runs operations on Sticker bot one after another with as little waiting as possible between them. The files of the
+    next operations are uploaded while the current one runs, and additions to the same pack share one conversation.
+    A step that fails is recovered from with /cancel and its operation is retried. The operations that haven't finished
+    are saved to a checkpoint after every operation, so a batch can be resumed after the app quits
+    """
+    def __init__(self, checkpoint: str, retries: int = gvars.SB_RETRIES, depth: int = gvars.SB_PIPELINE_DEPTH):
+        """
+        Instantiates a CommandQueue object
+        :param checkpoint: The path of the checkpoint file
+        :param retries: The number of times an operation is retried before it is given up on
+        :param depth: The number of upcoming operations whose files are uploaded ahead of time
+        """
+        self.checkpoint: str = checkpoint
+        self.retries: int = retries
+        self.depth: int = depth
+        self.ops: deque[Operation] = deque()
+        self.done: int = 0  # Operations that finished since the queue was started
+        self.failed: list[Operation] = []  # Operations that were given up on
+        self._session: Union[str, None] = None  # The conversation Sticker bot is known to be in
+        self._uploads: dict[str, asyncio.Task] = {}
+        self._callbacks: list[Callable[['CommandQueue'], None]] = []
+        self._task: Union[asyncio.Task, None] = None
+        self._started: float = 0.0
+        self._stopped: Union[float, None] = None
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    def add(self, ops: list[Operation]):
+        """
+        Adds operations to the end of the queue and saves the checkpoint. Use start to run them
+        :param ops: The operations
+        :return: None
+        """
+        self.ops.extend(ops)
+        self.save()
+
+    def resume(self) -> int:
+        """
+        Adds the operations that were saved to the checkpoint by an earlier run that didn't finish
+        :return: The number of operations added
+        """
+        if len(self.ops) > 0 or not os.path.exists(self.checkpoint): return 0
+        try:
+            with open(self.checkpoint, 'r') as f:
+                saved: list[dict] = json.load(f)
+        except (OSError, ValueError) as e:
+            warning(f'Could not read the Sticker bot checkpoint: {e}')
+            return 0
+        for d in saved:
+            try:
+                self.ops.append(Operation(d['kind'], d.get('group'), **d['args']))
+            except (KeyError, TypeError, ValueError) as e:
+                warning(f'Skipping a saved Sticker bot operation that could not be read ({d}): {e}')
+        info(f'Resuming {len(self.ops)} Sticker bot operations from the checkpoint')
+        return len(self.ops)
+
+    def save(self):
+        """
+        Saves the operations that haven't finished to the checkpoint, or deletes it if there aren't any
+        :return: None
+        """
+        if len(self.ops) == 0:
+            if os.path.exists(self.checkpoint): os.remove(self.checkpoint)
+            return
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            json.dump([op.to_dict() for op in self.ops], f)
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def start(self, callback: Callable[['CommandQueue'], None] = None) -> asyncio.Task:
+        """
+        Starts running the operations in the queue, unless they are already running
+        :param callback: Called with the queue after every operation that finishes or is given up on, until the queue is
+        empty. It is added even if the queue is already running (Default is None, if None then no callback)
+        :return: The task running the queue, which finishes once the queue is empty
+        """
+        if callback is not None: self._callbacks.append(callback)
+        if not self.running(): self._task = asyncio.ensure_future(self.__run())
+        return self._task
+
+    def stop(self):
+        """
+        Stops running operations. The operation that was running is tried again from the start when the queue is
+        started again
+        :return: None
+        """
+        if self.running(): self._task.cancel()
+
+    def running(self) -> bool:
+        """
+        Checks if the queue is running
+        :return: Whether the queue is running
+        """
+        return self._task is not None and not self._task.done()
+
+    def ops_per_minute(self) -> float:
+        """
+        Gets the throughput of the queue since it was started
+        :return: The number of operations that finished per minute
+        """
+        elapsed: float = (time.monotonic() if self._stopped is None else self._stopped) - self._started
+        return 0.0 if elapsed <= 0 else self.done * 60 / elapsed
+
+    async def __run(self):
+        """
+        Runs operations until the queue is empty, calling the callbacks after every operation that finishes or is given
+        up on
+        :return: None
+        """
+        self.done, self.failed = 0, []
+        self._started, self._stopped = time.monotonic(), None
+        info(f'Running {len(self.ops)} Sticker bot operations')
+        try:
+            while len(self.ops) > 0:
+                op: Operation = self.ops[0]
+                self.__prefetch()
+                try:
+                    await self.__attempt(op)
+                except Exception as e:  # Unexpected replies, timeouts and failed uploads are all retried
+                    op.attempts += 1
+                    warning(f'{op} failed on attempt {op.attempts}: {e}')
+                    self.__forget(op)
+                    await self.__cancel()
+                    if op.attempts <= self.retries: continue
+                    error(f'Giving up on {op}')
+                    op.error = str(e)
+                    self.failed.append(op)
+                    self.__drop_group(op)
+                else:
+                    self.done += 1
+                    self.__forget(op)
+                self.ops.popleft()
+                self.save()
+                for callback in list(self._callbacks): callback(self)
+        finally:
+            self._stopped = time.monotonic()
+            for t in self._uploads.values(): t.cancel()
+            self._uploads.clear()
+            self._callbacks.clear()
+            self._session = None
+        info(f'Finished {self.done} Sticker bot operations at {self.ops_per_minute():.1f} per minute, '
+             f'{len(self.failed)} failed')
+
+    async def __attempt(self, op: Operation):
+        """
+        Runs the steps of an operation
+        :param op: The operation
+        :return: None
+        :raises StepError: If Sticker bot replies to a step in a way the step doesn't expect
+        :raises asyncio.TimeoutError: If Sticker bot doesn't reply in time
+        """
+        start: int = op.prefix if op.session is not None and op.session == self._session else 0
+        self._session = None  # Until the operation finishes, the conversation Sticker bot is in isn't known
+        prev: Union[Message, None] = None
+        for i, step in enumerate(op.steps[start:], start):
+            if step.choice and prev is not None and step.send not in tgapi.reply_buttons(prev):
+                raise StepError(f'{step.send} is not one of the choices Sticker bot gave for step {i}')
+            inpt: Union[str, InputDocument, TypeInputFile] = \
+                await self.__upload(step.send) if step.upload else step.send
+            reply: Message = await tgapi.send_sb_await_reply(inpt)
+            if is_error(reply): raise StepError(f'Sticker bot refused step {i}: {reply.message}')
+            if not step.accepts(reply): raise StepError(f'Unexpected reply to step {i}: {reply.message}')
+            prev = reply
+        self._session = op.session
+
+    def __drop_group(self, op: Operation):
+        """
+        Drops the operations after one that was given up on that are in its group, since they relied on it working
+        :param op: The operation that was given up on (the first in the queue)
+        :return: None
+        """
+        if op.group is None: return
+        rest: list[Operation] = [o for o in list(self.ops)[1:] if o.group == op.group]
+        if len(rest) == 0: return
+        warning(f'Dropping {len(rest)} operations of {op.group} after giving up on {op}')
+        for o in rest:
+            self.ops.remove(o)
+            self.__forget(o)
+            o.error = f'Dropped because an earlier {op.kind} of the same group failed'
+        self.failed.extend(rest)
+
+    def __prefetch(self):
+        """
+        Starts uploading the files of the current operation and the next ones, so they are ready when they are needed
+        :return: None
+        """
+        for i in range(min(len(self.ops), self.depth + 1)):
+            for path in self.ops[i].files(): self.__upload(path)
+
+    def __upload(self, path: str) -> asyncio.Task:
+        """
+        Gets the upload of a file, starting it if it hasn't been started
+        :param path: The path of the file
+        :return: The task uploading the file
+        """
+        if path not in self._uploads:
+            debug(f'Uploading {path} ahead of its Sticker bot operation')
+            self._uploads[path] = asyncio.ensure_future(tgapi.upload_file(path))
+        return self._uploads[path]
+
+    def __forget(self, op: Operation):
+        """
+        Drops the uploads of an operation, after it finished or so they are uploaded again when it is retried
+        :param op: The operation
+        :return: None
+        """
+        for path in op.files():
+            t: Union[asyncio.Task, None] = self._uploads.pop(path, None)
+            if t is not None and not t.done(): t.cancel()
+
+    async def __cancel(self):
+        """
+        Sends /cancel to get Sticker bot out of whatever conversation it was in. Failing to is only logged, so that the
+        operation that failed is still retried or given up on
+        :return: None
+        """
+        self._session = None
+        try:
+            await tgapi.send_sb_await_reply(gvars.SB_CANCEL)
+        except asyncio.TimeoutError:
+            warning('Sticker bot did not reply to /cancel')
+        except Exception as e:  # e.g. a network error or a flood wait, which would otherwise stop the whole queue
+            warning(f'Could not send /cancel to Sticker bot: {e}')
+
+
+# The queue that every Sticker bot operation goes through
+queue: CommandQueue = CommandQueue(gvars.get_current_user_path() + gvars.SB_CHECKPOINT_FNAME)
+
+# Packs whose local copy was changed by operations that were given up on, and that haven't been synced since
+_unsynced: set[str] = set()
+
+
+def needs_sync(sn: str) -> bool:
+    """
+    Checks if the local copy of a pack may not match Telegram because operations on it were given up on. Changes that
+    are planned against the local copy (e.g. reorders) must wait until it is synced
+    :param sn: The shortname of the pack
+    :return: Whether the pack is waiting to be synced
+    """
+    return sn in _unsynced
+
+
+def sync_on_failure(pack: TgStickerPack, on_synced: Callable[[TgStickerPack], None] = None) \
+        -> Callable[[CommandQueue], None]:
+    """
+    Makes a queue callback that syncs a pack with Telegram after operations on it are given up on, since the local copy
+    of the pack was changed as if they had worked. The sync waits until no more operations on the pack are queued
+    :param pack: The pack
+    :param on_synced: Called with the pack after it was synced (Default is None, if None then nothing is called)
+    :return: The callback, to pass to CommandQueue.start
+    """
+    seen: set[Operation] = set()
+
+    def callback(q: CommandQueue):
+        new: list[Operation] = [op for op in q.failed if op.args.get('sn') == pack.sn and op not in seen]
+        seen.update(new)
+        if len(new) > 0: _unsynced.add(pack.sn)
+        if pack.sn not in _unsynced or any(op.args.get('sn') == pack.sn for op in q.ops): return
+        asyncio.ensure_future(_sync(pack, on_synced))
+
+    return callback
+
+
+async def _sync(pack: TgStickerPack, on_synced: Union[Callable[[TgStickerPack], None], None]):
+    """
+    Syncs a pack that operations failed on
+    :param pack: The pack
+    :param on_synced: Called with the pack after it was synced, or None
+    :return: None
+    """
+    info(f'Syncing pack {pack.sn} after Sticker bot operations on it failed')
+    try:
+        await pack.sync()
+    except Exception as e:
+        error(f'Could not sync pack {pack.sn}: {e}')  # It stays in _unsynced, so the next failure tries again
+        return
+    _unsynced.discard(pack.sn)
+    if on_synced is not None: on_synced(pack)
@@ -0,0 +1,166 @@
+import os
+from logging import debug, info, warning, error, critical
+from typing import Union
+
+from src import gvars
+
+
+class CacheManifest:
+    """
+    An in-memory listing of the files in each pack folder of the cache, so that finding a sticker's file doesn't need a
+    filesystem call. Each pack folder is read once with os.scandir the first time it is needed
+    """
+    def __init__(self, root: str):
+        """
+        Instantiates a CacheManifest object
+        :param root: The cache folder that holds one folder per pack (must end with a separator)
+        """
+        self.root: str = root
+        self._files: dict[str, set[str]] = {}  # Pack shortname -> names of the files in the pack's folder
+        self._mtimes: dict[str, float] = {}  # Pack shortname -> modification time of the folder when it was read
+        self._versions: dict[str, int] = {}  # Path -> number of times the file was replaced or removed
+
+    def __scan(self, sn: str) -> set[str]:
+        """
+        Reads the contents of a pack folder into the manifest
+        :param sn: The shortname of the pack
+        :return: The names of the files in the folder
+        """
+        debug(f'Scanning cache folder of pack {sn}')
+        files: set[str] = set()
+        try:
+            with os.scandir(self.root + sn) as it:
+                for e in it:
+                    if e.is_file() and not is_partial(e.name): files.add(e.name)
+            self._mtimes[sn] = os.stat(self.root + sn).st_mtime
+        except FileNotFoundError:
+            self._mtimes[sn] = 0
+        self._files[sn] = files
+        return files
+
+    def files(self, sn: str) -> set[str]:
+        """
+        Gets the names of the files in a pack folder
+        :param sn: The shortname of the pack
+        :return: The set of file names. Don't modify it
+        """
+        files: Union[set[str], None] = self._files.get(sn)
+        return self.__scan(sn) if files is None else files
+
+    def resolve(self, sn: str, stem: str, exts: tuple[str, ...]) -> Union[str, None]:
+        """
+        Finds the path of a file in a pack folder, trying each extension in order
+        :param sn: The shortname of the pack
+        :param stem: The name of the file without the extension
+        :param exts: The extensions to try, without the dot
+        :return: The path of the first file that exists, or None if none of them do
+        """
+        files: set[str] = self.files(sn)
+        for ext in exts:
+            if stem + '.' + ext in files: return self.root + sn + os.sep + stem + '.' + ext
+        return None
+
+    def add(self, path: str):
+        """
+        Records that a file was written to the cache
+        :param path: The path of the file
+        :return: None
+        """
+        sn, name = self.__split(path)
+        if sn is None: return
+        files: Union[set[str], None] = self._files.get(sn)
+        if files is None or name in files: self.__bump(path)
+        if files is not None: files.add(name)  # If the folder wasn't read yet, it will be read when it's needed
+
+    def discard(self, path: str):
+        """
+        Records that a file was removed from the cache
+        :param path: The path of the file
+        :return: None
+        """
+        sn, name = self.__split(path)
+        if sn is not None: self.__bump(path)
+        if sn is not None and sn in self._files: self._files[sn].discard(name)
+
+    def version(self, path: str) -> int:
+        """
+        Gets a number that changes every time a cached file is replaced or removed. Cache files are only ever written
+        whole (see tgapi.download_resumable), so anything derived from a file stays valid while its version is the same
+        :param path: The path of the file
+        :return: The version of the file
+        """
+        return self._versions.get(path, 0)
+
+    def __bump(self, path: str):
+        """
+        Changes the version of a file
+        :param path: The path of the file
+        :return: None
+        """
+        self._versions[path] = self._versions.get(path, 0) + 1
+
+    def remove_file(self, path: str):
+        """
+        Deletes a file from the cache and the manifest
+        :param path: The path of the file
+        :return: None
+        """
+        debug(f'Removing {path} from cache')
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            warning(f'{path} was already removed from the cache')
+        self.discard(path)
+
+    def invalidate(self, sn: str = None):
+        """
+        Forgets what is in a pack folder (or every folder) so that it's read again the next time it's needed. Call this
+        when files are changed by something other than this program
+        :param sn: The shortname of the pack (Default is None, if None then forget every pack)
+        :return: None
+        """
+        if sn is None:
+            self._files.clear()
+            self._mtimes.clear()
+        else:
+            self._files.pop(sn, None)
+            self._mtimes.pop(sn, None)
+
+    def refresh(self, sn: str) -> bool:
+        """
+        Reads a pack folder again if it was modified since it was last read. This costs a single stat call
+        :param sn: The shortname of the pack
+        :return: Whether the folder had to be read again
+        """
+        if sn not in self._files: return False
+        try:
+            mtime: float = os.stat(self.root + sn).st_mtime
+        except FileNotFoundError:
+            mtime = 0
+        if mtime == self._mtimes.get(sn): return False
+        self.__scan(sn)
+        return True
+
+    def __split(self, path: str) -> tuple[Union[str, None], str]:
+        """
+        Splits a path in the cache into the pack shortname and the file name
+        :param path: The path of the file
+        :return: (shortname, file name), shortname is None if the path isn't in a pack folder of the cache
+        """
+        folder, name = os.path.split(path)
+        if os.path.normpath(os.path.dirname(folder)) != os.path.normpath(self.root): return None, name
+        return os.path.basename(folder), name
+
+
+def is_partial(name: str) -> bool:
+    """
+    Checks if a file name belongs to a file that isn't a finished cache entry (including the journals of downloads
+    that haven't finished, see tgapi.download_resumable)
+    :param name: The name of the file
+    :return: Whether the file should be ignored
+    """
+    return name.endswith('.part') or name.endswith('.tmp') or name.endswith('.journal')
+
+
+# The manifest of the sticker cache
+manifest: CacheManifest = CacheManifest(gvars.CACHEPATH)
@@ -0,0 +1,99 @@
+import asyncio
+from logging import debug, info, warning, error, critical
+from typing import Union
+
+from src import gvars
+from src.Tg import cache, scheduler, store, stickers
+
+
+class Prefetcher:
+    """
+    Fetches packs to the FULL tier in the background, one pack at a time, so that opening a pack doesn't have to wait
+    for its stickers. Downloads are queued at BACKGROUND priority, so anything the user is waiting on goes first.
+    Prefetching stops before the cache reaches the point where it would be evicted, so run cache.manager.collect first
+    """
+    def __init__(self):
+        """
+        Instantiates a Prefetcher object
+        """
+        self._task: Union[asyncio.Task, None] = None
+        self._current: Union[tuple[str, asyncio.Task], None] = None  # (shortname, fetch) of the pack being fetched
+        self._preempted: set[str] = set()  # Packs that a page is fetching itself
+
+    def start(self, sns: list[str]):
+        """
+        Starts fetching packs in the background, replacing the packs that were being prefetched
+        :param sns: The shortnames of the packs, in the order to fetch them
+        :return: None
+        """
+        self.stop()
+        self._preempted.clear()
+        self._task = asyncio.ensure_future(self.__run(list(sns)))
+
+    def stop(self):
+        """
+        Stops prefetching. Stickers that were already downloaded are kept
+        :return: None
+        """
+        if self._task is not None and not self._task.done(): self._task.cancel()
+        self._task = None
+
+    def running(self) -> bool:
+        """
+        Checks if packs are being prefetched
+        :return: Whether the prefetcher is running
+        """
+        return self._task is not None and not self._task.done()
+
+    def preempt(self, sn: str):
+        """
+        Takes a pack off the prefetcher because it's about to be fetched at a higher priority. If the pack is being
+        prefetched right now its downloads are cancelled, the files that finished are kept
+        :param sn: The shortname of the pack
+        :return: None
+        """
+        self._preempted.add(sn)
+        if self._current is not None and self._current[0] == sn:
+            debug(f'Prefetch of pack {sn} preempted')
+            self._current[1].cancel()
+
+    async def __run(self, sns: list[str]):
+        """
+        Fetches every pack that isn't at the FULL tier yet, skipping packs that eviction took down a tier, until the
+        cache would go over PREFETCH_BUDGET_FRACTION of its budget
+        :param sns: The shortnames of the packs
+        :return: None
+        """
+        tiers: dict[str, store.Tier] = store.store.get_tiers(sns)
+        todo: list[str] = [sn for sn in sns if sn in tiers and tiers[sn] < store.Tier.FULL
+                           and sn not in cache.manager.evicted]
+        limit: int = int(cache.manager.budget * gvars.PREFETCH_BUDGET_FRACTION)
+        used: int = cache.manager.used
+        info(f'Prefetching {len(todo)} packs in the background')
+        for sn in todo:
+            if sn in self._preempted: continue
+            try:
+                pack: stickers.TgStickerPack = stickers.deserialize_pack(sn)
+            except Exception as e:
+                warning(f'Could not read pack {sn} to prefetch it: {e}')
+                continue
+            need: int = sum(s.filesize for s in pack.stickers)  # At most this much, previews are smaller
+            if used + need > limit:
+                info(f'Stopping prefetch before pack {sn}, the cache is nearly full ({used} of {limit} bytes)')
+                break
+            used += need
+            fetch: asyncio.Task = asyncio.ensure_future(pack.fetch(store.Tier.FULL, scheduler.Priority.BACKGROUND))
+            self._current = (sn, fetch)
+            try:
+                await fetch
+            except asyncio.CancelledError:
+                if not fetch.cancelled() or sn not in self._preempted: raise  # The prefetcher itself was stopped
+            except Exception as e:
+                error(f'Could not prefetch pack {sn}: {e}')
+            finally:
+                self._current = None
+        info('Prefetching finished')
+
+
+# The prefetcher of sticker packs
+prefetcher: Prefetcher = Prefetcher()
@@ -0,0 +1,94 @@
+from bisect import bisect_left
+from logging import debug, info, warning, error, critical
+from typing import Callable
+
+from src import gvars
+from src.Tg import commands, stickers
+from src.Tg.stickers import TgSticker, TgStickerPack
+
+
+def plan_moves(original: list[int], final: list[int]) -> list[tuple[int, int]]:
+    """
+    Plans the fewest single sticker moves that turn one order of a pack into another. The longest run of stickers that
+    are already in the right order relative to each other (the longest increasing subsequence of their old positions)
+    stays where it is, and every other sticker is moved once, in the same way Sticker bot's /ordersticker moves them
+    :param original: The document ids of the stickers in their current order
+    :param final: The same document ids in the order they should end up in
+    :return: The moves in the order to make them, as (document id to move, document id of the sticker currently at the
+    position it should move to)
+    """
+    if sorted(original) != sorted(final): raise ValueError('The final order must have the same stickers as the old')
+    pos: dict[int, int] = {d: i for i, d in enumerate(original)}
+    keep: set[int] = {final[i] for i in _lis([pos[d] for d in final])}
+    current: list[int] = list(original)
+    moves: list[tuple[int, int]] = []
+    for k, d in enumerate(final):
+        if d in keep: continue
+        # Put the sticker right after the one that comes before it in the final order
+        i: int = current.index(d)
+        current.pop(i)
+        j: int = 0 if k == 0 else current.index(final[k - 1]) + 1
+        current.insert(i, d)
+        if j == i: continue
+        moves.append((d, current[j]))  # Whatever is at index j now is pushed aside by the move
+        current.insert(j, current.pop(i))
+    debug(f'Planned {len(moves)} moves to reorder {len(original)} stickers')
+    return moves
+
+
+def _lis(seq: list[int]) -> list[int]:
+    """
+    Finds a longest strictly increasing subsequence
+    :param seq: The sequence
+    :return: The indexes of the items of the subsequence in the sequence, in order
+    """
+    tails: list[int] = []  # The smallest last value of an increasing subsequence of each length
+    tail_idx: list[int] = []  # The index of that value
+    prev: list[int] = [-1] * len(seq)  # The index of the item before each item in its subsequence
+    for i, v in enumerate(seq):
+        n: int = bisect_left(tails, v)
+        if n > 0: prev[i] = tail_idx[n - 1]
+        if n == len(tails):
+            tails.append(v)
+            tail_idx.append(i)
+        else:
+            tails[n] = v
+            tail_idx[n] = i
+    out: list[int] = []
+    i = tail_idx[-1] if len(tail_idx) > 0 else -1
+    while i != -1:
+        out.append(i)
+        i = prev[i]
+    return out[::-1]
+
+
+def submit_order(pack: TgStickerPack, order: list[TgSticker], callback: Callable[[commands.CommandQueue], None] = None,
+                 on_synced: Callable[[TgStickerPack], None] = None) -> int:
+    """
+    Queues the Sticker bot operations that change the order of a pack on Telegram, and saves the new order locally.
+    Each move is planned against the order the moves before it leave, so if one is given up on the rest are dropped and
+    the pack is synced to get the order it really ended up in. Until that sync finishes, no new order can be planned
+    :param pack: The pack
+    :param order: The stickers of the pack in their new order
+    :param callback: Passed to commands.queue.start, e.g. to tell the user about operations in commands.queue.failed
+    (Default is None, if None then no callback)
+    :param on_synced: Called with the pack after it was synced because a move failed (Default is None, if None then
+    nothing is called)
+    :return: The number of moves that were queued
+    """
+    if commands.needs_sync(pack.sn):
+        warning(f'Not reordering pack {pack.sn} until it is synced after a failed Sticker bot operation')
+        return 0
+    by_id: dict[int, TgSticker] = {s.doc_id: s for s in pack.stickers}
+    moves: list[tuple[int, int]] = plan_moves([s.doc_id for s in pack.stickers], [s.doc_id for s in order])
+    if len(moves) == 0: return 0
+    info(f'Reordering pack {pack.sn} with {len(moves)} moves')
+    group: str = f'{gvars.SB_ORDER} {pack.sn}'  # Later reorders of the pack are planned against this one too
+    commands.queue.add([commands.Operation('order_sticker', group, sn=pack.sn, sticker=commands.sticker_ref(by_id[d]),
+                                           target=commands.sticker_ref(by_id[t])) for d, t in moves])
+    commands.queue.start(commands.sync_on_failure(pack, on_synced))
+    commands.queue.start(callback)
+    pack.stickers = list(order)
+    pack.hash = 0
+    stickers.serialize_pack(pack)
+    return len(moves)
@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import itertools
+from enum import IntEnum
+from logging import debug, info, warning, error, critical
+from typing import Awaitable, Callable, Union
+
+from src import gvars
+
+
+class Priority(IntEnum):
+    """
+    The priority of a download in the DownloadScheduler. Lower values are started first
+
+    0 - INTERACTIVE : The user is looking at the screen waiting for this download
+
+    1 - BACKGROUND  : Prefetching that can wait until all interactive downloads have started
+    """
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class _Job:
+    """
+    A single download waiting in (or running from) the DownloadScheduler
+    """
+    def __init__(self, factory: Callable[[], Awaitable], dc_id: int, priority: Priority):
+        """
+        Instantiates a _Job object
+        :param factory: A function that creates the download coroutine when the job is started
+        :param dc_id: The DC that the file is stored on
+        :param priority: The priority of the job
+        """
+        self.factory: Callable[[], Awaitable] = factory
+        self.dc_id: int = dc_id
+        self.priority: Priority = priority
+        self.future: asyncio.Future = asyncio.get_event_loop().create_future()
+        self.task: Union[asyncio.Task, None] = None
+        self.future.add_done_callback(self.__on_future_done)
+
+    def __on_future_done(self, future: asyncio.Future):
+        """
+        Cancels the running download if the job's future is cancelled from outside of the scheduler
+        :param future: The future of this job
+        :return: None
+        """
+        if future.cancelled() and self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+class DownloadBatch:
+    """
+    A group of downloads that can be awaited, reprioritized or cancelled together
+    """
+    def __init__(self, scheduler: 'DownloadScheduler'):
+        """
+        Instantiates a DownloadBatch object. Use DownloadScheduler.batch() instead of calling this directly
+        :param scheduler: The scheduler the jobs in this batch are submitted to
+        """
+        self.scheduler: DownloadScheduler = scheduler
+        self.jobs: list[_Job] = []
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def done(self) -> bool:
+        """
+        Checks if every download in the batch has finished, failed or been cancelled
+        :return: Whether the batch is done
+        """
+        return all(j.future.done() for j in self.jobs)
+
+    async def wait(self, return_exceptions: bool = False) -> list:
+        """
+        Waits for every download in the batch to finish
+        :param return_exceptions: If True, exceptions are returned in the result list instead of being raised
+        :return: The results of the downloads in the order they were submitted
+        """
+        return await asyncio.gather(*[j.future for j in self.jobs], return_exceptions=return_exceptions)
+
+    def cancel(self) -> int:
+        """
+        Cancels every download in the batch that has not finished yet. Queued downloads are never started, and running
+        downloads are cancelled
+        :return: The number of downloads that were cancelled
+        """
+        n: int = 0
+        for j in self.jobs:
+            if j.future.cancel(): n += 1
+        info(f'Cancelled {n} of {len(self.jobs)} downloads in batch')
+        self.scheduler.pump()
+        return n
+
+    def promote(self, priority: Priority = Priority.INTERACTIVE):
+        """
+        Raises the priority of every queued download in the batch. Useful when the user opens something that was
+        being prefetched in the background
+        :param priority: The new priority of the downloads
+        :return: None
+        """
+        for j in self.jobs:
+            if j.task is None and not j.future.done() and priority < j.priority:
+                self.scheduler.requeue(j, priority)
+        self.scheduler.pump()
+
+
+class DownloadScheduler:
+    """
+    Runs downloads with a global concurrency cap, a concurrency cap per DC, and a priority queue
+    """
+    def __init__(self, max_concurrent: int, max_per_dc: int):
+        """
+        Instantiates a DownloadScheduler object
+        :param max_concurrent: The maximum number of downloads running at the same time
+        :param max_per_dc: The maximum number of downloads running at the same time on a single DC
+        """
+        self.max_concurrent: int = max_concurrent
+        self.max_per_dc: int = max_per_dc
+        self._queues: dict[int, list[tuple[int, int, _Job]]] = {}  # One heap of (priority, seq, job) per DC
+        self._seq = itertools.count()
+        self._running: int = 0
+        self._dc_running: dict[int, int] = {}
+
+    def batch(self) -> DownloadBatch:
+        """
+        Creates an empty DownloadBatch on this scheduler
+        :return: The new DownloadBatch
+        """
+        return DownloadBatch(self)
+
+    def submit(self, factory: Callable[[], Awaitable], dc_id: int = 0, priority: Priority = Priority.INTERACTIVE,
+               batch: DownloadBatch = None) -> asyncio.Future:
+        """
+        Queues a download. The download coroutine is only created once the download is allowed to start
+        :param factory: A function that creates the download coroutine
+        :param dc_id: The DC that the file is stored on
+        :param priority: The priority of the download
+        :param batch: The batch to add the download to (Default is None, if None then the download is not batched)
+        :return: A future that resolves to the result of the download
+        """
+        job: _Job = _Job(factory, dc_id, priority)
+        if batch is not None: batch.jobs.append(job)
+        self.requeue(job, priority)
+        self.pump()
+        return job.future
+
+    def pending(self) -> int:
+        """
+        Counts the downloads that are queued but not started. Cancelled downloads may be counted until they are reached
+        :return: The number of queued downloads
+        """
+        return sum(len(q) for q in self._queues.values())
+
+    def running(self) -> int:
+        """
+        Returns the number of downloads currently running
+        :return: The number of downloads currently running
+        """
+        return self._running
+
+    def requeue(self, job: _Job, priority: Priority):
+        """
+        Puts a queued job in the queue with a (new) priority. Old entries of the job are skipped when they are reached
+        :param job: The job to queue
+        :param priority: The priority to queue it with
+        :return: None
+        """
+        job.priority = priority
+        heapq.heappush(self._queues.setdefault(job.dc_id, []), (int(priority), next(self._seq), job))
+
+    def pump(self):
+        """
+        Starts as many queued downloads as the concurrency limits allow, highest priority first
+        :return: None
+        """
+        while self._running < self.max_concurrent:
+            best: Union[tuple[int, int, _Job], None] = None
+            for dc, q in self._queues.items():
+                if self._dc_running.get(dc, 0) >= self.max_per_dc: continue
+                while q and (q[0][2].future.done() or q[0][0] != q[0][2].priority or q[0][2].task is not None):
+                    heapq.heappop(q)  # Drop cancelled and stale entries
+                if q and (best is None or q[0][:2] < best[:2]): best = q[0]
+            if best is None: return
+            heapq.heappop(self._queues[best[2].dc_id])
+            self.__start(best[2])
+
+    def __start(self, job: _Job):
+        """
+        Starts a job
+        :param job: The job to start
+        :return: None
+        """
+        self._running += 1
+        self._dc_running[job.dc_id] = self._dc_running.get(job.dc_id, 0) + 1
+        debug(f'Starting download on DC {job.dc_id} with priority {job.priority.name} '
+              f'({self._running} running, {self.pending()} queued)')
+        job.task = asyncio.ensure_future(job.factory())
+        job.task.add_done_callback(lambda t: self.__finish(job, t))
+
+    def __finish(self, job: _Job, task: asyncio.Task):
+        """
+        Records that a job is done, passes its result on to its future and starts the next jobs
+        :param job: The job that finished
+        :param task: The task the job ran in
+        :return: None
+        """
+        self._running -= 1
+        self._dc_running[job.dc_id] -= 1
+        if not job.future.done():
+            if task.cancelled(): job.future.cancel()
+            elif task.exception() is not None: job.future.set_exception(task.exception())
+            else: job.future.set_result(task.result())
+        elif not task.cancelled() and task.exception() is not None:
+            warning(f'Download on DC {job.dc_id} failed after it was cancelled: {task.exception()}')
+        self.pump()
+
+
+# The scheduler that all Telegram downloads go through
+scheduler: DownloadScheduler = DownloadScheduler(gvars.MAX_CONCURRENT_DOWNLOADS, gvars.MAX_DOWNLOADS_PER_DC)
@@ -1,12 +1,20 @@
+import asyncio
 import os
-from typing import Union
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import compress
+from operator import and_
+from sqlite3 import Row
+from typing import AsyncIterator, Callable, Iterable, Iterator, Union
 
 from telethon.tl.types import Document, DocumentAttributeImageSize, StickerSet, StickerPack, \
-    DocumentAttributeFilename, InputDocumentFileLocation, InputStickerSetThumb, InputStickerSetShortName, PhotoSize
+    DocumentAttributeFilename, InputDocumentFileLocation, InputStickerSetThumb, InputStickerSetShortName, PhotoSize, \
+    PhotoCachedSize, PhotoSizeProgressive, PhotoPathSize
 from telethon.tl.types.messages import StickerSet as ParentSet
 from logging import debug, info, warning, error, critical
 from src import gvars, utils
-from src.Tg import tgapi
+from src.Tg import cache, manifest, tgapi, scheduler, store, thumbnails
 import jsonpickle
 
 
@@ -14,6 +22,9 @@ class TgSticker:
     """
     A Telegram Sticker (Does not include sticker data)
     """
+    __slots__ = ('doc_id', 'doc_access_hash', 'doc_mimetype', 'doc_dc_id', 'doc_fileref', 'filesize', 'filename',
+                 'parent_sn', 'height', 'width', 'emojis', 'thumb_sizes', 'outline')
+
     def __init__(self, doc: Document, emojis: str, parent_sn: str):
         """
         Instantiates a TgSticker Object
@@ -24,45 +35,87 @@ class TgSticker:
         debug(f'Instantiating TgSticker Object under stickerset {parent_sn}')
         self.doc_id: int = doc.id
         self.doc_access_hash: int = doc.access_hash
-        self.doc_mimetype: str = doc.mime_type
+        self.doc_mimetype: str = sys.intern(doc.mime_type)
         self.doc_dc_id: int = doc.dc_id
         self.doc_fileref: bytes = doc.file_reference
         self.filesize: int = doc.size
-        self.filename: str = utils.get_doc_attr(doc, DocumentAttributeFilename).file_name
-        self.parent_sn: str = parent_sn
+        self.filename: str = sys.intern(utils.get_doc_attr(doc, DocumentAttributeFilename).file_name)
+        self.parent_sn: str = sys.intern(parent_sn)
         imgsize: DocumentAttributeImageSize = utils.get_doc_attr(doc, DocumentAttributeImageSize)
         self.height: int = imgsize.h
         self.width: int = imgsize.w
-        self.emojis: str = emojis
+        self.emojis: str = sys.intern(emojis)
+        # The server side previews of the sticker as 'type:WxH' joined by commas (e.g. 'm:128x128')
+        self.thumb_sizes: str = sys.intern(_encode_thumb_sizes(doc.thumbs))
+        # The compressed SVG outline of the sticker that Telegram sends with its metadata (empty if there isn't one)
+        self.outline: bytes = next((t.bytes for t in doc.thumbs or [] if isinstance(t, PhotoPathSize)), b'')
 
-    def get_loc(self) -> InputDocumentFileLocation:
+    def get_loc(self, thumb_size: str = '0') -> InputDocumentFileLocation:
         """
         Gets the InputDocumentFileLocation of the sticker image
+        :param thumb_size: The type of the server side preview to get, or '0' for the sticker image itself
         :return: The InputDocumentFileLocation of the sticker image from telegram
         """
         return InputDocumentFileLocation(
             self.doc_id,
             self.doc_access_hash,
             self.doc_fileref,
-            '0'
+            thumb_size
         )
 
+    def preview_type(self, size: int = gvars.GRID_THUMB_SIZE) -> str | None:
+        """
+        Picks the smallest server side preview of the sticker that is big enough to show at a size
+        :param size: The size (px) of the square the sticker is shown in
+        :return: The type of the preview, or None if there isn't one big enough
+        """
+        best: Union[tuple[int, str], None] = None
+        for t in self.thumb_sizes.split(','):
+            if t == '': continue
+            typ, dims = t.split(':')
+            side: int = max(int(d) for d in dims.split('x'))
+            if side >= size and (best is None or side < best[0]): best = (side, typ)
+        return None if best is None else best[1]
+
     def get_file_path(self) -> str | None:
         """
         Gets the local file path of the sticker image on the system.
         :return: The string file path of the sticker image. If not found, returns None
         """
-        path: str = gvars.CACHEPATH + self.parent_sn + os.sep + str(self.doc_id)
-        print(path)
-        if os.path.exists(path + '.webp'): return path + '.webp'
-        elif os.path.exists(path + '.tgs'): return path + '.tgs'
-        else: return None
+        path: Union[str, None] = manifest.manifest.resolve(self.parent_sn, str(self.doc_id), ('webp', 'tgs'))
+        cache.manager.touch(path)
+        return path
+
+    def get_preview_path(self, size: int = gvars.GRID_THUMB_SIZE) -> str | None:
+        """
+        Gets the local file path of the image to show in a grid: the scaled down copy of the sticker image, or the
+        server side preview, falling back to the full sized image if there is neither
+        :param size: The size of the scaled down copy (px)
+        :return: The string file path of the image to show in a grid. If not found, returns None
+        """
+        path: Union[str, None] = manifest.manifest.resolve(self.parent_sn, f'{self.doc_id}_{size}', ('webp',))
+        if path is None and (typ := self.preview_type(size)) is not None:
+            path = manifest.manifest.resolve(self.parent_sn, f'{self.doc_id}_{typ}', ('webp',))
+        if path is None: return self.get_file_path()
+        cache.manager.touch(path)
+        return path
+
+    def get_cached_paths(self) -> list[str]:
+        """
+        Gets the paths of every cached file of the sticker: the image, its server side previews and scaled down copies
+        :return: The list of paths
+        """
+        root: str = manifest.manifest.root + self.parent_sn + os.sep
+        return [root + n for n in manifest.manifest.files(self.parent_sn)
+                if n.startswith(f'{self.doc_id}.') or n.startswith(f'{self.doc_id}_')]
 
 
 class TgPackThumb:
     """
     A Telegram Sticker Pack Thumbnail
     """
+    __slots__ = ('parent_sn', 'height', 'width', 'size', 'dc_id', 'version')
+
     def __init__(self, parent_sn: str, height: int, width: int, size: int, dc_id: int, version: int):
         """
         Instantiates a TgPackThumb object
@@ -93,6 +146,8 @@ class TgStickerPack:
     """
     A Telegram Sticker Pack
     """
+    __slots__ = ('id', 'access_hash', 'name', 'sn', 'size', 'hash', 'is_animated', 'thumb', 'stickers')
+
     def __init__(self, sset: StickerSet, stickers: list[TgSticker], thumb: Union[TgPackThumb, None]):
         """
         Instantiates a TgStickerPack object
@@ -111,20 +166,83 @@ class TgStickerPack:
         self.thumb: TgPackThumb = thumb
         self.stickers: list[TgSticker] = stickers
 
-    async def download_stickers(self):
+    async def download_stickers(self, priority: scheduler.Priority = scheduler.Priority.INTERACTIVE,
+                                stickers: list[TgSticker] = None, previews: bool = False):
         """
         Downloads all the stickers in this stickerpack to the cache folder associated with this object
+        :param priority: The priority of the downloads on the download scheduler
+        :param stickers: The stickers to download (Default is None, if None then download every sticker in the pack)
+        :param previews: If True, download the smallest server side preview that is big enough for a grid instead of
+        the full sized image, for the stickers that have one (Default is False)
         :return:
         """
-        info(f'Downloading all stickers in pack {self.sn} to cache')
+        stickers = self.stickers if stickers is None else stickers
+        info(f'Downloading {len(stickers)} {"sticker previews" if previews else "stickers"} in pack {self.sn} to cache')
         debug(f'creating src.Tg.tgapi.download_doclist coroutine and adding to the event loop')
         await tgapi.download_doclist(
-            [d.get_loc() for d in self.stickers],
-            [tgapi.DocName(d.filename, d.doc_mimetype) for d in self.stickers],
+            [d.get_loc() for d in stickers],
+            [tgapi.DocName(d.filename, d.doc_mimetype) for d in stickers],
             gvars.CACHEPATH + self.sn + os.sep,
-            True
+            True,
+            [d.doc_dc_id for d in stickers],
+            priority,
+            thumbnails.make_thumbnail,
+            [d.preview_type() for d in stickers] if previews else None,
+            [d.filesize for d in stickers]
         )
 
+    async def download_originals(self, stickers: list[TgSticker] = None,
+                                 priority: scheduler.Priority = scheduler.Priority.INTERACTIVE) -> list[str]:
+        """
+        Downloads the full sized images of stickers that only have a preview cached, e.g. to export or upload them
+        :param stickers: The stickers (Default is None, if None then every sticker in the pack)
+        :param priority: The priority of the downloads on the download scheduler
+        :return: The paths of the full sized images, in the same order as the stickers (None where a download failed)
+        """
+        stickers = self.stickers if stickers is None else stickers
+        missing: list[TgSticker] = [s for s in stickers if s.get_file_path() is None]
+        if len(missing) > 0: await self.download_stickers(priority, missing)
+        return [s.get_file_path() for s in stickers]
+
+    def get_tier(self) -> store.Tier:
+        """
+        Gets how much of this pack has been fetched into the cache, as recorded in the metadata database
+        :return: The tier of the pack (META if the pack isn't saved)
+        """
+        return store.store.get_tiers([self.sn]).get(self.sn, store.Tier.META)
+
+    async def fetch(self, tier: store.Tier, priority: scheduler.Priority = scheduler.Priority.INTERACTIVE) -> int:
+        """
+        Fetches this pack into the cache up to a tier, downloading only the files that are missing, and records the
+        tier. The pack must already be saved
+        :param tier: The tier to fetch the pack up to
+        :param priority: The priority of the downloads on the download scheduler
+        :return: The number of stickers that were downloaded
+        """
+        downloaded: int = 0
+        if tier >= store.Tier.THUMB:
+            if self.thumb is not None and self.get_thumb_path() is None:
+                await self.download_thumb()
+            elif self.thumb is None and len(self.stickers) > 0 and self.stickers[0].get_preview_path() is None:
+                await self.download_stickers(priority, self.stickers[:1], True)  # The first sticker is the thumb
+                downloaded += 1
+        if tier >= store.Tier.FULL: downloaded += await self.download_missing(priority)
+        if tier > self.get_tier():
+            debug(f'Pack {self.sn} fetched to tier {tier.name}')
+            store.store.set_tier(self.sn, tier)
+        return downloaded
+
+    async def download_missing(self, priority: scheduler.Priority = scheduler.Priority.INTERACTIVE) -> int:
+        """
+        Downloads the stickers in this pack that have nothing to show in a grid in the cache, e.g. because the pack was
+        loaded without them. Server side previews are downloaded instead of the full sized images where there are any
+        :param priority: The priority of the downloads on the download scheduler
+        :return: The number of stickers that were downloaded
+        """
+        missing: list[TgSticker] = [s for s in self.stickers if s.get_preview_path() is None]
+        if len(missing) > 0: await self.download_stickers(priority, missing, True)
+        return len(missing)
+
     async def download_thumb(self):
         """
         Downloads the thumbnail of this stickerpack to the cache folder
@@ -135,52 +253,365 @@ class TgStickerPack:
             return
         else:
             info(f'Downloading pack thumbnail for pack {self.sn} and saving to cache')
-            debug(f'creating src.Tg.tgapi.download_file coroutine and adding to the event loop')
-            await gvars.client.download_file(
+            debug(f'creating src.Tg.tgapi.download_resumable coroutine and adding to the event loop')
+            fpath: str = utils.check_path(gvars.CACHEPATH + self.sn + os.sep) + \
+                'thumb.' + ('tgs' if self.is_animated else 'webp')
+            await tgapi.download_resumable(
                 InputStickerSetThumb(InputStickerSetShortName(self.sn), self.thumb.version),
-                gvars.CACHEPATH + self.sn + os.sep + 'thumb.' + ('tgs' if self.is_animated else 'webp')
+                fpath,
+                self.thumb.size
             )
+            manifest.manifest.add(fpath)
 
     def get_thumb_path(self) -> str | None:
         """
         Gets the local file location of the thumbnail of the pack. If no such file exists, the method returns None
         :return: The relative string path of the thumbnail of the pack. Returns None if the file doesn't exist.
         """
-        fpath: str = (gvars.CACHEPATH + self.sn + os.sep) + \
-                     ('thumb' if self.thumb is not None else str(self.stickers[0].doc_id)) + \
-                     ('.tgs' if self.is_animated else '.webp')
-        if not os.path.exists(fpath): return None
-        return fpath
+        if self.thumb is None: return self.stickers[0].get_preview_path() if len(self.stickers) > 0 else None
+        path: Union[str, None] = manifest.manifest.resolve(
+            self.sn,
+            'thumb',
+            ('tgs',) if self.is_animated else ('webp',)
+        )
+        cache.manager.touch(path)
+        return path
 
-    async def update_meta(self):
+    def get_preview_path(self, size: int = gvars.GRID_THUMB_SIZE) -> str | None:
         """
-        Redownloads the metadata associated with this sticker pack
-        :return:
+        Gets the local file location of the image to show for this pack in a grid. This is the pack thumbnail, or the
+        scaled down copy of the first sticker if the pack doesn't have a thumbnail
+        :param size: The size of the scaled down copy of the first sticker (px)
+        :return: The relative string path of the image. Returns None if the file doesn't exist.
+        """
+        if self.thumb is None and len(self.stickers) > 0: return self.stickers[0].get_preview_path(size)
+        return self.get_thumb_path()
+
+    async def make_thumbnails(self, size: int = gvars.GRID_THUMB_SIZE):
+        """
+        Makes scaled down copies of every downloaded sticker in this pack that doesn't have one yet
+        :param size: The size to scale the stickers to (px)
+        :return: None
+        """
+        paths: list[str] = [p for s in self.stickers
+                            if manifest.manifest.resolve(self.sn, f'{s.doc_id}_{size}', ('webp',)) is None
+                            and (p := s.get_file_path()) is not None and thumbnails.can_thumbnail(p)]
+        if len(paths) == 0: return
+        info(f'Making {len(paths)} missing thumbnails for pack {self.sn}')
+        await asyncio.gather(*[thumbnails.make_thumbnail(p, size) for p in paths])
+
+    def copy_meta(self, npack: 'TgStickerPack'):
+        """
+        Copies the metadata (including the sticker list) of another copy of this pack onto this object
+        :param npack: The other copy of this pack
+        :return: None
         """
-        info(f'Updating metadata for pack {self.sn}')
-        npack: TgStickerPack = generate(await tgapi.get_stickerset(self.sn))
         self.id = npack.id
         self.access_hash = npack.access_hash
-        self.name = npack.access_hash
+        self.name = npack.name
         self.sn = npack.sn
         self.size = npack.size
         self.hash = npack.hash
         self.is_animated = npack.is_animated
         self.thumb = npack.thumb
-        self.stickers = npack.thumb
+        self.stickers = npack.stickers
+
+    async def update_meta(self):
+        """
+        Redownloads the metadata associated with this sticker pack
+        :return:
+        """
+        info(f'Updating metadata for pack {self.sn}')
+        self.copy_meta(generate(await tgapi.get_stickerset(self.sn)))
         debug('creating download_thumb coroutine and adding to the event loop')
         await self.download_thumb()
         debug('serializing pack metadata to cache')
         serialize_pack(self)
 
+    async def sync(self, priority: scheduler.Priority = scheduler.Priority.INTERACTIVE) -> bool:
+        """
+        Brings the cached copy of this pack up to date with Telegram. Only stickers that were added (or are missing from
+        the cache) are downloaded, and the files of stickers that were removed are deleted. Stickers are only downloaded
+        if the pack was fetched to the FULL tier
+        :param priority: The priority of the downloads on the download scheduler
+        :return: Whether anything had to be downloaded, deleted or rewritten
+        """
+        info(f'Syncing pack {self.sn} with Telegram')
+        tier: store.Tier = self.get_tier()
+        npack: TgStickerPack = generate(await tgapi.get_stickerset(self.sn))
+        new_ids: set[int] = {s.doc_id for s in npack.stickers}
+        old_ids: set[int] = {s.doc_id for s in self.stickers}
+        added: list[TgSticker] = [s for s in npack.stickers if s.doc_id not in old_ids or
+                                  (tier == store.Tier.FULL and s.get_preview_path() is None)]
+        removed: list[TgSticker] = [s for s in self.stickers if s.doc_id not in new_ids]
+        new_thumb: bool = npack.thumb is not None and \
+            (self.thumb is None or self.thumb.version != npack.thumb.version or self.get_thumb_path() is None)
+        if npack.hash == self.hash and len(added) == 0 and len(removed) == 0 and not new_thumb:
+            debug(f'Pack {self.sn} is unchanged (hash {self.hash})')
+            return False
+        debug(f'Pack {self.sn}: {len(added)} stickers to download, {len(removed)} to delete, new thumb: {new_thumb}')
+        for s in removed:
+            for path in s.get_cached_paths(): manifest.manifest.remove_file(path)
+        self.copy_meta(npack)
+        if new_thumb: await self.download_thumb()
+        serialize_pack(self)
+        await self.fetch(tier, priority)  # Downloads the added stickers if the pack is FULL
+        return True
+
     async def update_all(self):
         """
-        Upadtes all information associated with this sticker pack, including redownloading all stickers
+        Updates all information associated with this sticker pack, downloading only the stickers that changed
         :return:
         """
         info(f'Updating all cached information for pack {self.sn}')
-        await self.update_meta()
-        await self.download_stickers()
+        await self.sync()
+
+
+class StickerTable:
+    """
+    A compact, column-oriented table of stickers for working with a whole sticker library at once.
+
+    Numbers are kept in typed arrays, repeated strings (shortnames, MIME types, filenames) are stored once and referred
+    to by index, and all emojis share a single string buffer. TgSticker objects are only created when a row is accessed
+    """
+    __slots__ = ('doc_ids', 'access_hashes', 'dc_ids', 'filesizes', 'heights', 'widths', 'sn_idx', 'mime_idx',
+                 'fname_idx', 'thumbs_idx', 'strings', '_string_idx', 'filerefs', '_fileref_ends', 'outlines',
+                 '_outline_ends', '_emoji_parts', '_emoji_ends', '_search_parts', '_search_ends')
+
+    def __init__(self):
+        """
+        Instantiates an empty StickerTable object
+        """
+        self.doc_ids: array = array('q')
+        self.access_hashes: array = array('q')
+        self.dc_ids: array = array('B')
+        self.filesizes: array = array('q')
+        self.heights: array = array('H')
+        self.widths: array = array('H')
+        self.sn_idx: array = array('I')  # Indexes into self.strings
+        self.mime_idx: array = array('I')
+        self.fname_idx: array = array('I')
+        self.thumbs_idx: array = array('I')
+        self.strings: list[str] = []
+        self._string_idx: dict[str, int] = {}
+        self.filerefs: bytearray = bytearray()
+        self._fileref_ends: array = array('I')
+        self.outlines: bytearray = bytearray()
+        self._outline_ends: array = array('I')
+        self._emoji_parts: list[str] = []  # Joined into one buffer the first time it is read after an extend
+        self._emoji_ends: array = array('I')
+        self._search_parts: list[str] = []  # The same emojis normalized with utils.normalize_emoji, for with_emoji
+        self._search_ends: array = array('I')
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __getitem__(self, i: int) -> TgSticker:
+        i = self.__row(i)
+        return _make_sticker(
+            self.doc_ids[i], self.access_hashes[i], self.strings[self.mime_idx[i]], self.dc_ids[i], self.fileref(i),
+            self.filesizes[i], self.strings[self.fname_idx[i]], self.strings[self.sn_idx[i]], self.heights[i],
+            self.widths[i], self.emojis(i), self.strings[self.thumbs_idx[i]], self.outline(i)
+        )
+
+    def __iter__(self) -> Iterator[TgSticker]:
+        for i in range(len(self)): yield self[i]
+
+    def extend(self, stickers: Iterable[TgSticker]):
+        """
+        Adds stickers to the end of the table
+        :param stickers: The stickers to add
+        :return: None
+        """
+        end: int = self._emoji_ends[-1] if len(self._emoji_ends) > 0 else 0
+        search_end: int = self._search_ends[-1] if len(self._search_ends) > 0 else 0
+        for s in stickers:
+            self.doc_ids.append(s.doc_id)
+            self.access_hashes.append(s.doc_access_hash)
+            self.dc_ids.append(s.doc_dc_id)
+            self.filesizes.append(s.filesize)
+            self.heights.append(s.height)
+            self.widths.append(s.width)
+            self.sn_idx.append(self.__intern(s.parent_sn))
+            self.mime_idx.append(self.__intern(s.doc_mimetype))
+            self.fname_idx.append(self.__intern(s.filename))
+            self.thumbs_idx.append(self.__intern(s.thumb_sizes))
+            self.filerefs += s.doc_fileref
+            self._fileref_ends.append(len(self.filerefs))
+            self.outlines += s.outline
+            self._outline_ends.append(len(self.outlines))
+            self._emoji_parts.append(s.emojis)
+            end += len(s.emojis)
+            self._emoji_ends.append(end)
+            normalized: str = utils.normalize_emoji(s.emojis)
+            self._search_parts.append(normalized)
+            search_end += len(normalized)
+            self._search_ends.append(search_end)
+
+    @property
+    def emoji_buf(self) -> str:
+        """
+        The emojis of every row, one after another
+        :return: The emoji buffer
+        """
+        if len(self._emoji_parts) != 1: self._emoji_parts = [''.join(self._emoji_parts)]
+        return self._emoji_parts[0]
+
+    def __search_buf(self) -> str:
+        """
+        Gets the normalized emojis of every row, one after another
+        :return: The normalized emoji buffer
+        """
+        if len(self._search_parts) != 1: self._search_parts = [''.join(self._search_parts)]
+        return self._search_parts[0]
+
+    def __intern(self, string: str) -> int:
+        """
+        Gets the index of a string in self.strings, adding it if it isn't there yet
+        :param string: The string
+        :return: The index of the string
+        """
+        i: Union[int, None] = self._string_idx.get(string)
+        if i is None:
+            i = self._string_idx[string] = len(self.strings)
+            self.strings.append(string)
+        return i
+
+    # Row access
+
+    def __row(self, i: int) -> int:
+        """
+        Checks a row number, turning a negative one into the row it counts back to from the end
+        :param i: The row
+        :return: The row as a number from 0
+        :raises IndexError: If the row isn't in the table
+        """
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError('StickerTable row out of range')
+        return i
+
+    def emojis(self, i: int) -> str:
+        """
+        Gets the emojis of a row
+        :param i: The row
+        :return: The emojis of the sticker in that row
+        """
+        i = self.__row(i)
+        return self.emoji_buf[(self._emoji_ends[i - 1] if i > 0 else 0):self._emoji_ends[i]]
+
+    def fileref(self, i: int) -> bytes:
+        """
+        Gets the file reference of a row
+        :param i: The row
+        :return: The file reference of the sticker in that row
+        """
+        i = self.__row(i)
+        return bytes(self.filerefs[(self._fileref_ends[i - 1] if i > 0 else 0):self._fileref_ends[i]])
+
+    def outline(self, i: int) -> bytes:
+        """
+        Gets the compressed vector outline of a row
+        :param i: The row
+        :return: The outline of the sticker in that row (empty if it doesn't have one)
+        """
+        i = self.__row(i)
+        return bytes(self.outlines[(self._outline_ends[i - 1] if i > 0 else 0):self._outline_ends[i]])
+
+    def parent_sn(self, i: int) -> str:
+        """
+        Gets the pack shortname of a row
+        :param i: The row
+        :return: The shortname of the pack the sticker in that row belongs to
+        """
+        return self.strings[self.sn_idx[i]]
+
+    def select(self, rows: Iterable[int]) -> list[TgSticker]:
+        """
+        Creates TgSticker objects for a set of rows
+        :param rows: The rows to get
+        :return: A list of TgStickers
+        """
+        return [self[i] for i in rows]
+
+    # Bulk filters, each returning the matching row numbers. equal, isin and between compare a whole column with the
+    # bound methods of the value (e.g. 5.__eq__), so the loop stays in C instead of calling Python code for every row
+
+    def where(self, column: array, predicate: Callable[[int], bool]) -> list[int]:
+        """
+        Finds the rows where a numeric column matches a predicate. The predicate is called for every row, so prefer
+        equal, isin and between where they fit
+        :param column: The column to test (e.g. self.filesizes)
+        :param predicate: A function of the column value that returns whether the row matches
+        :return: The matching rows
+        """
+        return list(compress(range(len(column)), map(predicate, column)))
+
+    def equal(self, column: array, value: int) -> list[int]:
+        """
+        Finds the rows where a numeric column is equal to a value
+        :param column: The column to test (e.g. self.dc_ids)
+        :param value: The value
+        :return: The matching rows
+        """
+        return list(compress(range(len(column)), map(int(value).__eq__, column)))
+
+    def isin(self, column: array, values: Iterable[int]) -> list[int]:
+        """
+        Finds the rows where a numeric column is one of a set of values
+        :param column: The column to test (e.g. self.doc_ids)
+        :param values: The values
+        :return: The matching rows
+        """
+        return list(compress(range(len(column)), map(frozenset(values).__contains__, column)))
+
+    def between(self, column: array, low: int = None, high: int = None) -> list[int]:
+        """
+        Finds the rows where a numeric column is in a range
+        :param column: The column to test (e.g. self.filesizes)
+        :param low: The lowest value that matches (Default is None, if None then there is no lower bound)
+        :param high: The value that matches are under (Default is None, if None then there is no upper bound)
+        :return: The matching rows
+        """
+        if low is None and high is None: return list(range(len(column)))
+        if low is None: return list(compress(range(len(column)), map(int(high).__gt__, column)))
+        if high is None: return list(compress(range(len(column)), map(int(low).__le__, column)))
+        return list(compress(range(len(column)),
+                             map(and_, map(int(low).__le__, column), map(int(high).__gt__, column))))
+
+    def with_emoji(self, emoji: str) -> list[int]:
+        """
+        Finds the rows whose emojis contain a string, searching the shared emoji buffer instead of every row. Variation
+        selectors are ignored, the same way as in the emoji index
+        :param emoji: The emoji to search for
+        :return: The matching rows (empty if the emoji is empty)
+        """
+        emoji = utils.normalize_emoji(emoji)
+        if len(emoji) == 0: return []
+        buf: str = self.__search_buf()
+        rows: list[int] = []
+        i: int = buf.find(emoji)
+        while i != -1:
+            row: int = bisect_right(self._search_ends, i)
+            if i + len(emoji) <= self._search_ends[row] and (len(rows) == 0 or rows[-1] != row): rows.append(row)
+            i = buf.find(emoji, i + 1)
+        return rows
+
+    def in_pack(self, sn: str) -> list[int]:
+        """
+        Finds the rows of stickers belonging to a pack
+        :param sn: The shortname of the pack
+        :return: The matching rows
+        """
+        i: Union[int, None] = self._string_idx.get(sn)
+        return [] if i is None else self.equal(self.sn_idx, i)
+
+    def total_size(self, rows: Iterable[int] = None) -> int:
+        """
+        Adds up the file sizes of rows
+        :param rows: The rows to add up (Default is None, if None then add up every row)
+        :return: The total size in bytes
+        """
+        return sum(self.filesizes) if rows is None else sum(self.filesizes[i] for i in rows)
 
 
 def generate(sset: ParentSet) -> TgStickerPack:
@@ -190,14 +621,14 @@ def generate(sset: ParentSet) -> TgStickerPack:
     :return: The TgStickerPack object assocated with the input StickerSet object
     """
     info(f"Generating TgStickerPack object for StickerSet {sset.set.short_name}")
-    e: dict[int, str] = {}
+    e: dict[int, list[str]] = {}
     p: StickerPack
     for p in sset.packs:
         for d in p.documents:
-            e[d] = ''.join(sorted((e.get(d, '') + p.emoticon)))
+            e.setdefault(d, []).append(p.emoticon)  # Keep each emoticon whole so they can be split apart again
     tgs: list[TgSticker] = []
     for d in sset.documents:
-        tgs.append(TgSticker(d, e.get(d.id, ''), sset.set.short_name))
+        tgs.append(TgSticker(d, ''.join(sorted(e.get(d.id, []))), sset.set.short_name))
 
     return TgStickerPack(sset.set, tgs, generate_thumb(sset))
 
@@ -211,42 +642,82 @@ def generate_thumb(sset: Union[ParentSet, StickerSet]) -> Union[TgPackThumb, Non
     if isinstance(sset, ParentSet): sset = sset.set
     info(f"Generating TgPackThumb object for {sset.short_name}")
     if sset.thumbs is None or len(sset.thumbs) == 0 or sset.thumb_version is None: return None
-    ps: PhotoSize = sset.thumbs[0]
-    if type(ps) != PhotoSize: return None # TODO thumbs can include PhotoPathObject, account for this!!
+    # The thumbs can also include a vector outline (PhotoPathSize), the thumbnail that can be downloaded is a PhotoSize
+    ps: Union[PhotoSize, None] = next((t for t in sset.thumbs if isinstance(t, PhotoSize)), None)
+    if ps is None: return None
     return TgPackThumb(sset.short_name, ps.h, ps.w, ps.size, sset.thumb_dc_id, sset.thumb_version)
 
 
-async def get_pack(sn: str, force_get_new: bool = False, force_redownload_stickers: bool = False) -> TgStickerPack:
+async def get_pack(sn: str, force_get_new: bool = False, force_redownload_stickers: bool = False,
+                   tier: store.Tier = store.Tier.FULL) -> TgStickerPack:
     """
     Gets a TgStickerPack of a specified short name. If the pack is already cached on the user's local machine, then
     the program will retrieve from the cache. If it is not saved, or the method is flagged to download a new copy, then
     The program will call Telegram's servers and generate a new copy and cache it.
     :param sn: The shortname of the desired stickerpack
-    :param force_get_new: If True, forces the system to redownload the StickerSet object from Telegram
+    :param force_get_new: If True, syncs the cached copy with Telegram, downloading only stickers that changed
     :param force_redownload_stickers: If True, forces the system to redownload all sticker pack images to cache
+    :param tier: How much of the pack to fetch into the cache (Default is FULL, every sticker). Use THUMB to only get
+    what is needed to show the pack in a list
     :return:
     """
     info(f'Generating local data for pack {sn}')
-    if force_redownload_stickers and not force_get_new:
-        debug('creating new TgStickerPack object. download_stickers coroutine created and added to the event loop')
+    if check_pack_saved(sn):
+        debug(f'deserializing pack {sn} from local cache')
         tgpack: TgStickerPack = deserialize_pack(sn)
-        await tgpack.download_stickers()
+        if force_get_new: await tgpack.sync()
+        if force_redownload_stickers: await tgpack.download_stickers()
+        await tgpack.fetch(tier)  # Only downloads what the tier needs and isn't cached
         return tgpack
-    if check_pack_saved(sn) and not force_get_new:
-        debug(f'deserializing pack {sn} from local cache')
-        return deserialize_pack(sn)
     info(f'Sticker set {sn} not saved in local cache, downloading from Telegram')
     debug('creating src.Tg.tgapi.get_stickerset coroutine and adding to the event loop')
     sset: StickerSet = await tgapi.get_stickerset(sn)
     tgpack: TgStickerPack = generate(sset)
     debug(f'Serializing {sn} to local cache')
     serialize_pack(tgpack)
-    debug('creating tgpack.download_stickers coroutine and adding to the event loop')
-    await tgpack.download_stickers()
-    if tgpack.thumb is not None: await tgpack.download_thumb()
+    debug(f'fetching pack {sn} to tier {tier.name}')
+    await tgpack.fetch(tier)
     return tgpack
 
 
+async def get_packs(sns: list[str], width: int = gvars.PACK_LOAD_WIDTH, force_get_new: bool = False,
+                    tier: store.Tier = store.Tier.FULL) -> AsyncIterator[TgStickerPack]:
+    """
+    Gets many TgStickerPacks at once. Cached packs are read in one go, then the rest are loaded up to width packs
+    concurrently. Packs are yielded as soon as they are ready, so the order is not the same as the order of sns. Packs
+    that fail to load are logged and skipped.
+    :param sns: The shortnames of the desired stickerpacks
+    :param width: The maximum number of packs to load at the same time
+    :param force_get_new: If True, forces the system to redownload the StickerSet objects from Telegram
+    :param tier: How much of each pack to fetch into the cache (see get_pack)
+    :return: An async iterator of the TgStickerPacks
+    """
+    info(f'Getting {len(sns)} packs, {width} at a time')
+    if not force_get_new:
+        cached: dict[str, TgStickerPack] = deserialize_packs(sns)  # One query for everything already cached
+        tiers: dict[str, store.Tier] = store.store.get_tiers(list(cached))
+        cached = {sn: p for sn, p in cached.items() if tiers.get(sn, store.Tier.META) >= tier}
+        for p in cached.values(): yield p
+        sns = [sn for sn in sns if sn not in cached]  # Including cached packs that need a higher tier
+    sem: asyncio.Semaphore = asyncio.Semaphore(width)
+
+    async def load(sn: str) -> Union[TgStickerPack, None]:
+        async with sem:
+            try:
+                return await get_pack(sn, force_get_new, tier=tier)
+            except Exception as e:
+                error(f'Could not load pack {sn}: {e}')
+                return None
+
+    tasks: list[asyncio.Task] = [asyncio.ensure_future(load(sn)) for sn in sns]
+    try:
+        for t in asyncio.as_completed(tasks):
+            pack: Union[TgStickerPack, None] = await t
+            if pack is not None: yield pack
+    finally:
+        for t in tasks: t.cancel()  # If the caller stops iterating early, stop loading the rest
+
+
 def serialize_pack(pack: TgStickerPack):
     """
     Serializes a sticker pack
@@ -254,7 +725,17 @@ def serialize_pack(pack: TgStickerPack):
     :return: None
     """
     info(f'Serializing Metadata for for {pack.sn} to local cache')
-    utils.serialize(pack, gvars.CACHEPATH + pack.sn + os.sep, pack.sn + '.json')
+    store.store.save_packs([pack])
+
+
+def serialize_packs(packs: list[TgStickerPack]):
+    """
+    Serializes many sticker packs in a single transaction
+    :param packs: The packs to serialize
+    :return: None
+    """
+    info(f'Serializing Metadata for {len(packs)} packs to local cache')
+    store.store.save_packs(packs)
 
 
 def check_pack_saved(sn: str) -> bool:
@@ -264,7 +745,7 @@ def check_pack_saved(sn: str) -> bool:
     :return: Whether the pack is saved or not
     """
     info(f'Checking if pack {sn} is saved on the local cache')
-    return utils.check_file(gvars.CACHEPATH + sn + os.sep + sn + '.json')
+    return store.store.has_pack(sn) or utils.check_file(_legacy_pack_path(sn))
 
 
 def deserialize_pack(sn: str) -> TgStickerPack:
@@ -274,7 +755,127 @@ def deserialize_pack(sn: str) -> TgStickerPack:
     :return: The TgStickerPack object
     """
     info(f'Deserializing pack {sn} from local cache')
-    return utils.deserialize(gvars.CACHEPATH + sn + os.sep + sn + '.json')
+    return deserialize_packs([sn])[sn]
+
+
+def deserialize_packs(sns: list[str]) -> dict[str, TgStickerPack]:
+    """
+    Deserializes many sticker packs at once. Packs that aren't saved are left out of the result
+    :param sns: The shortnames of the desired packs
+    :return: A dict of shortname to TgStickerPack object
+    """
+    info(f'Deserializing {len(sns)} packs from local cache')
+    packs: dict[str, TgStickerPack] = {}
+    for sn, (prow, trow, srows) in store.store.load_packs(sns).items():
+        packs[sn] = _pack_from_rows(prow, trow, srows)
+    legacy: list[TgStickerPack] = [utils.deserialize(_legacy_pack_path(sn)) for sn in sns
+                                   if sn not in packs and utils.check_file(_legacy_pack_path(sn))]
+    if len(legacy) > 0:
+        info(f'Moving {len(legacy)} packs from json files to the metadata database')
+        for p in legacy:
+            for s in p.stickers:
+                if not hasattr(s, 'thumb_sizes'): s.thumb_sizes = ''  # Saved before previews were recorded
+                if not hasattr(s, 'outline'): s.outline = b''
+        serialize_packs(legacy)
+        for p in legacy: packs[p.sn] = p
+    return packs
+
+
+def _legacy_pack_path(sn: str) -> str:
+    """
+    Gets the path of the json file that packs were serialized to before the metadata database
+    :param sn: The shortname of the pack
+    :return: The path of the json file
+    """
+    return gvars.CACHEPATH + sn + os.sep + sn + '.json'
+
+
+def _pack_from_rows(prow: Row, trow: Union[Row, None], srows: list[Row]) -> TgStickerPack:
+    """
+    Rebuilds a TgStickerPack from its rows in the metadata database
+    :param prow: The row of the pack
+    :param trow: The row of the pack's thumbnail, or None if the pack doesn't have one
+    :param srows: The rows of the pack's stickers in order
+    :return: The TgStickerPack object
+    """
+    pack: TgStickerPack = TgStickerPack.__new__(TgStickerPack)
+    pack.id = prow['id']
+    pack.access_hash = prow['access_hash']
+    pack.name = prow['name']
+    pack.sn = sys.intern(prow['sn'])
+    pack.size = prow['size']
+    pack.hash = prow['hash']
+    pack.is_animated = bool(prow['is_animated'])
+    pack.thumb = None if trow is None else \
+        TgPackThumb(pack.sn, trow['height'], trow['width'], trow['size'], trow['dc_id'], trow['version'])
+    pack.stickers = [_make_sticker(r['doc_id'], r['access_hash'], r['mimetype'], r['dc_id'], r['fileref'],
+                                   r['filesize'], r['filename'], pack.sn, r['height'], r['width'], r['emojis'],
+                                   r['thumbs'], r['outline']) for r in srows]
+    return pack
+
+
+def _make_sticker(doc_id: int, access_hash: int, mimetype: str, dc_id: int, fileref: bytes, filesize: int,
+                  filename: str, parent_sn: str, height: int, width: int, emojis: str, thumb_sizes: str,
+                  outline: bytes) -> TgSticker:
+    """
+    Creates a TgSticker from its saved fields instead of a Telegram Document. The parameters are the attributes of the
+    same name on TgSticker
+    :return: The TgSticker object
+    """
+    s: TgSticker = TgSticker.__new__(TgSticker)
+    s.doc_id = doc_id
+    s.doc_access_hash = access_hash
+    s.doc_mimetype = sys.intern(mimetype)
+    s.doc_dc_id = dc_id
+    s.doc_fileref = fileref
+    s.filesize = filesize
+    s.filename = sys.intern(filename)
+    s.parent_sn = sys.intern(parent_sn)
+    s.height = height
+    s.width = width
+    s.emojis = sys.intern(emojis)
+    s.thumb_sizes = sys.intern(thumb_sizes)
+    s.outline = outline
+    return s
+
+
+def _encode_thumb_sizes(thumbs: Union[list, None]) -> str:
+    """
+    Encodes the downloadable server side previews of a document for TgSticker.thumb_sizes
+    :param thumbs: The thumbs of the Telegram Document
+    :return: The previews as 'type:WxH' joined by commas, or an empty string if there are none
+    """
+    return ','.join(f'{t.type}:{t.w}x{t.h}' for t in thumbs or []
+                    if isinstance(t, (PhotoSize, PhotoCachedSize, PhotoSizeProgressive)))
+
+
+def load_library(sns: list[str] = None) -> StickerTable:
+    """
+    Loads the stickers of many cached packs into one StickerTable
+    :param sns: The shortnames of the packs to load (Default is None, if None then load every cached pack)
+    :return: A StickerTable holding the stickers of the packs, in pack order
+    """
+    sns = store.store.list_packs() if sns is None else sns
+    info(f'Loading stickers of {len(sns)} packs into a StickerTable')
+    table: StickerTable = StickerTable()
+    for i in range(0, len(sns), 50):  # A few packs at a time so that only a few packs of TgStickers exist at once
+        for sn, (prow, trow, srows) in store.store.load_packs(sns[i:i + 50]).items():
+            table.extend(_pack_from_rows(prow, trow, srows).stickers)
+    return table
+
+
+def find_by_emoji(emoji: str, owned_only: bool = True) -> list[TgSticker]:
+    """
+    Finds every cached sticker tagged with an emoji using the emoji index
+    :param emoji: The emoji to look up
+    :param owned_only: If True, only stickers in packs that the current user owns are returned
+    :return: A list of the TgStickers tagged with the emoji
+    """
+    info(f'Looking up stickers tagged with {emoji}')
+    return [_make_sticker(r['doc_id'], r['access_hash'], r['mimetype'], r['dc_id'], r['fileref'], r['filesize'],
+                          r['filename'], r['parent_sn'], r['height'], r['width'], r['emojis'], r['thumbs'],
+                          r['outline'])
+            for r in store.store.find_emoji(emoji, gvars.CURRENT_USER if owned_only else None)]
 
 
 async def get_owned_packs() -> list[str]:
@@ -282,9 +883,12 @@ async def get_owned_packs() -> list[str]:
     Gets all the sticker packs that the user owns
     :return: A list of strs containing the shortnames of all the user's owned packs
     """
+    lst: list[str] = store.store.get_owned(gvars.CURRENT_USER)
+    if len(lst) > 0: return lst
     try:
         lst = utils.deserialize(gvars.get_current_user_path() + gvars.PACKS_FNAME)
         useless_var = lst[0] + ''
+        store.store.set_owned(gvars.CURRENT_USER, lst)
         return lst
     except:
         pass
@@ -297,5 +901,5 @@ async def update_owned_packs() -> list[str]:
     :return: A list of strs containing the shortnames of all the users's owned packs
     """
     lst = await tgapi.get_owned_stickerset_shortnames()
-    utils.serialize(lst, gvars.get_current_user_path(), gvars.PACKS_FNAME)
+    store.store.set_owned(gvars.CURRENT_USER, lst)
     return lst
@@ -0,0 +1,365 @@
+import sqlite3
+from enum import IntEnum
+from logging import debug, info, warning, error, critical
+from typing import Callable, Iterable, Union
+
+from src import gvars, utils
+
+
+# Each entry upgrades the database by one version (PRAGMA user_version), either as a SQL script or as a function of
+# the connection. Only ever append to this list
+_MIGRATIONS: list[Union[str, Callable[[sqlite3.Connection], None]]] = [
+    '''
+    CREATE TABLE packs (
+        sn          TEXT PRIMARY KEY,  -- Primary key doubles as the index on short name
+        id          INTEGER NOT NULL,
+        access_hash INTEGER NOT NULL,
+        name        TEXT NOT NULL,
+        size        INTEGER NOT NULL,
+        hash        INTEGER NOT NULL,
+        is_animated INTEGER NOT NULL
+    );
+    CREATE TABLE thumbs (
+        parent_sn TEXT PRIMARY KEY REFERENCES packs(sn) ON DELETE CASCADE,
+        height    INTEGER,
+        width     INTEGER,
+        size      INTEGER,
+        dc_id     INTEGER,
+        version   INTEGER
+    );
+    CREATE TABLE stickers (
+        parent_sn   TEXT NOT NULL REFERENCES packs(sn) ON DELETE CASCADE,
+        position    INTEGER NOT NULL,
+        doc_id      INTEGER NOT NULL,
+        access_hash INTEGER NOT NULL,
+        mimetype    TEXT,
+        dc_id       INTEGER,
+        fileref     BLOB,
+        filesize    INTEGER,
+        filename    TEXT,
+        height      INTEGER,
+        width       INTEGER,
+        emojis      TEXT,
+        PRIMARY KEY (parent_sn, position)
+    );
+    CREATE INDEX stickers_doc_id ON stickers(doc_id);
+    CREATE TABLE owned_packs (
+        user     TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        sn       TEXT NOT NULL,
+        PRIMARY KEY (user, position)
+    );
+    ''',
+    lambda conn: _add_emoji_index(conn),
+    '''
+    CREATE TABLE file_access (
+        path  TEXT PRIMARY KEY,
+        atime REAL NOT NULL
+    ) WITHOUT ROWID;
+    ''',
+    '''
+    ALTER TABLE packs ADD COLUMN tier INTEGER NOT NULL DEFAULT 0;
+    UPDATE packs SET tier = 2;  -- Packs saved before tiers were recorded were always saved with every sticker
+    ''',
+    '''
+    ALTER TABLE stickers ADD COLUMN thumbs TEXT NOT NULL DEFAULT '';  -- Server side previews, see TgSticker
+    ''',
+    '''
+    ALTER TABLE stickers ADD COLUMN outline BLOB NOT NULL DEFAULT x'';  -- Compressed vector outline, see TgSticker
+    ''',
+]
+
+
+class Tier(IntEnum):
+    """
+    How much of a sticker pack has been fetched into the cache. Each tier includes the ones below it
+    """
+    META = 0  # Only the metadata (the pack and its sticker list)
+    THUMB = 1  # The pack thumbnail, or the first sticker if the pack doesn't have a thumbnail
+    FULL = 2  # Every sticker
+
+
+class MetaStore:
+    """
+    A SQLite database holding the metadata of every cached sticker pack and the owned pack list of each user
+    """
+    def __init__(self, fpath: str):
+        """
+        Instantiates a MetaStore object, creating or upgrading the database if needed
+        :param fpath: The path of the database file
+        """
+        info(f'Opening metadata database at {fpath}')
+        self.fpath: str = fpath
+        self.conn: sqlite3.Connection = sqlite3.connect(fpath)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.__migrate()
+
+    def __migrate(self):
+        """
+        Runs every migration that the database hasn't had yet
+        :return: None
+        """
+        version: int = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        for i in range(version, len(_MIGRATIONS)):
+            debug(f'Upgrading metadata database to version {i + 1}')
+            if isinstance(_MIGRATIONS[i], str):
+                self.conn.executescript('BEGIN;' + _MIGRATIONS[i] + f'PRAGMA user_version = {i + 1}; COMMIT;')
+            else:
+                with self.conn:
+                    _MIGRATIONS[i](self.conn)
+                    self.conn.execute(f'PRAGMA user_version = {i + 1}')
+
+    # Packs
+
+    def has_pack(self, sn: str) -> bool:
+        """
+        Checks if a pack is in the database
+        :param sn: The shortname of the pack
+        :return: Whether the pack is in the database
+        """
+        return self.conn.execute('SELECT 1 FROM packs WHERE sn = ?', (sn,)).fetchone() is not None
+
+    def save_packs(self, packs: Iterable):
+        """
+        Writes packs and their thumbs and stickers to the database in a single transaction, replacing older copies
+        :param packs: The TgStickerPack objects to write
+        :return: None
+        """
+        with self.conn:
+            for p in packs:
+                debug(f'Writing pack {p.sn} to metadata database')
+                self.conn.execute(
+                    'INSERT INTO packs (sn, id, access_hash, name, size, hash, is_animated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT(sn) DO UPDATE SET id = excluded.id, access_hash = excluded.access_hash, '
+                    'name = excluded.name, size = excluded.size, hash = excluded.hash, '
+                    'is_animated = excluded.is_animated',
+                    (p.sn, p.id, p.access_hash, p.name, p.size, p.hash, int(p.is_animated))
+                )
+                self.conn.execute('DELETE FROM thumbs WHERE parent_sn = ?', (p.sn,))
+                if p.thumb is not None:
+                    t = p.thumb
+                    self.conn.execute(
+                        'INSERT INTO thumbs (parent_sn, height, width, size, dc_id, version) VALUES (?, ?, ?, ?, ?, ?)',
+                        (p.sn, t.height, t.width, t.size, t.dc_id, t.version)
+                    )
+                self.conn.execute('DELETE FROM stickers WHERE parent_sn = ?', (p.sn,))
+                self.conn.executemany(
+                    'INSERT INTO stickers (parent_sn, position, doc_id, access_hash, mimetype, dc_id, fileref, '
+                    'filesize, filename, height, width, emojis, thumbs, outline) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(p.sn, i, s.doc_id, s.doc_access_hash, s.doc_mimetype, s.doc_dc_id, s.doc_fileref, s.filesize,
+                      s.filename, s.height, s.width, s.emojis, s.thumb_sizes, s.outline)
+                     for i, s in enumerate(p.stickers)]
+                )
+                self.conn.execute('DELETE FROM sticker_emojis WHERE parent_sn = ?', (p.sn,))
+                _index_emojis(self.conn, [(p.sn, s.doc_id, s.emojis) for s in p.stickers])
+
+    def load_packs(self, sns: list[str]) -> dict[str, tuple[sqlite3.Row, Union[sqlite3.Row, None], list[sqlite3.Row]]]:
+        """
+        Reads packs from the database. Packs that aren't in the database are left out of the result
+        :param sns: The shortnames of the packs to read
+        :return: A dict of shortname to (pack row, thumb row or None, sticker rows in pack order)
+        """
+        res: dict[str, tuple[sqlite3.Row, Union[sqlite3.Row, None], list[sqlite3.Row]]] = {}
+        for chunk in _chunks(sns, 500):  # Stay under SQLite's limit on the number of query parameters
+            marks: str = ', '.join('?' * len(chunk))
+            for r in self.conn.execute(f'SELECT * FROM packs WHERE sn IN ({marks})', chunk):
+                res[r['sn']] = (r, None, [])
+            for r in self.conn.execute(f'SELECT * FROM thumbs WHERE parent_sn IN ({marks})', chunk):
+                res[r['parent_sn']] = (res[r['parent_sn']][0], r, res[r['parent_sn']][2])
+            for r in self.conn.execute(f'SELECT * FROM stickers WHERE parent_sn IN ({marks}) '
+                                       f'ORDER BY parent_sn, position', chunk):
+                res[r['parent_sn']][2].append(r)
+        return res
+
+    def list_packs(self) -> list[str]:
+        """
+        Gets the shortnames of every pack in the database
+        :return: A list of shortnames
+        """
+        return [r[0] for r in self.conn.execute('SELECT sn FROM packs ORDER BY sn')]
+
+    def get_tiers(self, sns: list[str]) -> dict[str, Tier]:
+        """
+        Gets how much of each pack has been fetched. Packs that aren't in the database are left out of the result
+        :param sns: The shortnames of the packs
+        :return: A dict of shortname to tier
+        """
+        res: dict[str, Tier] = {}
+        for chunk in _chunks(sns, 500):
+            marks: str = ', '.join('?' * len(chunk))
+            for r in self.conn.execute(f'SELECT sn, tier FROM packs WHERE sn IN ({marks})', chunk):
+                res[r[0]] = Tier(r[1])
+        return res
+
+    def set_tier(self, sn: str, tier: Tier):
+        """
+        Records how much of a pack has been fetched
+        :param sn: The shortname of the pack
+        :param tier: The tier the pack has been fetched to
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute('UPDATE packs SET tier = ? WHERE sn = ?', (int(tier), sn))
+
+    def cap_tiers(self, sns: Iterable[str], tier: Tier):
+        """
+        Lowers the recorded tier of packs that lost files, e.g. to cache eviction. Packs under the tier are unchanged
+        :param sns: The shortnames of the packs
+        :param tier: The highest tier the packs can still be at
+        :return: None
+        """
+        with self.conn:
+            self.conn.executemany('UPDATE packs SET tier = MIN(tier, ?) WHERE sn = ?', [(int(tier), sn) for sn in sns])
+
+    def get_thumb_stickers(self) -> dict[str, int]:
+        """
+        Gets the first sticker of every pack that doesn't have a thumbnail, which is shown as the pack thumbnail instead
+        :return: A dict of shortname to the document id of the first sticker
+        """
+        return {r[0]: r[1] for r in self.conn.execute(
+            'SELECT s.parent_sn, s.doc_id FROM stickers s LEFT JOIN thumbs t ON t.parent_sn = s.parent_sn '
+            'WHERE s.position = 0 AND t.parent_sn IS NULL')}
+
+    def delete_pack(self, sn: str):
+        """
+        Deletes a pack and its thumb and stickers from the database
+        :param sn: The shortname of the pack
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM packs WHERE sn = ?', (sn,))
+
+    # Emoji index
+
+    def find_emoji(self, emoji: str, user: str = None) -> list[sqlite3.Row]:
+        """
+        Finds every cached sticker tagged with an emoji
+        :param emoji: The emoji to look up
+        :param user: If not None, only stickers in packs owned by this local user are returned
+        :return: The sticker rows of the matching stickers, in pack and sticker order
+        """
+        if user is None:
+            return self.conn.execute(
+                'SELECT s.* FROM sticker_emojis e JOIN stickers s ON s.parent_sn = e.parent_sn AND s.doc_id = e.doc_id '
+                'WHERE e.emoji = ? ORDER BY s.parent_sn, s.position', (utils.normalize_emoji(emoji),)).fetchall()
+        return self.conn.execute(
+            'SELECT s.* FROM sticker_emojis e JOIN stickers s ON s.parent_sn = e.parent_sn AND s.doc_id = e.doc_id '
+            'JOIN owned_packs o ON o.sn = e.parent_sn AND o.user = ? '
+            'WHERE e.emoji = ? ORDER BY o.position, s.position', (user, utils.normalize_emoji(emoji))).fetchall()
+
+    def list_emojis(self) -> list[tuple[str, int]]:
+        """
+        Lists every emoji in the index with the number of stickers tagged with it
+        :return: A list of (emoji, count), most used first
+        """
+        return [(r[0], r[1]) for r in self.conn.execute(
+            'SELECT emoji, COUNT(*) AS n FROM sticker_emojis GROUP BY emoji ORDER BY n DESC')]
+
+    # Cache access times
+
+    def get_access_times(self) -> dict[str, float]:
+        """
+        Gets the last recorded access time of every cached file
+        :return: A dict of file path to access time
+        """
+        return {r[0]: r[1] for r in self.conn.execute('SELECT path, atime FROM file_access')}
+
+    def set_access_times(self, times: Iterable[tuple[str, float]]):
+        """
+        Records the last access times of cached files
+        :param times: (file path, access time) pairs
+        :return: None
+        """
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO file_access (path, atime) VALUES (?, ?)', times)
+
+    def forget_access(self, paths: list[str]):
+        """
+        Removes the access times of files that were deleted
+        :param paths: The paths of the files
+        :return: None
+        """
+        with self.conn:
+            self.conn.executemany('DELETE FROM file_access WHERE path = ?', [(p,) for p in paths])
+
+    def forget_access_in(self, folders: list[str]):
+        """
+        Removes the access times of every file in folders that were deleted
+        :param folders: The paths of the folders, ending with a separator
+        :return: None
+        """
+        with self.conn:
+            self.conn.executemany('DELETE FROM file_access WHERE substr(path, 1, ?) = ?',
+                                  [(len(f), f) for f in folders])
+
+    # Owned packs
+
+    def get_owned(self, user: str) -> list[str]:
+        """
+        Gets the list of packs a user owns
+        :param user: The local name of the user
+        :return: The shortnames of the owned packs in order. Empty if the list was never saved
+        """
+        return [r[0] for r in self.conn.execute('SELECT sn FROM owned_packs WHERE user = ? ORDER BY position', (user,))]
+
+    def set_owned(self, user: str, sns: list[str]):
+        """
+        Replaces the list of packs a user owns
+        :param user: The local name of the user
+        :param sns: The shortnames of the owned packs in order
+        :return: None
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM owned_packs WHERE user = ?', (user,))
+            self.conn.executemany('INSERT INTO owned_packs (user, position, sn) VALUES (?, ?, ?)',
+                                  [(user, i, sn) for i, sn in enumerate(sns)])
+
+
+def _add_emoji_index(conn: sqlite3.Connection):
+    """
+    Migration that creates the emoji index and fills it from the stickers that are already saved
+    :param conn: The database connection
+    :return: None
+    """
+    conn.execute('''
+        CREATE TABLE sticker_emojis (
+            emoji     TEXT NOT NULL,
+            parent_sn TEXT NOT NULL REFERENCES packs(sn) ON DELETE CASCADE,
+            doc_id    INTEGER NOT NULL,
+            PRIMARY KEY (emoji, parent_sn, doc_id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX sticker_emojis_pack ON sticker_emojis(parent_sn)')
+    _index_emojis(conn, conn.execute('SELECT parent_sn, doc_id, emojis FROM stickers').fetchall())
+
+
+def _index_emojis(conn: sqlite3.Connection, stickers: Iterable[tuple[str, int, str]]):
+    """
+    Adds stickers to the emoji index
+    :param conn: The database connection
+    :param stickers: (pack shortname, doc_id, emojis) of each sticker to add
+    :return: None
+    """
+    conn.executemany(
+        'INSERT OR IGNORE INTO sticker_emojis (emoji, parent_sn, doc_id) VALUES (?, ?, ?)',
+        [(utils.normalize_emoji(e), sn, doc_id) for sn, doc_id, emojis in stickers for e in utils.split_emojis(emojis)]
+    )
+
+
+def _chunks(lst: list, n: int) -> list[list]:
+    """
+    Splits a list into lists of at most n elements
+    :param lst: The list to split
+    :param n: The maximum size of each chunk
+    :return: The list of chunks
+    """
+    return [lst[i:i + n] for i in range(0, len(lst), n)]
+
+
+# The metadata database for the program
+store: MetaStore = MetaStore(utils.check_path(gvars.CACHEPATH) + gvars.DB_FNAME)
@@ -1,15 +1,24 @@
 import asyncio
 import copy
+import json
 import os
-from typing import Union
+from collections import deque
+from typing import Awaitable, Callable, Union
 
 from logging import debug, info, warning, error, critical
+from telethon import events
 from telethon.tl.types import Document, InputDocumentFileLocation, InputStickerSetShortName, TypeInputFile, Message, \
-    ReplyKeyboardHide
+    ReplyKeyboardHide, TypeInputFileLocation
 from telethon.tl.types.messages import StickerSet
 from telethon.tl.functions.messages import GetStickerSetRequest
 
 from src import gvars, utils
+from src.Tg import manifest, scheduler, uploads
+
+
+# The size of each GetFile request of a resumable download. It divides 1MB, so requests that start at a multiple of it
+# never cross a megabyte boundary, which GetFile doesn't allow
+_PART_SIZE: int = 128 * 1024
 
 
 class DocName:
@@ -71,33 +80,129 @@ async def send_sb(inpt: Union[str, Document, TypeInputFile]) -> Message:
         return await gvars.client.send_file(entity=gvars.STICKERBOT, file=inpt, force_document=True)
 
 
-async def upload_file(path: str) -> TypeInputFile:
+def upload_callback(progress: uploads.UploadProgress):
+    """
+    Logs the progress of uploads. Can be passed as the callback of upload_file and upload_files
+    :param progress: The progress of the uploads
+    :return: None
+    """
+    debug(f'Uploaded {progress.bytes_sent} / {progress.total} bytes ({progress.files_done} / {len(progress.sizes)} '
+          f'files) at {progress.rate() / 1024:.0f} KB/s, {progress.path}: {progress.file_fraction():.0%}')
+
+
+async def upload_file(path: str, callback: Callable[[uploads.UploadProgress], None] = None) -> TypeInputFile:
     """
-    Uploads a file to Telegram but does not send it.
+    Uploads a file to Telegram but does not send it. The parts of the file are sent in parallel
     :param path: The path of the file on the local system
+    :param callback: Called with the progress every time a part is sent (Default is None, if None then no callback)
     :return: The Input Location of the file on Telegram's servers
     """
-    if not os.path.exists(path):
-        critical(f'Could not find file at {path}, program cannot continue')
-        raise Exception("File does not exist")
     info(f'Uploading file from {path}')
-    return await gvars.client.upload_file(path)
+    return await uploads.uploader.upload(path, callback)
+
+
+async def upload_files(paths: list[str], callback: Callable[[uploads.UploadProgress], None] = upload_callback) \
+        -> list[TypeInputFile]:
+    """
+    Uploads a group of files to Telegram but does not send them, several at a time. Use this for bulk sticker creation
+    :param paths: The paths of the files on the local system
+    :param callback: Called with the progress of the whole group every time a part of a file is sent (Default is
+    upload_callback, which logs the progress)
+    :return: The Input Locations of the files on Telegram's servers, in the same order as the paths
+    """
+    return await uploads.uploader.upload_all(paths, callback)
+
+
+class _ReplyWaiter:
+    """
+    Waits for messages from Sticker bot using pushed NewMessage updates instead of polling the chat history
+    """
+    def __init__(self):
+        """
+        Instantiates a _ReplyWaiter object. The event handler is only added to the client once install() is called
+        """
+        self.installed: bool = False
+        self._waiting: list[tuple[int, Callable[[Message], bool], asyncio.Future]] = []
+        self._recent: deque[Message] = deque(maxlen=16)  # Replies that can arrive before send_message returns
 
+    def install(self):
+        """
+        Adds the NewMessage handler for Sticker bot to the client if it hasn't been added already
+        :return: None
+        """
+        if self.installed: return
+        debug('Adding NewMessage event handler for stickerbot replies')
+        gvars.client.add_event_handler(self.__on_message, events.NewMessage(chats=gvars.STICKERBOT, incoming=True))
+        self.installed = True
 
-async def upload_callback(sent_bytes: int, total_bytes: int):
-    # TODO: Write Method
-    # TODO: Write Docstring
-    print(str(sent_bytes) + ' / ' + str(total_bytes))
+    async def __on_message(self, event: events.NewMessage.Event):
+        """
+        Hands a new message from Sticker bot to the oldest waiter that accepts it
+        :param event: The NewMessage event from Telegram
+        :return: None
+        """
+        msg: Message = event.message
+        debug(f'Received message {msg.id} from stickerbot')
+        self._recent.append(msg)
+        for w in sorted(self._waiting, key=lambda x: x[0]):
+            after_id, predicate, fut = w
+            if msg.id > after_id and not fut.done() and predicate(msg):
+                fut.set_result(msg)
+                return
+
+    async def wait(self, after_id: int, predicate: Callable[[Message], bool] = lambda m: True,
+                   timeout: float = gvars.SB_REPLY_TIMEOUT) -> Message:
+        """
+        Waits for the next message from Sticker bot after a message
+        :param after_id: The ID of the message to wait for a reply to (usually the message we sent)
+        :param predicate: A function that returns whether a message is the one being waited for
+        :param timeout: The amount of time to wait before giving up (seconds)
+        :return: The message received
+        :raises asyncio.TimeoutError: If no matching message arrives in time
+        """
+        for m in self._recent:
+            if m.id > after_id and predicate(m): return m
+        fut: asyncio.Future = asyncio.get_event_loop().create_future()
+        w = (after_id, predicate, fut)
+        self._waiting.append(w)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            error(f'No reply from stickerbot after message {after_id} within {timeout} seconds')
+            raise
+        finally:
+            self._waiting.remove(w)
+
+
+reply_waiter: _ReplyWaiter = _ReplyWaiter()
+
+
+async def send_sb_await_reply(inpt: Union[str, Document, TypeInputFile],
+                              timeout: float = gvars.SB_REPLY_TIMEOUT) -> Message:
+    """
+    Sends whatever is input to Sticker bot and waits for its reply
+    :param inpt: The input to send to Sticker bot
+    :param timeout: The amount of time to wait for the reply (seconds)
+    :return: The Message that Sticker bot replied with
+    """
+    reply_waiter.install()
+    sent: Message = await send_sb(inpt)
+    return await reply_waiter.wait(sent.id, timeout=timeout)
 
 
-async def await_next_msg_id(current_id: int, user: str, delay: float = 0.1) -> Message:
+async def await_next_msg_id(current_id: int, user: str, delay: float = 0.1,
+                            timeout: float = gvars.SB_REPLY_TIMEOUT) -> Message:
     """
     Waits for the next message and then continues
     :param current_id: The ID of the current message
     :param user: The name (not nickname) of the chat you want to search
-    :param delay: The amount of time to wait between checking (seconds)
+    :param delay: The amount of time to wait between checking (seconds), only used for chats other than Sticker bot
+    :param timeout: The amount of time to wait for a Sticker bot reply (seconds)
     :return: The new message received
     """
+    if user == gvars.STICKERBOT:
+        reply_waiter.install()
+        return await reply_waiter.wait(current_id, timeout=timeout)
     while True:
         msg: Message = await gvars.client.iter_messages(entity=user).__anext__()
         if msg.id != current_id: return msg
@@ -105,17 +210,24 @@ async def await_next_msg_id(current_id: int, user: str, delay: float = 0.1) -> M
         await asyncio.sleep(delay)
 
 
-async def await_next_msg_str(target_str: str, user: str, delay: float = 0.1) -> Message:
+async def await_next_msg_str(target_str: str, user: str, after_id: int, delay: float = 0.1,
+                             timeout: float = gvars.SB_REPLY_TIMEOUT) -> Message:
     """
     Waits for a message to show with certain message contents
     :param target_str: The target message contents to search for
     :param user: The name (not nickname) of the chat you want to search
-    :param delay: The amount of time to wait between checking (seconds)
+    :param after_id: The ID of the message to wait for a reply to (usually the message we sent). Older messages with the
+    same contents are ignored
+    :param delay: The amount of time to wait between checking (seconds), only used for chats other than Sticker bot
+    :param timeout: The amount of time to wait for a Sticker bot reply (seconds)
     :return: The new message received
     """
+    if user == gvars.STICKERBOT:
+        reply_waiter.install()
+        return await reply_waiter.wait(after_id, lambda m: m.message == target_str, timeout)
     while True:
         msg: Message = await gvars.client.iter_messages(entity=user).__anext__()
-        if msg.message == target_str: return msg
+        if msg.id > after_id and msg.message == target_str: return msg
         debug(f"Target message not found. Waiting for {delay} seconds...")
         await asyncio.sleep(delay)
 
@@ -135,18 +247,93 @@ def get_document_loc(doc: Document) -> InputDocumentFileLocation:
     )
 
 
-async def download_doc(doc: InputDocumentFileLocation,  meta: DocName, path: str, fname_is_id: bool):
+async def download_resumable(loc: TypeInputFileLocation, fpath: str, size: int = None) -> str:
+    """
+    Downloads a file from Telegram to the local device. The file is written to <fpath>.part and a small journal
+    (<fpath>.journal) records how much of it was written, so a download that was interrupted (network errors, the app
+    quitting, cancellation) continues from where it stopped the next time. The file is only renamed to fpath once it's
+    complete, so the file at fpath is never partial
+    :param loc: The location of the file on Telegram's servers
+    :param fpath: The path to save the file to
+    :param size: The expected size of the file in bytes (Default is None, if None then the size isn't checked)
+    :return: The path the file was saved to
+    """
+    part, journal = fpath + '.part', fpath + '.journal'
+    offset: int = _resume_offset(part, journal, size)
+    if offset > 0: info(f'Resuming download of {fpath} from byte {offset}')
+    with open(part, 'r+b' if offset > 0 else 'wb') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        _write_journal(journal, offset, size)
+        async for chunk in gvars.client.iter_download(loc, offset=offset, request_size=_PART_SIZE, file_size=size):
+            f.write(chunk)
+            f.flush()
+            offset += len(chunk)
+            _write_journal(journal, offset, size)
+    if size is not None and offset != size:
+        for p in (part, journal): os.remove(p)  # Start over next time, resuming a file that doesn't add up won't help
+        raise Exception(f'Downloaded {offset} bytes of {fpath}, expected {size}')
+    os.replace(part, fpath)
+    os.remove(journal)
+    return fpath
+
+
+def _resume_offset(part: str, journal: str, size: Union[int, None]) -> int:
+    """
+    Finds where an interrupted download can continue from
+    :param part: The path of the partial file
+    :param journal: The path of the journal of the download
+    :param size: The expected size of the file in bytes
+    :return: The offset to continue from, a multiple of _PART_SIZE. 0 if the download has to start over
+    """
+    try:
+        with open(journal, 'r') as f:
+            entry: dict = json.load(f)
+        written: int = os.path.getsize(part)
+    except (OSError, ValueError):
+        return 0
+    if not isinstance(entry, dict) or entry.get('size') != size: return 0  # The journal of another version of the file
+    offset: int = min(int(entry.get('offset', 0)), written)  # The journal can be ahead of a write that was lost
+    return offset - offset % _PART_SIZE
+
+
+def _write_journal(journal: str, offset: int, size: Union[int, None]):
+    """
+    Records how far a download got
+    :param journal: The path of the journal of the download
+    :param offset: The number of bytes written to the partial file
+    :param size: The expected size of the file in bytes
+    :return: None
+    """
+    with open(journal, 'w') as f:
+        json.dump({'offset': offset, 'size': size}, f)
+
+
+async def download_doc(doc: InputDocumentFileLocation,  meta: DocName, path: str, fname_is_id: bool,
+                       preview: str = None, size: int = None) -> str:
     """
     Downloads a Telegram document to the local device
     :param doc: The File location on Telegram's servers
     :param meta: The DocName metadata
     :param path: The folder on the local device to save to
     :param fname_is_id: Whether or not to set the local filename to the document id
-    :return: None
+    :param preview: The type of a server side thumbnail of the document to download instead of the document itself
+    (e.g. 'm'). Previews are saved as <filename>_<type>.webp, since sticker previews are WebP images (Default is None,
+    if None then the document itself is downloaded)
+    :param size: The size of the document in bytes, to check the download against. Not used for previews (Default is
+    None, if None then the size isn't checked)
+    :return: The path the document was saved to
     """
     filename: str = str(doc.id) if fname_is_id else meta.filename()
-    info(f'Downloading Telegram document with id: {doc.id} to path: {path}{filename}.{meta.ext()}')
-    await asyncio.create_task(gvars.client.download_file(doc, utils.check_path(path) + filename + '.' + meta.ext()))
+    ext: str = meta.ext()
+    if preview is not None:
+        doc = InputDocumentFileLocation(doc.id, doc.access_hash, doc.file_reference, preview)
+        filename, ext, size = filename + '_' + preview, 'webp', None
+    info(f'Downloading Telegram document with id: {doc.id} to path: {path}{filename}.{ext}')
+    fpath: str = utils.check_path(path) + filename + '.' + ext
+    await download_resumable(doc, fpath, size)
+    manifest.manifest.add(fpath)
+    return fpath
 
 
 async def download_doc_nloc(doc: Document, path: str, fname_is_id: bool):
@@ -161,45 +348,95 @@ async def download_doc_nloc(doc: Document, path: str, fname_is_id: bool):
         get_document_loc(doc),
         derive_docname(doc),
         path,
-        fname_is_id
+        fname_is_id,
+        size=doc.size
     )
 
 
-# TODO Restrict number of concurrent downloads
-async def download_doclist(doc_arr: list[InputDocumentFileLocation], meta_arr: list[DocName],
-                           path: str, fname_is_id: bool):
+def schedule_doclist(doc_arr: list[InputDocumentFileLocation], meta_arr: list[DocName], path: str,
+                     fname_is_id: bool, dc_arr: list[int] = None,
+                     priority: scheduler.Priority = scheduler.Priority.INTERACTIVE,
+                     batch: scheduler.DownloadBatch = None,
+                     postprocess: Callable[[str], Awaitable] = None,
+                     preview_arr: list[Union[str, None]] = None,
+                     size_arr: list[int] = None) -> scheduler.DownloadBatch:
     """
-    Downloads a list of Documents to the local device
+    Queues a list of Documents for download on the download scheduler without waiting for them
     :param doc_arr: The list of File Locations on Telegram's Servers
     :param meta_arr: A list of DocName metadata corresponding to the File Locations in doc_arr
     :param path: The path on the local system to download to
     :param fname_is_id: Whether or not to set the local filename to the document id
-    :return: None
+    :param dc_arr: A list of the DC IDs the documents are stored on (Default is None, if None then DC 0 is assumed)
+    :param priority: The priority of the downloads
+    :param batch: The batch to add the downloads to (Default is None, if None then a new batch is created)
+    :param postprocess: A coroutine function run on the path of each file after it downloads, as part of the download.
+    Not run on previews
+    :param preview_arr: The type of the server side thumbnail to download instead of each document, None for the
+    documents themselves (Default is None, if None then every document is downloaded itself). See download_doc
+    :param size_arr: A list of the sizes of the documents in bytes (Default is None, if None then sizes aren't checked)
+    :return: The DownloadBatch that the downloads were added to, which can be awaited or cancelled
     """
-    tasklst: list[asyncio.Task] = []
     utils.check_path(path)
+    batch = scheduler.scheduler.batch() if batch is None else batch
 
-    for i in range(0, len(doc_arr)):
-        tsk: asyncio.Task = asyncio.create_task(download_doc(doc_arr[i], meta_arr[i], path, fname_is_id))
-        debug("Began download document " + str(i) + '\n' + str(doc_arr[i].id))
-        tasklst.append(tsk)
+    async def download(d: InputDocumentFileLocation, m: DocName, pv: Union[str, None], sz: Union[int, None]) -> str:
+        fpath: str = await download_doc(d, m, path, fname_is_id, pv, sz)
+        if postprocess is not None and pv is None: await postprocess(fpath)
+        return fpath
 
-    j: int = 0
-    for t in tasklst:
-        await t
-        j += 1
+    for i in range(0, len(doc_arr)):
+        scheduler.scheduler.submit(
+            lambda d=doc_arr[i], m=meta_arr[i], pv=None if preview_arr is None else preview_arr[i],
+            sz=None if size_arr is None else size_arr[i]: download(d, m, pv, sz),
+            0 if dc_arr is None else dc_arr[i],
+            priority,
+            batch
+        )
+        debug("Queued download of document " + str(i) + '\n' + str(doc_arr[i].id))
+    return batch
 
 
-async def download_doclist_nloc(doc_arr: list[Document], path: str, fname_is_id: bool):
+async def download_doclist(doc_arr: list[InputDocumentFileLocation], meta_arr: list[DocName],
+                           path: str, fname_is_id: bool, dc_arr: list[int] = None,
+                           priority: scheduler.Priority = scheduler.Priority.INTERACTIVE,
+                           postprocess: Callable[[str], Awaitable] = None,
+                           preview_arr: list[Union[str, None]] = None, size_arr: list[int] = None):
+    """
+    Downloads a list of Documents to the local device
+    :param doc_arr: The list of File Locations on Telegram's Servers
+    :param meta_arr: A list of DocName metadata corresponding to the File Locations in doc_arr
+    :param path: The path on the local system to download to
+    :param fname_is_id: Whether or not to set the local filename to the document id
+    :param dc_arr: A list of the DC IDs the documents are stored on (Default is None, if None then DC 0 is assumed)
+    :param priority: The priority of the downloads
+    :param postprocess: A coroutine function run on the path of each file after it downloads (not run on previews)
+    :param preview_arr: The type of the server side thumbnail to download instead of each document, None for the
+    documents themselves (Default is None, if None then every document is downloaded itself)
+    :param size_arr: A list of the sizes of the documents in bytes (Default is None, if None then sizes aren't checked)
+    :return: None
+    """
+    batch: scheduler.DownloadBatch = schedule_doclist(doc_arr, meta_arr, path, fname_is_id, dc_arr, priority,
+                                                      postprocess=postprocess, preview_arr=preview_arr,
+                                                      size_arr=size_arr)
+    try:
+        await batch.wait()
+    except asyncio.CancelledError:
+        batch.cancel()
+        raise
+
+
+async def download_doclist_nloc(doc_arr: list[Document], path: str, fname_is_id: bool,
+                                priority: scheduler.Priority = scheduler.Priority.INTERACTIVE):
     """
     Downloads a list of Documents to the local device without using the File Locations
     :param doc_arr: The list of Documents to download
     :param path: The path on the local system to download to
     :param fname_is_id: Whether or not to set the local file to the document id
+    :param priority: The priority of the downloads
     :return: None
     """
     await download_doclist([get_document_loc(d) for d in doc_arr], [derive_docname(d) for d in doc_arr],
-                           path, fname_is_id)
+                           path, fname_is_id, [d.dc_id for d in doc_arr], priority, size_arr=[d.size for d in doc_arr])
 
 
 async def get_stickerset(short: str) -> StickerSet:
@@ -222,21 +459,23 @@ async def get_owned_stickerset_shortnames() -> list[str]:
     Works by messaging @Stickers to add a sticker to a pack and looking at the reply keyboard that the bot returns
     :return: A list of strings that contains the shortnames of all the packs
     """
-    delay: float = 0.1
     info('Checking what stickersets are owned by the current user')
-    debug(f'running src.Tg.tgapi.get_owned_stickerset_shortnames with delay {delay}')
-    cmsg = await send_sb("/cancel")
-    await await_next_msg_id(cmsg.id, gvars.STICKERBOT)
-    cmsg = await send_sb("/addsticker")
-    # TODO add logs
-    msg: Message = await await_next_msg_id(cmsg.id, gvars.STICKERBOT)
-    sets: list[str] = []
-    print(msg.stringify())
-    if msg.reply_markup is None or isinstance(msg.reply_markup, ReplyKeyboardHide) \
-            or msg.reply_markup.rows is None or len(msg.reply_markup.rows) == 0:
-        return sets
-    for r in msg.reply_markup.rows:
-        for b in r.buttons:
-            sets.append(b.text)
-    await send_sb("/cancel")
+    await send_sb_await_reply(gvars.SB_CANCEL)
+    msg: Message = await send_sb_await_reply(gvars.SB_ADD)
+    debug(msg.stringify())
+    sets: list[str] = reply_buttons(msg)
+    if len(sets) == 0: return sets
+    await send_sb(gvars.SB_CANCEL)
     return sets
+
+
+def reply_buttons(msg: Message) -> list[str]:
+    """
+    Gets the choices on the reply keyboard of a message (e.g. the packs Sticker bot asks to choose from)
+    :param msg: The message
+    :return: The text of every button on the keyboard, empty if the message doesn't have one
+    """
+    if msg.reply_markup is None or isinstance(msg.reply_markup, ReplyKeyboardHide) \
+            or getattr(msg.reply_markup, 'rows', None) is None:
+        return []
+    return [b.text for r in msg.reply_markup.rows for b in r.buttons]
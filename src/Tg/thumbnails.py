@@ -0,0 +1,63 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from logging import debug, info, warning, error, critical
+from typing import Union
+
+from src import gvars, imaging
+from src.Tg import manifest
+
+
+_pool: Union[ProcessPoolExecutor, None] = None
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    Gets the process pool that images are scaled in, creating it the first time it's needed. The workers are spawned
+    rather than forked, since forking a process that already runs Qt, sqlite and executor threads can deadlock. They
+    only import src.imaging, which doesn't need anything from this process
+    :return: The process pool
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2),
+                                    mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def get_thumb_path(path: str, size: int = gvars.GRID_THUMB_SIZE) -> str:
+    """
+    Gets the path that the scaled down copy of an image is saved to
+    :param path: The path of the original image
+    :param size: The size the image is scaled to
+    :return: The path of the scaled copy
+    """
+    return os.path.splitext(path)[0] + f'_{size}.webp'
+
+
+def can_thumbnail(path: str) -> bool:
+    """
+    Checks if an image can be scaled down. Animated (tgs) stickers are Lottie files and can't be
+    :param path: The path of the image
+    :return: Whether the image can be scaled down
+    """
+    return path.endswith('.webp') or path.endswith('.png')
+
+
+async def make_thumbnail(path: str, size: int = gvars.GRID_THUMB_SIZE) -> Union[str, None]:
+    """
+    Scales a cached image down to the grid cell size in the process pool and saves it next to the original
+    :param path: The path of the original image
+    :param size: The size to scale the image down to (px)
+    :return: The path of the scaled copy, or None if it couldn't be made
+    """
+    if not can_thumbnail(path): return None
+    dst: str = get_thumb_path(path, size)
+    debug(f'Scaling {path} to {size}px')
+    ok: bool = await asyncio.get_event_loop().run_in_executor(get_pool(), imaging.scale_image, path, dst, size)
+    if not ok:
+        warning(f'Could not scale {path}')
+        return None
+    manifest.manifest.add(dst)
+    return dst
@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import os
+import random
+import time
+from logging import debug, info, warning, error, critical
+from typing import Callable, Union
+
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig, TypeInputFile
+from telethon.utils import get_appropriated_part_size
+
+from src import gvars
+
+
+# Files bigger than this have to be uploaded with SaveBigFilePart (and are sent as InputFileBig)
+_BIG_FILE_SIZE: int = 10 * 1024 * 1024
+
+
+class UploadProgress:
+    """
+    The progress of a group of uploads, passed to the progress callback every time a part of a file is sent
+    """
+    def __init__(self, sizes: dict[str, int]):
+        """
+        Instantiates an UploadProgress object
+        :param sizes: The size in bytes of every file in the group, by path
+        """
+        self.sizes: dict[str, int] = sizes
+        self.sent: dict[str, int] = {p: 0 for p in sizes}
+        self.total: int = sum(sizes.values())
+        self.bytes_sent: int = 0
+        self.files_done: int = 0
+        self._done: set[str] = set()  # The files counted in files_done
+        self.path: str = ''  # The file the last part that was sent belongs to
+        self.started: float = time.monotonic()
+
+    def add(self, path: str, nbytes: int):
+        """
+        Records that a part of a file was sent
+        :param path: The path of the file
+        :param nbytes: The size of the part in bytes
+        :return: None
+        """
+        self.path = path
+        self.sent[path] += nbytes
+        self.bytes_sent += nbytes
+        if self.sent[path] >= self.sizes[path]: self.finish(path)
+
+    def finish(self, path: str) -> bool:
+        """
+        Records that every part of a file was sent. Counts the file in files_done if it isn't counted yet, which is how
+        empty files get counted
+        :param path: The path of the file
+        :return: Whether the file wasn't counted before
+        """
+        if path in self._done: return False
+        self._done.add(path)
+        self.files_done += 1
+        return True
+
+    def file_fraction(self, path: str = None) -> float:
+        """
+        Gets how much of a file has been sent
+        :param path: The path of the file (Default is None, if None then the file the last part belonged to)
+        :return: The fraction of the file that was sent, from 0 to 1
+        """
+        path = self.path if path is None else path
+        return 1.0 if self.sizes.get(path, 0) == 0 else self.sent[path] / self.sizes[path]
+
+    def fraction(self) -> float:
+        """
+        Gets how much of the whole group has been sent
+        :return: The fraction of the bytes of every file that were sent, from 0 to 1
+        """
+        return 1.0 if self.total == 0 else self.bytes_sent / self.total
+
+    def rate(self) -> float:
+        """
+        Gets the average upload speed of the group so far
+        :return: The speed in bytes per second
+        """
+        elapsed: float = time.monotonic() - self.started
+        return 0.0 if elapsed <= 0 else self.bytes_sent / elapsed
+
+
+class Uploader:
+    """
+    Uploads files to Telegram without sending them. Several files are uploaded at once, and the parts of each file are
+    sent as concurrent SaveFilePart (or SaveBigFilePart) requests instead of one after another
+    """
+    def __init__(self, max_concurrent: int, max_parts: int):
+        """
+        Instantiates an Uploader object
+        :param max_concurrent: The maximum number of files uploaded at the same time
+        :param max_parts: The maximum number of parts of a single file sent at the same time
+        """
+        self.max_concurrent: int = max_concurrent
+        self.max_parts: int = max_parts
+        self._files: Union[asyncio.Semaphore, None] = None  # Made on first use, so it belongs to the running loop
+
+    async def upload(self, path: str, callback: Callable[[UploadProgress], None] = None) -> TypeInputFile:
+        """
+        Uploads a single file
+        :param path: The path of the file on the local system
+        :param callback: Called with the progress every time a part is sent (Default is None, if None then no callback)
+        :return: The Input Location of the file on Telegram's servers
+        """
+        return (await self.upload_all([path], callback))[0]
+
+    async def upload_all(self, paths: list[str],
+                         callback: Callable[[UploadProgress], None] = None) -> list[TypeInputFile]:
+        """
+        Uploads a group of files, up to max_concurrent at once
+        :param paths: The paths of the files on the local system
+        :param callback: Called with the progress of the whole group every time a part of any of the files is sent
+        (Default is None, if None then no callback)
+        :return: The Input Locations of the files on Telegram's servers, in the same order as the paths
+        """
+        for p in paths:
+            if not os.path.exists(p):
+                critical(f'Could not find file at {p}, program cannot continue')
+                raise Exception("File does not exist")
+        if self._files is None: self._files = asyncio.Semaphore(self.max_concurrent)
+        progress: UploadProgress = UploadProgress({p: os.path.getsize(p) for p in paths})
+        info(f'Uploading {len(paths)} files ({progress.total} bytes)')
+        results: list[TypeInputFile] = await asyncio.gather(*[self.__upload(p, progress, callback) for p in paths])
+        info(f'Uploaded {len(paths)} files at {progress.rate() / 1024:.0f} KB/s')
+        return results
+
+    async def __upload(self, path: str, progress: UploadProgress,
+                       callback: Union[Callable[[UploadProgress], None], None]) -> TypeInputFile:
+        """
+        Uploads a file, sending up to max_parts of its parts at once
+        :param path: The path of the file
+        :param progress: The progress of the group the file is in
+        :param callback: The progress callback
+        :return: The Input Location of the file
+        """
+        async with self._files:
+            with open(path, 'rb') as f:
+                data: bytes = f.read()
+            part_size: int = get_appropriated_part_size(len(data)) * 1024
+            parts: int = max(1, (len(data) + part_size - 1) // part_size)
+            big: bool = len(data) > _BIG_FILE_SIZE
+            file_id: int = random.randrange(-2 ** 63, 2 ** 63)
+            debug(f'Uploading {path} as {parts} parts of {part_size} bytes')
+            limit: asyncio.Semaphore = asyncio.Semaphore(self.max_parts)
+
+            async def send(i: int):
+                chunk: bytes = data[i * part_size:(i + 1) * part_size]
+                async with limit:
+                    ok: bool = await gvars.client(SaveBigFilePartRequest(file_id, i, parts, chunk) if big else
+                                                  SaveFilePartRequest(file_id, i, chunk))
+                if not ok: raise Exception(f'Telegram did not save part {i} of {path}')
+                progress.add(path, len(chunk))
+                if callback is not None: callback(progress)
+
+            tasks: list[asyncio.Task] = [asyncio.ensure_future(send(i)) for i in range(parts)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for t in tasks: t.cancel()
+                raise
+            if progress.finish(path) and callback is not None: callback(progress)
+            name: str = os.path.basename(path)
+            if big: return InputFileBig(file_id, parts, name)
+            return InputFile(file_id, parts, name, hashlib.md5(data).hexdigest())
+
+
+# The uploader that all Telegram uploads go through
+uploader: Uploader = Uploader(gvars.MAX_CONCURRENT_UPLOADS, gvars.MAX_PARTS_PER_UPLOAD)
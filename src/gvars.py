@@ -15,6 +15,35 @@ api_hash: str = apikeys.api_hash
 # Constants
 CURRENT_USER: str = 'user'
 PACKS_FNAME: str = 'packs.json'
+DB_FNAME: str = 'metadata.db'
+SB_CHECKPOINT_FNAME: str = 'sb_queue.json'  # Sticker bot operations that haven't finished, see commands.py
+
+# Download limits
+MAX_CONCURRENT_DOWNLOADS: int = 8  # Downloads running at once across all DCs
+MAX_DOWNLOADS_PER_DC: int = 4  # Downloads running at once on a single DC
+PACK_LOAD_WIDTH: int = 4  # Sticker packs loaded at once by stickers.get_packs
+PREFETCH_PACKS: bool = False  # Download the stickers of every owned pack in the background after the home page loads
+PREFETCH_BUDGET_FRACTION: float = 0.8  # Prefetching stops at this fraction of CACHE_BUDGET_BYTES, under what eviction
+# trims the cache to, so that prefetched stickers aren't evicted right away
+
+# Upload limits
+MAX_CONCURRENT_UPLOADS: int = 4  # Files uploaded at once by uploads.Uploader
+MAX_PARTS_PER_UPLOAD: int = 4  # Parts of a single file sent at once
+
+# Size (px) that sticker images are scaled to for grid cells
+GRID_THUMB_SIZE: int = 80
+
+# Lazy image loading for grids
+GRID_PREFETCH_ROWS: int = 2  # Rows above and below the viewport whose images are loaded ahead of scrolling
+GRID_PIXMAP_BUDGET_BYTES: int = 64 * 1024 * 1024  # Off-screen images of a grid are released past this size
+PIXMAP_CACHE_BYTES: int = 128 * 1024 * 1024  # Decoded images shared between pages are evicted past this size
+
+# Navigation
+PAGE_CACHE_SIZE: int = 5  # Recently opened sticker pack pages kept alive for going back to them
+
+# Cache limits
+CACHE_BUDGET_BYTES: int = 512 * 1024 * 1024  # Least recently used sticker files are evicted past this size
+PARTIAL_MAX_AGE: float = 24 * 60 * 60  # Unfinished downloads untouched for this long (seconds) are deleted
 
 # Paths
 DATAPATH: str = 'tgsticker' + os.sep  # Root program data path
@@ -41,6 +70,9 @@ MIME: dict[str, str] = {
 
 # User handles
 STICKERBOT: str = 'Stickers'  # Sticker bot   : @Stickers
+SB_REPLY_TIMEOUT: float = 10.0  # Seconds to wait for a reply from Sticker bot
+SB_RETRIES: int = 2  # Times a Sticker bot operation is retried (after /cancel) before it is given up on
+SB_PIPELINE_DEPTH: int = 4  # Upcoming Sticker bot operations whose files are uploaded while the current one runs
 
 
 # Helper methods to get paths without long string concatenation garbage
@@ -88,3 +120,5 @@ SB_ORDER: str = '/ordersticker'         # Change Position of a Sticker in the Pa
 SB_SETICON: str = '/setpackicon'        # Change Icon of a Sticker Pack
 SB_DELETE: str = '/delsticker'          # Delete a Sticker in a Sticker Pack
 SB_CANCEL: str = '/cancel'              # Cancels existing operations
+SB_PUBLISH: str = '/publish'            # Publishes a new Sticker Pack
+SB_SKIP: str = '/skip'                  # Skips an optional step (e.g. the icon of a new Sticker Pack)
@@ -0,0 +1,23 @@
+# Functions in this module run in worker processes, so it must not import anything with side effects (like src.gvars)
+import os
+
+from PIL import Image
+
+
+def scale_image(src: str, dst: str, size: int) -> bool:
+    """
+    Scales an image down to fit in a square and saves it as WebP. The file is written under a temporary name and
+    renamed into place, so a half written file is never seen at dst
+    :param src: The path of the image to scale
+    :param dst: The path to save the scaled image to
+    :param size: The width and height of the square to fit the image in (px)
+    :return: Whether the image could be scaled
+    """
+    try:
+        with Image.open(src) as im:
+            im.thumbnail((size, size), Image.LANCZOS)
+            im.save(dst + '.tmp', 'WEBP', quality=90, method=4)
+        os.replace(dst + '.tmp', dst)
+        return True
+    except (OSError, ValueError):
+        return False
@@ -124,6 +124,55 @@ def get_attr_filename(f: Document, fallback: str = "") -> str:
     return attr.file_name
 
 
+def split_emojis(emojis: str) -> list[str]:
+    """
+    Splits a string of emojis into single emojis, keeping modifiers, variation selectors, keycaps, flags and ZWJ
+    sequences attached to the emoji they belong to
+    :param emojis: The string of emojis
+    :return: A list of the emojis in the string
+    """
+    res: list[str] = []
+    i: int = 0
+    while i < len(emojis):
+        j: int = i + 1
+        if 0x1F1E6 <= ord(emojis[i]) <= 0x1F1FF and j < len(emojis) and 0x1F1E6 <= ord(emojis[j]) <= 0x1F1FF:
+            j += 1  # Flags are pairs of regional indicators
+        else:
+            while j < len(emojis):
+                c: int = ord(emojis[j])
+                if c in (0xFE0E, 0xFE0F, 0x20E3) or 0x1F3FB <= c <= 0x1F3FF or 0xE0020 <= c <= 0xE007F:
+                    j += 1  # Variation selectors, keycaps, skin tones and tag sequences
+                elif c == 0x200D and j + 1 < len(emojis):
+                    j += 2  # Zero width joiner and the emoji it joins
+                else:
+                    break
+        res.append(emojis[i:j])
+        i = j
+    return res
+
+
+def is_emoji(emoji: str) -> bool:
+    """
+    Checks if a piece of a string split by split_emojis is an emoji, by the block its first character is in
+    :param emoji: The piece of the string
+    :return: Whether it is an emoji
+    """
+    if len(emoji) == 0: return False
+    if emoji[0] in '0123456789#*': return emoji.endswith('\u20e3')  # Keycaps
+    c: int = ord(emoji[0])
+    return 0x1F000 <= c <= 0x1FAFF or 0x2190 <= c <= 0x2BFF or \
+        c in (0x00A9, 0x00AE, 0x203C, 0x2049, 0x2122, 0x2139, 0x3030, 0x303D, 0x3297, 0x3299)
+
+
+def normalize_emoji(emoji: str) -> str:
+    """
+    Removes variation selectors from an emoji so that e.g. the text and emoji styles of ❤ are the same
+    :param emoji: The emoji to normalize
+    :return: The normalized emoji
+    """
+    return emoji.replace('\ufe0f', '').replace('\ufe0e', '')
+
+
 def setup_logging(level: int, console: bool, file: bool, path: str = None):
     hnd = []
     hnd.append(logging.StreamHandler(sys.stdout)) if console else None